@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark reading compressed daily logs
+
+Generates a synthetic daily log, stores it plain and compressed with gzip, xz,
+and zstd (if the zstandard package is available), and reports the throughput
+of scanning every line and of a full qhist query for each copy.
+"""
+
+import os, sys, argparse, datetime, gzip, lzma, shutil, statistics, tempfile, time
+
+my_root = os.path.dirname(os.path.realpath(__file__)).rsplit("/", 1)[0]
+sys.path.insert(0, f"{my_root}/src")
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from qhist import qhist
+from qhist.logs import open_log
+from generate_logs import generate_logs
+
+def compress(source, path, suffix):
+    if suffix == ".gz":
+        target = gzip.open(path, "wb", compresslevel = 6)
+    elif suffix == ".xz":
+        target = lzma.open(path, "wb", preset = 1)
+    else:
+        import zstandard
+        target = zstandard.ZstdCompressor(level = 3).stream_writer(open(path, "wb"))
+
+    with open(source, "rb") as log_file, target:
+        shutil.copyfileobj(log_file, target, 1 << 20)
+
+def time_call(function, repeat):
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+def scan(data_file):
+    with open_log(data_file) as log_file:
+        for line in log_file:
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark reading compressed logs")
+    parser.add_argument("-n", "--repeat",   help = "number of runs of each measurement", type = int, default = 3)
+    parser.add_argument("--jobs",           help = "jobs in the synthetic log", type = int, default = 20000)
+    args = parser.parse_args()
+
+    suffixes = ["", ".gz", ".xz"]
+
+    try:
+        import zstandard
+        suffixes.append(".zst")
+    except ImportError:
+        print("Note: zstandard is not installed, so .zst logs are not measured\n")
+
+    log_date = datetime.date(2025, 3, 31)
+    log_name = log_date.strftime("%Y%m%d")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        plain_file = os.path.join(temp_dir, "plain", log_name)
+        end_records = generate_logs(os.path.dirname(plain_file), log_date, 1, args.jobs)
+        plain_size = os.path.getsize(plain_file)
+
+        print("{:8} {:>10} {:>12} {:>14} {:>12}".format("Log", "Size (MB)", "Scan (s)", "Scan (MB/s)", "Query (s)"))
+
+        for suffix in suffixes:
+            log_path = os.path.join(temp_dir, suffix.lstrip(".") or "plain")
+            data_file = os.path.join(log_path, log_name + suffix)
+
+            if suffix:
+                os.mkdir(log_path)
+                compress(plain_file, data_file, suffix)
+
+            config = qhist.QhistConfig(time_format = "h")
+            config.pbs_log_path, config.pbs_log_start, config.cache_path = log_path, log_name, None
+            scan_time = time_call(lambda: scan(data_file), args.repeat)
+            query_time = time_call(lambda: list(qhist.query(period = log_name, config = config, use_server = False,
+                                                            attributes = ["id", "user", "Resource_List[ncpus]"])),
+                                   args.repeat)
+
+            print("{:8} {:>10.1f} {:>12.3f} {:>14.1f} {:>12.3f}".format(suffix or "plain", os.path.getsize(data_file) / 1e6,
+                  scan_time, plain_size / 1e6 / scan_time, query_time))
+
+    print("\n{} end records ({:.1f} MB uncompressed)".format(end_records, plain_size / 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Benchmark the memory used by parsed job records
+
+Parses the end records of the bundled test log repeatedly and reports the bytes
+held per job as full PbsRecords and as CompactRecords, both for fully parsed
+records and for lazy records built from the default table fields.
+"""
+
+import os, sys, argparse, gc, tracemalloc
+
+my_root = os.path.dirname(os.path.realpath(__file__)).rsplit("/", 1)[0]
+sys.path.insert(0, f"{my_root}/src")
+
+from pbsparse import PbsRecord
+from qhist import qhist
+from qhist.records import LazyRecord, CompactRecord, expand_fields
+
+testdata = os.path.join(my_root, "src", "qhist", "test", "testdata")
+
+def measure(build, lines):
+    gc.collect()
+    tracemalloc.start()
+    records = [build(line) for line in lines]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return size / len(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark memory used per job record")
+    parser.add_argument("-n", "--repeat", help = "number of copies of the test records", type = int, default = 2000)
+    args = parser.parse_args()
+
+    config = qhist.QhistConfig(time_format = "h")
+    fields = expand_fields(qhist.get_format_fields(config.table_format_data["default"]))
+
+    with open(testdata) as log_file:
+        lines = [line.rstrip("\n") for line in log_file if ";E;" in line] * args.repeat
+
+    # Lines are copied so that records do not share strings with the input
+    lines = [line[:20] + line[20:] for line in lines]
+
+    full = lambda line: PbsRecord(line, True, time_divisor = 3600.0)
+    lazy = lambda line: LazyRecord(line, True, 3600.0, fields = fields)
+
+    print("{:24} {:>16} {:>16} {:>8}".format("Records", "Before (B/job)", "After (B/job)", "Saving"))
+
+    for label, build in (("full", full), ("lazy (default format)", lazy)):
+        before = measure(build, lines)
+        after = measure(lambda line: CompactRecord(build(line)), lines)
+        print("{:24} {:>16.0f} {:>16.0f} {:>7.1f}x".format(label, before, after, before / after))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Benchmark rendering of table rows for the bundled test records
+
+Compares the per-row FillFormatter used previously against the precompiled
+RowRenderer, for each of the default table formats.
+"""
+
+import os, sys, argparse, time
+
+my_root = os.path.dirname(os.path.realpath(__file__)).rsplit("/", 1)[0]
+sys.path.insert(0, f"{my_root}/src")
+
+from pbsparse import PbsRecord
+from qhist import qhist
+
+testdata = os.path.join(my_root, "src", "qhist", "test", "testdata")
+
+def time_rows(render, rows, repeat):
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        for row in rows:
+            render(row)
+
+    return len(rows) * repeat / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark table row rendering")
+    parser.add_argument("-n", "--repeat", help = "number of passes over the test records", type = int, default = 5000)
+    args = parser.parse_args()
+
+    config = qhist.QhistConfig(time_format = "h")
+
+    with open(testdata) as log_file:
+        rows = [vars(PbsRecord(line, True, time_divisor = 3600.0)) for line in log_file]
+
+    print("{:16} {:>16} {:>16} {:>8}".format("Format", "Before (rows/s)", "After (rows/s)", "Speedup"))
+
+    for format_type in ("default", "wide", "default_status"):
+        table_format = config.table_format_data[format_type]
+        before = time_rows(lambda row: qhist.FillFormatter(fill_value = "-").format(table_format, **row), rows, args.repeat)
+        after = time_rows(qhist.RowRenderer(table_format), rows, args.repeat)
+        print("{:16} {:>16.0f} {:>16.0f} {:>7.1f}x".format(format_type, before, after, after / before))
+
+if __name__ == "__main__":
+    main()
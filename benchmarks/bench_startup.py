@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark the startup time of small qhist queries
+
+Runs a single-job query against a copy of the bundled test log many times and
+reports the median wall time next to that of the same query run by a baseline
+revision of qhist (extracted with git archive), and the time taken to start the
+interpreter and import pbsparse alone. Runs of each command are interleaved, so
+changes in machine load affect all of them alike.
+"""
+
+import os, sys, argparse, io, json, shutil, statistics, subprocess, tarfile, tempfile, time
+
+my_root = os.path.dirname(os.path.realpath(__file__)).rsplit("/", 1)[0]
+testdata = os.path.join(my_root, "src", "qhist", "test", "testdata")
+
+def get_first_commit():
+    commits = subprocess.run(["git", "rev-list", "--max-parents=0", "HEAD"], cwd = my_root, capture_output = True,
+                             text = True, check = True).stdout.split()
+    return commits[-1]
+
+def extract_revision(revision, dest_dir):
+    """Extract the files of a git revision of this repository, and return the path of its qhist command"""
+    archive = subprocess.run(["git", "archive", revision], cwd = my_root, capture_output = True, check = True).stdout
+
+    with tarfile.open(fileobj = io.BytesIO(archive)) as tar:
+        tar.extractall(dest_dir)
+
+    return os.path.join(dest_dir, "bin", "qhist")
+
+def time_commands(commands, env, repeat):
+    times = [[] for _ in commands]
+
+    for _ in range(repeat):
+        for command, command_times in zip(commands, times):
+            start = time.perf_counter()
+            subprocess.run(command, env = env, stdout = subprocess.DEVNULL, check = True)
+            command_times.append(time.perf_counter() - start)
+
+    return [statistics.median(command_times) for command_times in times]
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark qhist startup time")
+    parser.add_argument("-n", "--repeat", help = "number of runs of each command", type = int, default = 40)
+    parser.add_argument("-b", "--baseline", help = "git revision to compare against (default: first commit)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        baseline = args.baseline or get_first_commit()
+        log_path = os.path.join(temp_dir, "logs")
+        config_file = os.path.join(temp_dir, "server.json")
+        os.mkdir(log_path)
+        shutil.copy(testdata, os.path.join(log_path, "20250331"))
+
+        with open(config_file, "w") as f:
+            json.dump({ "pbs_log_path" : log_path }, f)
+
+        env = dict(os.environ, QHIST_SERVER_CONFIG = config_file)
+        env.pop("PYTHONPATH", None)
+        query = ["-p", "20250331", "-j", "4215065"]
+        baseline_qhist = extract_revision(baseline, os.path.join(temp_dir, "baseline"))
+
+        commands = [("python -c pass", [sys.executable, "-c", "pass"]),
+                    ("import pbsparse", [sys.executable, "-c", "import pbsparse"]),
+                    ("qhist ({})".format(baseline[:10]), [sys.executable, baseline_qhist] + query),
+                    ("qhist (this tree)", [sys.executable, os.path.join(my_root, "bin", "qhist")] + query)]
+        results = time_commands([command for _, command in commands], env, args.repeat)
+
+    for (label, _), seconds in zip(commands, results):
+        print("{:28} {:>8.1f} ms".format(label, seconds * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end qhist queries on synthetic accounting logs
+
+Generates daily logs with generate_logs.py (including array jobs, requeued jobs,
+and jobs with long exec_vnode lists) and times a full run of qhist.main() for
+each output mode, a user and an expression filter, averages, reverse reading,
+sorting, and grouping. Each scenario runs in a fresh interpreter, and the suite
+reports the median wall time, end records processed per second, and the peak
+resident set size. Results can be saved and compared against a later run to
+catch regressions.
+"""
+
+import os, sys, argparse, datetime, json, resource, statistics, subprocess, tempfile, time
+
+my_root = os.path.dirname(os.path.realpath(__file__)).rsplit("/", 1)[0]
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from generate_logs import generate_logs
+
+# Scenarios as (name, qhist arguments)
+SCENARIOS = (   ("table",               []),
+                ("wide",                ["-w"]),
+                ("list",                ["-l"]),
+                ("csv",                 ["-c"]),
+                ("json",                ["-J"]),
+                ("ndjson",              ["--ndjson"]),
+                ("nodes",               ["-n"]),
+                ("filter user",         ["-u", "user001"]),
+                ("filter expression",   ["-F", "numnodes>=8 and queue==main"]),
+                ("average",             ["-a"]),
+                ("reverse",             ["-r"]),
+                ("sort",                ["-S", "memory"]),
+                ("group",               ["-g", "user"])   )
+
+def run_child(qhist_args):
+    """Run qhist.main() in this process and report its time and peak memory"""
+    sys.path.insert(0, os.path.join(my_root, "src"))
+    from qhist import qhist
+
+    sys.argv = ["qhist"] + qhist_args
+    sys.stdout = open(os.devnull, "w")
+    start = time.perf_counter()
+
+    try:
+        qhist.main()
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise
+
+    seconds = time.perf_counter() - start
+    sys.stdout.close()
+    sys.stdout = sys.__stdout__
+
+    print(json.dumps({ "seconds" : seconds, "maxrss" : get_peak_memory() }))
+
+def get_peak_memory():
+    """Return the peak resident set size of this process in bytes"""
+    # On Linux, ru_maxrss survives exec and would include the parent generating logs
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def run_scenario(qhist_args, env, repeat):
+    command = [sys.executable, os.path.realpath(__file__), "--child", "--"] + qhist_args
+    results = []
+
+    for _ in range(repeat):
+        output = subprocess.run(command, env = env, stdout = subprocess.PIPE, check = True, text = True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+
+    return statistics.median(r["seconds"] for r in results), max(r["maxrss"] for r in results)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark qhist queries on synthetic accounting logs")
+    parser.add_argument("-n", "--repeat",   help = "number of runs of each scenario", type = int, default = 3)
+    parser.add_argument("--days",           help = "number of daily logs", type = int, default = 2)
+    parser.add_argument("--jobs",           help = "jobs ending per day", type = int, default = 20000)
+    parser.add_argument("--max-nodes",      help = "largest number of nodes used by a job", type = int, default = 64)
+    parser.add_argument("--arrays",         help = "fraction of jobs that are job arrays", type = float, default = 0.05)
+    parser.add_argument("--requeues",       help = "fraction of jobs that are requeued", type = float, default = 0.02)
+    parser.add_argument("--only",           help = "comma-separated scenarios to run")
+    parser.add_argument("--save",           help = "write results to a JSON file")
+    parser.add_argument("--compare",        help = "compare against results saved with --save")
+    parser.add_argument("--threshold",      help = "slowdown that counts as a regression (default: 0.1)", type = float, default = 0.1)
+    parser.add_argument("--child",          help = argparse.SUPPRESS, action = "store_true")
+    parser.add_argument("qhist_args",       help = argparse.SUPPRESS, nargs = "*")
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.qhist_args)
+
+    scenarios = SCENARIOS
+
+    if args.only:
+        scenarios = [s for s in SCENARIOS if s[0] in args.only.split(",")]
+
+    baseline = {}
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    start_date = datetime.date(2025, 3, 1)
+    period = "{}-{}".format(start_date.strftime("%Y%m%d"), (start_date + datetime.timedelta(days = args.days - 1)).strftime("%Y%m%d"))
+    results, regressions = {}, []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, "logs")
+        config_file = os.path.join(temp_dir, "server.json")
+        end_records = generate_logs(log_path, start_date, args.days, args.jobs, max_nodes = args.max_nodes,
+                                    array_fraction = args.arrays, requeue_fraction = args.requeues)
+
+        with open(config_file, "w") as f:
+            json.dump({ "pbs_log_path" : log_path }, f)
+
+        env = dict(os.environ, QHIST_SERVER_CONFIG = config_file)
+        print("{} end records in {} days\n".format(end_records, args.days))
+        print("{:20} {:>9} {:>12} {:>10} {:>9}".format("Scenario", "Time (s)", "Records/s", "Peak (MB)", "Change"))
+
+        for name, qhist_args in scenarios:
+            seconds, maxrss = run_scenario(["-p", period] + qhist_args, env, args.repeat)
+            results[name] = { "seconds" : seconds, "records_per_second" : end_records / seconds, "maxrss" : maxrss }
+            change = ""
+
+            if name in baseline:
+                ratio = seconds / baseline[name]["seconds"] - 1
+                change = "{:+.1%}".format(ratio)
+
+                if ratio > args.threshold:
+                    regressions.append(name)
+
+            print("{:20} {:>9.2f} {:>12.0f} {:>10.1f} {:>9}".format(name, seconds, end_records / seconds, maxrss / 1024 ** 2, change))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({ "end_records" : end_records, "results" : results }, f, indent = 4)
+
+    if regressions:
+        sys.exit("\nError: slower than baseline by more than {:.0%}: {}".format(args.threshold, ", ".join(regressions)))
+
+if __name__ == "__main__":
+    main()
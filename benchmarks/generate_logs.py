@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic PBS accounting logs for benchmarks
+
+Records are built from the queued, started, requeued, and end records in the
+bundled test log, with randomized users, accounts, queues, resources, and times.
+Each day can include array jobs (with subjob and parent end records), requeued
+jobs (with R records and a second start), and jobs on many nodes with long
+exec_vnode lists. Output is reproducible for a given seed.
+"""
+
+import os, argparse, datetime, random
+
+my_root = os.path.dirname(os.path.realpath(__file__)).rsplit("/", 1)[0]
+testdata = os.path.join(my_root, "src", "qhist", "test", "testdata")
+
+# Constants
+QUEUES = ("main", "main", "main", "htc", "casper", "preempt", "gpudev")
+JOB_NAMES = ("STDIN", "run_model", "wrf.exe", "cesm_case", "analysis", "train.sh", "postproc")
+CPUS_PER_NODE = 128
+LOG_FORMAT = "%m/%d/%Y %H:%M:%S"
+
+#
+## Classes
+#
+
+class LogGenerator:
+    """Build synthetic accounting records from the test log templates
+
+    Args:
+        seed (int): Seed for the random number generator
+        users (int): Number of distinct users (activity is skewed towards a few)
+        max_nodes (int): Largest number of nodes used by a job
+        array_fraction (float): Fraction of jobs that are job arrays
+        requeue_fraction (float): Fraction of jobs that are requeued once
+    """
+
+    def __init__(self, seed = 1, users = 200, max_nodes = 64, array_fraction = 0.05, requeue_fraction = 0.02):
+        self.random = random.Random(seed)
+        self.users = ["user{:03d}".format(n) for n in range(users)]
+        self.max_nodes = max_nodes
+        self.array_fraction = array_fraction
+        self.requeue_fraction = requeue_fraction
+        self.templates = {}
+        self.next_id = 5000000
+
+        with open(testdata) as log_file:
+            for line in log_file:
+                time_stamp, record_type, job_id, record_meta = line.rstrip("\n").split(";")
+
+                if record_type not in self.templates:
+                    self.templates[record_type] = [item.split("=", 1) for item in record_meta.split()]
+
+    def format_record(self, event_time, record_type, job_id, values):
+        items = []
+
+        for key, default in self.templates[record_type]:
+            value = values.get(key, default)
+
+            if value is not None:
+                items.append("{}={}".format(key, value))
+
+        for key in ("array_indices_submitted", "array_indices_remaining"):
+            if key in values:
+                items.append("{}={}".format(key, values[key]))
+
+        return (event_time, "{};{};{};{}".format(event_time.strftime(LOG_FORMAT), record_type, job_id, " ".join(items)))
+
+    def job_values(self, queued, started, ended, exit_status = 0, run_count = 1):
+        rand = self.random
+        user_index = min(int(rand.paretovariate(1.2)) - 1, len(self.users) - 1)
+        user = self.users[user_index]
+        queue = rand.choice(QUEUES)
+        nodes = 1 if rand.random() < 0.7 else rand.randint(2, self.max_nodes)
+        ncpus = rand.choice((1, 4, 16, 36)) if nodes == 1 else nodes * CPUS_PER_NODE
+        ngpus = nodes * 4 if queue == "gpudev" else 0
+        elapsed = int((ended - started).total_seconds())
+        walltime = max(elapsed + rand.randint(60, 7200), 600)
+        mem_gb = nodes * rand.choice((2, 16, 64, 235))
+        first_node = rand.randint(1, 2500)
+        chunk = "ncpus={}:mem={}gb".format(CPUS_PER_NODE if nodes > 1 else ncpus, mem_gb // nodes)
+        vnodes = ["(dec{:04d}:{})".format(first_node + n, chunk) for n in range(nodes)]
+
+        return {    "user"                          : user,
+                    "group"                         : "ncar",
+                    "account"                       : '"P{:08d}"'.format(93300000 + user_index % 40),
+                    "jobname"                       : rand.choice(JOB_NAMES),
+                    "queue"                         : queue,
+                    "ctime"                         : int(queued.timestamp()),
+                    "qtime"                         : int(queued.timestamp()),
+                    "etime"                         : int(queued.timestamp()),
+                    "start"                         : int(started.timestamp()),
+                    "end"                           : int(ended.timestamp()),
+                    "exec_host"                     : "+".join("dec{:04d}/0*{}".format(first_node + n, CPUS_PER_NODE) for n in range(nodes)),
+                    "exec_vnode"                    : "+".join(vnodes),
+                    "Resource_List.mem"             : "{}gb".format(mem_gb),
+                    "Resource_List.ncpus"           : ncpus,
+                    "Resource_List.ngpus"           : ngpus,
+                    "Resource_List.nodect"          : nodes,
+                    "Resource_List.select"          : "{}:{}".format(nodes, chunk),
+                    "Resource_List.walltime"        : "{:02d}:{:02d}:{:02d}".format(walltime // 3600, walltime % 3600 // 60, walltime % 60),
+                    "Exit_status"                   : exit_status,
+                    "resources_used.cpupercent"     : rand.randint(0, 100 * min(ncpus, 256)),
+                    "resources_used.cput"           : "{:02d}:{:02d}:{:02d}".format(elapsed // 3600, elapsed % 3600 // 60, elapsed % 60),
+                    "resources_used.mem"            : "{}kb".format(rand.randint(1000, mem_gb * 1000000)),
+                    "resources_used.ncpus"          : ncpus,
+                    "resources_used.vmem"           : "{}kb".format(rand.randint(1000, mem_gb * 1000000)),
+                    "resources_used.walltime"       : "{:02d}:{:02d}:{:02d}".format(elapsed // 3600, elapsed % 3600 // 60, elapsed % 60),
+                    "eligible_time"                 : "00:{:02d}:{:02d}".format(rand.randint(0, 59), rand.randint(0, 59)),
+                    "run_count"                     : run_count }
+
+    def job_records(self, day_start):
+        """Return the (time, line) records of one job that ends during a day"""
+        rand = self.random
+        job_id = "{}.desched1".format(self.next_id)
+        self.next_id += 1
+
+        queued = day_start + datetime.timedelta(seconds = rand.randint(0, 86399))
+        started = queued + datetime.timedelta(seconds = int(rand.expovariate(1 / 600.0)))
+        ended = started + datetime.timedelta(seconds = int(rand.expovariate(1 / 3600.0)) + 1)
+        day_end = day_start + datetime.timedelta(seconds = 86399)
+        ended, started = min(ended, day_end), min(started, day_end)
+        records = []
+
+        if rand.random() < self.array_fraction:
+            size = rand.randint(2, 20)
+            values = self.job_values(queued, started, ended)
+            values.update(array_indices_submitted = "1-{}".format(size))
+            parent_id = job_id.replace(".", "[].", 1)
+            records.append(self.format_record(queued, "Q", parent_id, values))
+
+            for index in range(1, size + 1):
+                subjob_id = job_id.replace(".", "[{}].".format(index), 1)
+                records.append(self.format_record(started, "S", subjob_id, values))
+                records.append(self.format_record(ended, "E", subjob_id, values))
+
+            # Parent records carry no resource usage or placement
+            for key, _ in self.templates["E"]:
+                if key.startswith(("resources_used.", "exec_")):
+                    values[key] = None
+
+            records.append(self.format_record(ended, "E", parent_id, values))
+        elif rand.random() < self.requeue_fraction:
+            requeued = started + (ended - started) / 2
+            values = self.job_values(queued, started, requeued, exit_status = -3)
+            records.append(self.format_record(queued, "Q", job_id, values))
+            records.append(self.format_record(started, "S", job_id, values))
+            records.append(self.format_record(requeued, "R", job_id, values))
+            values = self.job_values(queued, requeued, ended, run_count = 2)
+            records.append(self.format_record(requeued, "S", job_id, values))
+            records.append(self.format_record(ended, "E", job_id, values))
+        else:
+            values = self.job_values(queued, started, ended)
+            records.append(self.format_record(queued, "Q", job_id, values))
+            records.append(self.format_record(started, "S", job_id, values))
+            records.append(self.format_record(ended, "E", job_id, values))
+
+        return records
+
+    def day_lines(self, log_date, jobs):
+        """Return the log lines of a day with the given number of jobs, in time order"""
+        day_start = datetime.datetime.combine(log_date, datetime.time())
+        records = []
+
+        for _ in range(jobs):
+            records.extend(self.job_records(day_start))
+
+        records.sort(key = lambda record: record[0])
+        return [line for _, line in records]
+
+#
+## Functions
+#
+
+def generate_logs(log_path, start_date, days, jobs, **generator_opts):
+    """Write daily logs to a directory
+
+    Returns:
+        int: The number of end (E) records written
+    """
+    generator = LogGenerator(**generator_opts)
+    end_records = 0
+    os.makedirs(log_path, exist_ok = True)
+
+    for n in range(days):
+        log_date = start_date + datetime.timedelta(days = n)
+        lines = generator.day_lines(log_date, jobs)
+        end_records += sum(1 for line in lines if line[20] == "E")
+
+        with open(os.path.join(log_path, log_date.strftime("%Y%m%d")), "w") as log_file:
+            log_file.write("\n".join(lines) + "\n")
+
+    return end_records
+
+def main():
+    parser = argparse.ArgumentParser(description = "Generate synthetic PBS accounting logs")
+    parser.add_argument("log_path",                 help = "directory in which daily logs are written")
+    parser.add_argument("--start",                  help = "first log date (YYYYmmdd, default: 20250301)", default = "20250301")
+    parser.add_argument("--days",                   help = "number of daily logs", type = int, default = 1)
+    parser.add_argument("--jobs",                   help = "jobs ending per day", type = int, default = 10000)
+    parser.add_argument("--users",                  help = "number of distinct users", type = int, default = 200)
+    parser.add_argument("--max-nodes",              help = "largest number of nodes used by a job", type = int, default = 64)
+    parser.add_argument("--arrays",                 help = "fraction of jobs that are job arrays", type = float, default = 0.05)
+    parser.add_argument("--requeues",               help = "fraction of jobs that are requeued", type = float, default = 0.02)
+    parser.add_argument("--seed",                   help = "random seed", type = int, default = 1)
+    args = parser.parse_args()
+
+    start_date = datetime.datetime.strptime(args.start, "%Y%m%d").date()
+    end_records = generate_logs(args.log_path, start_date, args.days, args.jobs, seed = args.seed, users = args.users,
+                                max_nodes = args.max_nodes, array_fraction = args.arrays, requeue_fraction = args.requeues)
+    print("Wrote {} days with {} end records to {}".format(args.days, end_records, args.log_path))
+
+if __name__ == "__main__":
+    main()
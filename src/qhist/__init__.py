@@ -1 +1,3 @@
-__all__ = ["qhist"]
+from .qhist import query
+
+__all__ = ["qhist", "query"]
@@ -0,0 +1,179 @@
+"""
+Rolling up the subjobs of job arrays for qhist
+
+Subjobs are combined into one record per array as records stream past, so
+large arrays produce a single row. Only arrays that are still open are held in
+memory: an array is closed by its parent end record, which PBS writes after all
+of its subjobs have ended.
+"""
+
+import re
+
+from collections import OrderedDict
+from pbsparse import PbsRecord
+from .records import get_attributes
+
+# Constants
+ARRAY_REGEX = re.compile(r"^([^\[]*)\[([^\]]*)\](.*)$")
+ARRAY_FIELDS = ("start", "end", "Exit_status", "resources_used[walltime]", "resources_used[mem]")
+
+#
+## Classes
+#
+
+class ArrayRollup(PbsRecord):
+    """The subjobs of a job array rolled up into a single record
+
+    Attributes of the first subjob are kept (except its placement), with the ID
+    of the array, the first start and last end times, and the mean resource
+    usage of the subjobs. The rollup also has the number of subjobs (subjobs),
+    a histogram of their exit statuses (exit_statuses), and the minimum and
+    maximum elapsed time and memory. Exit_status is 0 if every subjob exited
+    with status 0 and 1 otherwise, as for array parents in PBS.
+
+    Args:
+        job (PbsRecord): The first subjob read
+        array_id (str): The ID of the array (e.g., "1234[].server")
+    """
+
+    def __init__(self, job, array_id):
+        for key, value in get_attributes(job).items():
+            if not key.startswith("_") and not key.startswith("exec_"):
+                setattr(self, key, dict(value) if isinstance(value, dict) else value)
+
+        self.id = array_id
+        self.short_id = array_id.split(".")[0]
+        self.subjobs = 0
+        self.exit_statuses = {}
+        self.min_elapsed = self.max_elapsed = None
+        self.min_memory = self.max_memory = None
+        self._sums = {}
+        self._expected = None
+
+    def add(self, job):
+        """Add the times, exit status, and resource usage of a subjob"""
+        self.subjobs += 1
+        status = str(getattr(job, "Exit_status", "-"))
+        self.exit_statuses[status] = self.exit_statuses.get(status, 0) + 1
+
+        for name, pick in (("start", min), ("end", max), ("time", max)):
+            value = getattr(job, name, None)
+
+            if value is not None:
+                setattr(self, name, pick(getattr(self, name, value), value))
+
+        resources_used = getattr(job, "resources_used", {})
+        sums = self._sums
+
+        for key, value in resources_used.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total, count = sums.get(key, (0, 0))
+                sums[key] = (total + value, count + 1)
+
+        for name, key in (("elapsed", "walltime"), ("memory", "mem")):
+            value = resources_used.get(key)
+
+            if isinstance(value, (int, float)):
+                low, high = getattr(self, "min_" + name), getattr(self, "max_" + name)
+                setattr(self, "min_" + name, value if low is None else min(low, value))
+                setattr(self, "max_" + name, value if high is None else max(high, value))
+
+    def expect(self, parent):
+        """Set the number of subjobs to expect from the parent end record, if known"""
+        try:
+            self._expected = count_indices(parent.array_indices_submitted)
+        except (AttributeError, ValueError):
+            pass
+
+    def is_complete(self):
+        return self._expected is not None and self.subjobs >= self._expected
+
+    def close(self):
+        """Finish the rollup with mean resource usage and return it"""
+        resources_used = self.__dict__.setdefault("resources_used", {})
+
+        for key, (total, count) in self._sums.items():
+            resources_used[key] = total / count
+
+        failed = any(status != "0" for status in self.exit_statuses)
+        self.Exit_status = "1" if failed else "0"
+        self.exit_statuses = " ".join("{}:{}".format(status, count) for status, count in
+                                      sorted(self.exit_statuses.items(), key = lambda item: (-item[1], item[0])))
+        del self._sums, self._expected
+        return self
+
+#
+## Functions
+#
+
+def get_array_id(job_id):
+    """Return the array ID of a subjob or parent, or None for other jobs
+
+    Returns:
+        tuple: The array ID and whether the job is the array parent
+    """
+    match = ARRAY_REGEX.match(job_id)
+
+    if match:
+        return "{}[]{}".format(match.group(1), match.group(3)), not match.group(2)
+    else:
+        return None, False
+
+def count_indices(spec):
+    """Count the subjob indices in a PBS range list (e.g., "0-99:2,200")"""
+    count = 0
+
+    for part in spec.split(","):
+        if "-" in part:
+            bounds, _, step = part.partition(":")
+            first, last = bounds.split("-")
+            count += len(range(int(first), int(last) + 1, int(step or 1)))
+        else:
+            int(part)
+            count += 1
+
+    return count
+
+def collapse_arrays(records, reverse = False):
+    """Yield records with the subjobs of each job array rolled up into one record
+
+    Other records are passed through. Reading forwards, a rollup is yielded in
+    place of the array's parent end record. In reverse, the parent is read
+    first and gives the number of subjobs, so the rollup is yielded once all of
+    them have been read. Arrays that are still open when the records run out
+    (e.g., whose parent is outside the time range or filtered out) are yielded
+    at the end in the order they were first seen. Parents without any subjobs
+    in the records are passed through.
+    """
+    open_arrays = OrderedDict()
+
+    for job in records:
+        array_id, is_parent = get_array_id(job.id)
+
+        if array_id is None:
+            yield job
+        elif is_parent:
+            if reverse:
+                # Subjobs follow the parent when reading in reverse
+                open_arrays[array_id] = job
+                continue
+
+            rollup = open_arrays.pop(array_id, None)
+            yield job if rollup is None else rollup.close()
+        else:
+            rollup = open_arrays.get(array_id)
+
+            if not isinstance(rollup, ArrayRollup):
+                parent, rollup = rollup, ArrayRollup(job, array_id)
+                open_arrays[array_id] = rollup
+
+                if parent is not None:
+                    rollup.expect(parent)
+
+            rollup.add(job)
+
+            if reverse and rollup.is_complete():
+                yield open_arrays.pop(array_id).close()
+
+    for rollup in open_arrays.values():
+        yield rollup.close() if isinstance(rollup, ArrayRollup) else rollup
@@ -0,0 +1,407 @@
+"""
+Sidecar caches of processed PBS accounting data
+
+Daily accounting logs are immutable once the day has closed, so the processed
+end-type records for each day can be stored in a compact columnar form and
+reused by later queries. Cache entries are keyed by the size and modification
+time of the source log, so a log that changes is simply parsed again.
+
+An index of where each job, user, and account appears in the logs is also kept
+alongside the records, so selective queries can seek straight to the matching
+lines instead of scanning every log in the period.
+"""
+
+import os, re, datetime, json, struct, zlib, tempfile, sqlite3
+
+from array import array
+
+# Constants
+CACHE_MAGIC = b"QHC1"
+CACHE_VERSION = 1
+CACHE_EVENTS = "ER"
+INDEX_VERSION = 2
+NODE_REGEX = re.compile(r"\(([^:]*)")
+DT_EPOCH = datetime.datetime(1970, 1, 1)
+LAYOUT_COLUMN = "\0layout"
+
+#
+## Classes
+#
+
+class RecordCache:
+    """Store processed end-type records for each daily log in columnar files
+
+    Each column is stored as a typed array (integers, floats, datetimes) or as
+    a dictionary-encoded string column, which keeps repeated values like users,
+    queues, and accounts small. Columns with mixed types fall back to JSON.
+
+    Args:
+        cache_path (str): Directory in which cache files are kept
+        date_format (str): The format of daily log file names
+    """
+
+    def __init__(self, cache_path, date_format = "%Y%m%d"):
+        self.cache_path = os.path.expanduser(cache_path)
+        self.date_format = date_format
+        self.index = RecordIndex(os.path.join(self.cache_path, "index.db"))
+
+    def usable(self, type_filter):
+        return not type_filter or all(c in CACHE_EVENTS + ", " for c in type_filter)
+
+    def get_cache_file(self, data_file, Record, time_divisor, source = None):
+        # Logs from named sources share file names, so each source has its own directory
+        return os.path.join(self.cache_path, "records", *([source] if source else []),
+                            "{}.{}.{:g}.qhc".format(os.path.basename(data_file), Record.__name__, time_divisor))
+
+    def get_log_key(self, data_file):
+        log_stat = os.stat(data_file)
+        return log_stat.st_size, int(log_stat.st_mtime)
+
+    def is_closed(self, data_file):
+        today = datetime.datetime.today().strftime(self.date_format)
+        return os.path.basename(data_file) != today
+
+    def load(self, data_file, Record, time_divisor, source = None):
+        """Return the cached records for a log, or None if the cache is stale"""
+        try:
+            size, mtime = self.get_log_key(data_file)
+
+            with open(self.get_cache_file(data_file, Record, time_divisor, source), "rb") as cache_file:
+                cache_data = cache_file.read()
+        except OSError:
+            return None
+
+        try:
+            if cache_data[:4] != CACHE_MAGIC:
+                return None
+
+            header_len, = struct.unpack_from("<I", cache_data, 4)
+            header = json.loads(cache_data[8:8 + header_len].decode())
+
+            if (header["version"], header["size"], header["mtime"]) != (CACHE_VERSION, size, mtime):
+                return None
+
+            columns = decode_columns(header["columns"], cache_data, 8 + header_len, header["count"])
+        except (ValueError, KeyError, struct.error, zlib.error):
+            return None
+
+        return build_records(Record, header["count"], columns)
+
+    def store(self, data_file, records, Record, time_divisor, source = None):
+        """Write records for a closed log to the cache, ignoring write failures"""
+        if not self.is_closed(data_file):
+            return
+
+        try:
+            size, mtime = self.get_log_key(data_file)
+        except OSError:
+            return
+
+        column_specs, blobs = encode_columns(records)
+        header = json.dumps({   "version"   : CACHE_VERSION,
+                                "size"      : size,
+                                "mtime"     : mtime,
+                                "count"     : len(records),
+                                "columns"   : column_specs }).encode()
+        cache_file = self.get_cache_file(data_file, Record, time_divisor, source)
+
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok = True)
+            fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(cache_file), suffix = ".tmp")
+
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(CACHE_MAGIC + struct.pack("<I", len(header)) + header)
+
+                for blob in blobs:
+                    temp_file.write(blob)
+
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, cache_file)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except (OSError, UnboundLocalError):
+                pass
+
+class RecordIndex:
+    """Map job IDs, users, accounts, and hosts to the byte offsets of their end records
+
+    Entries are stored in an SQLite database with one row per key and record.
+    Logs are indexed on first use and updated incrementally: if a log has only
+    grown since it was last seen, just the appended bytes are scanned. Indexes
+    written by older versions are emptied and rebuilt as logs are used.
+
+    Args:
+        index_path (str): Path to the SQLite database file
+    """
+
+    kinds = ("id", "user", "account", "host")
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._db = None
+
+    def __getstate__(self):
+        return { "index_path" : self.index_path, "_db" : None }
+
+    def connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok = True)
+            db = sqlite3.connect(self.index_path, timeout = 60)
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS logs (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, indexed INTEGER);
+                CREATE TABLE IF NOT EXISTS entries (log INTEGER, kind TEXT, key TEXT, offset INTEGER);
+                CREATE INDEX IF NOT EXISTS entry_keys ON entries (kind, key, log);
+            """)
+
+            # Entries of older versions lack some kinds, so the index is not used unless it can be rebuilt
+            if db.execute("PRAGMA user_version").fetchone()[0] < INDEX_VERSION:
+                with db:
+                    db.execute("DELETE FROM entries")
+                    db.execute("DELETE FROM logs")
+                    db.execute("PRAGMA user_version = {}".format(INDEX_VERSION))
+
+            self._db = db
+
+        return self._db
+
+    def update(self, data_file):
+        """Bring the index up to date for a log and return its row id
+
+        Returns None if the log cannot be indexed, such as when the index is
+        stale and cannot be written.
+        """
+        try:
+            log_stat = os.stat(data_file)
+            db = self.connect()
+            row = db.execute("SELECT rowid, size, mtime, indexed FROM logs WHERE path = ?", (data_file,)).fetchone()
+
+            if row and row[1:3] == (log_stat.st_size, int(log_stat.st_mtime)):
+                return row[0]
+
+            with db:
+                if row and row[3] <= log_stat.st_size:
+                    log_id, start = row[0], row[3]
+                else:
+                    if row:
+                        db.execute("DELETE FROM entries WHERE log = ?", (row[0],))
+                        db.execute("DELETE FROM logs WHERE rowid = ?", (row[0],))
+
+                    log_id = db.execute("INSERT INTO logs VALUES (?, 0, 0, 0)", (data_file,)).lastrowid
+                    start = 0
+
+                entries, indexed = scan_log(data_file, start)
+                db.executemany("INSERT INTO entries VALUES ({}, ?, ?, ?)".format(log_id), entries)
+                db.execute("UPDATE logs SET size = ?, mtime = ?, indexed = ? WHERE rowid = ?",
+                           (log_stat.st_size, int(log_stat.st_mtime), indexed, log_id))
+
+            return log_id
+        except (OSError, sqlite3.Error):
+            return None
+
+    def lookup(self, data_file, criteria):
+        """Return sorted offsets of end records matching all criteria
+
+        Args:
+            data_file (str): Path to the daily accounting log
+            criteria (list): (kind, values) pairs; any value may match within a
+                             pair, and all pairs must match. Job IDs are matched
+                             as prefixes, like the qhist job filter.
+
+        Returns:
+            list: Byte offsets of the matching lines, or None if the log could not
+                  be indexed. Hosts are matched by node name, as in exec_vnode.
+        """
+        log_id = self.update(data_file)
+
+        if log_id is None:
+            return None
+
+        matches = None
+
+        for kind, values in criteria:
+            offsets = set()
+
+            for value in values:
+                if kind == "id":
+                    query = "SELECT offset FROM entries WHERE kind = ? AND key >= ? AND key < ? AND log = ?"
+                    params = (kind, value, value + "\U0010ffff", log_id)
+                else:
+                    query = "SELECT offset FROM entries WHERE kind = ? AND key = ? AND log = ?"
+                    params = (kind, value, log_id)
+
+                offsets.update(r[0] for r in self._db.execute(query, params))
+
+            matches = offsets if matches is None else matches & offsets
+
+        return sorted(matches or ())
+
+#
+## Functions
+#
+
+def scan_log(data_file, start = 0):
+    """Collect index entries for end records without fully parsing them
+
+    Returns:
+        tuple: A list of (kind, key, offset) entries and the offset just past
+               the last complete line that was scanned
+    """
+    entries = []
+    offset = start
+
+    with open(data_file, "rb") as log_file:
+        log_file.seek(start)
+
+        for line in log_file:
+            if not line.endswith(b"\n"):
+                break
+
+            if line[20:21] in (b"E", b"R"):
+                try:
+                    _, _, job_id, record_meta = line.decode(errors = "replace").split(";", 3)
+                except ValueError:
+                    offset += len(line)
+                    continue
+
+                entries.append(("id", job_id.split(".")[0], offset))
+
+                for item in record_meta.split():
+                    if item.startswith("user="):
+                        entries.append(("user", item[5:], offset))
+                    elif item.startswith("account="):
+                        entries.append(("account", item[8:].replace('"', ""), offset))
+                    elif item.startswith("exec_vnode="):
+                        entries.extend(("host", node, offset) for node in set(NODE_REGEX.findall(item)))
+
+            offset += len(line)
+
+    return entries, offset
+
+def get_columns(records):
+    """Split record attributes into columns, flattening resource dictionaries
+
+    The attribute order of each record is kept as a layout string, so that
+    rebuilt records serialize exactly like freshly parsed ones.
+    """
+    columns = {}
+    layouts = []
+
+    for row, record in enumerate(records):
+        layout = []
+
+        for key, value in vars(record).items():
+            if key == "_raw_record":
+                continue
+
+            if isinstance(value, dict):
+                for child_key, child_value in value.items():
+                    name = "{}.{}".format(key, child_key)
+                    columns.setdefault(name, {})[row] = child_value
+                    layout.append(name)
+            else:
+                columns.setdefault(key, {})[row] = value
+                layout.append(key)
+
+        layouts.append("\t".join(layout))
+
+    columns[LAYOUT_COLUMN] = dict(enumerate(layouts))
+    return columns
+
+def encode_columns(records):
+    column_specs, blobs = [], []
+    count = len(records)
+
+    for name, cells in get_columns(records).items():
+        kinds = set(type(value) for value in cells.values())
+        missing = [row for row in range(count) if row not in cells] if len(cells) < count else []
+        values = [cells[row] for row in range(count) if row in cells]
+
+        if kinds == {int} and all(-2 ** 63 <= v < 2 ** 63 for v in values):
+            kind, blob = "i", array("q", values).tobytes()
+        elif kinds == {float}:
+            kind, blob = "f", array("d", values).tobytes()
+        elif kinds == {datetime.datetime}:
+            kind, blob = "t", array("q", (int((v - DT_EPOCH).total_seconds()) for v in values)).tobytes()
+        elif kinds == {str}:
+            unique = {}
+            codes = array("I", (unique.setdefault(v, len(unique)) for v in values))
+            kind, blob = "s", json.dumps(list(unique)).encode() + b"\0" + codes.tobytes()
+        else:
+            kind, blob = "j", json.dumps([encode_value(v) for v in values]).encode()
+
+        blob = zlib.compress(blob, 6)
+        column_specs.append({ "name" : name, "kind" : kind, "length" : len(blob), "missing" : missing })
+        blobs.append(blob)
+
+    return column_specs, blobs
+
+def encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return { "t" : int((value - DT_EPOCH).total_seconds()) }
+    elif isinstance(value, (str, int, float, bool)):
+        return value
+    else:
+        return str(value)
+
+def decode_value(value):
+    if isinstance(value, dict):
+        return DT_EPOCH + datetime.timedelta(seconds = value["t"])
+    else:
+        return value
+
+def decode_columns(column_specs, cache_data, offset, count):
+    columns = {}
+
+    for spec in column_specs:
+        blob = zlib.decompress(cache_data[offset:offset + spec["length"]])
+        offset += spec["length"]
+
+        if spec["kind"] == "i":
+            values = array("q", blob).tolist()
+        elif spec["kind"] == "f":
+            values = array("d", blob).tolist()
+        elif spec["kind"] == "t":
+            values = [DT_EPOCH + datetime.timedelta(seconds = v) for v in array("q", blob)]
+        elif spec["kind"] == "s":
+            labels, codes = blob.split(b"\0", 1)
+            labels = json.loads(labels.decode())
+            values = [labels[c] for c in array("I", codes)]
+        else:
+            values = [decode_value(v) for v in json.loads(blob.decode())]
+
+        for row in spec["missing"]:
+            values.insert(row, None)
+
+        if len(values) != count:
+            raise ValueError("column {} has the wrong length".format(spec["name"]))
+
+        columns[spec["name"]] = values
+
+    return columns
+
+def build_records(Record, count, columns):
+    records = []
+    layouts = {}
+
+    for row, layout in enumerate(columns.pop(LAYOUT_COLUMN)):
+        try:
+            names = layouts[layout]
+        except KeyError:
+            names = layouts[layout] = [(name,) + tuple(name.split(".", 1)) for name in layout.split("\t") if name]
+
+        record = Record.__new__(Record)
+        row_data = record.__dict__
+
+        for name, key, *child_key in names:
+            if child_key:
+                try:
+                    row_data[key][child_key[0]] = columns[name][row]
+                except KeyError:
+                    row_data[key] = { child_key[0] : columns[name][row] }
+            else:
+                row_data[key] = columns[name][row]
+
+        records.append(record)
+
+    return records
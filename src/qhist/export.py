@@ -0,0 +1,402 @@
+"""
+Columnar export of job records for qhist
+
+Records are collected into batches of typed columns and written to Parquet or
+Arrow IPC (Feather) files using pyarrow, or to a NumPy .npz archive when only
+NumPy is available. Integer, float, boolean, datetime, and string values keep
+their types, and missing values are stored as nulls (NaN/NaT/"" in .npz files).
+Batches of .npz columns are spooled to temporary files next to the output and
+copied into the archive when it is closed, so only one batch is held in memory.
+If the export fails, the partially written output file is removed.
+"""
+
+import os, datetime, json, tempfile, zipfile
+
+from .filters import get_accessor
+
+# Constants
+EXPORT_FORMATS = { ".parquet" : "parquet", ".arrow" : "arrow", ".feather" : "arrow", ".npz" : "npz" }
+EXPORT_BATCH = 1 << 16
+
+#
+## Classes
+#
+
+class ColumnExporter:
+    """Write job records to a columnar file in large batches
+
+    The type of each column is inferred from its values: a column with both
+    integers and floats is stored as floats, and a column with mixed types is
+    stored as strings. Types are widened in the same way when later batches
+    differ; for Parquet and Arrow output, the batches already written are then
+    rewritten with the wider types. Columns that are empty in the first batch
+    of Parquet and Arrow output are stored as strings.
+
+    Args:
+        path (str): The output file
+        export_format (str): One of parquet, arrow, or npz
+        fields (list): Column names (e.g., "numcpus", "memory")
+        translate (function): Maps column names to record attributes
+        batch_size (int): Number of records collected before a batch is written
+    """
+
+    def __init__(self, path, export_format, fields, translate = None, batch_size = EXPORT_BATCH):
+        self.path = path
+        self.export_format = export_format
+        self.fields = fields
+        self.batch_size = batch_size
+        self.columns = [[] for _ in fields]
+        self.writer = None
+        self.schema = None
+        self.written = False
+        self.spools = []
+        self.dtypes = [[] for _ in fields]
+        self.rows = 0
+
+        self.accessors = [get_field_accessor(field, translate) for field in fields]
+        self.record_fields = set(get_record_field(field, translate) for field in fields)
+
+        try:
+            if export_format in ("parquet", "arrow"):
+                import pyarrow
+                self.pa = pyarrow
+
+                if export_format == "parquet":
+                    import pyarrow.parquet
+            elif export_format == "npz":
+                import numpy
+                self.np = numpy
+                spool_dir = os.path.dirname(os.path.abspath(path))
+                self.spools = [tempfile.TemporaryFile(dir = spool_dir) for _ in fields]
+            else:
+                raise ValueError("unknown export format ({})".format(export_format))
+        except ImportError as e:
+            raise ValueError("export format {} requires the {} package".format(export_format, e.name))
+
+    def add(self, record):
+        for column, accessor in zip(self.columns, self.accessors):
+            try:
+                column.append(accessor(record))
+            except (AttributeError, KeyError, TypeError):
+                column.append(None)
+
+        if len(self.columns[0]) >= self.batch_size:
+            self.write_batch()
+
+    def write_batch(self):
+        if not self.columns[0]:
+            return
+
+        columns = [normalize_column(column) for column in self.columns]
+        self.columns = [[] for _ in self.fields]
+
+        try:
+            if self.export_format == "npz":
+                for spool, dtypes, (kind, values) in zip(self.spools, self.dtypes, columns):
+                    values = self.to_numpy(kind, values)
+                    self.np.save(spool, values)
+                    dtypes.append(None if kind == "null" else values.dtype)
+
+                self.rows += len(columns[0][1])
+                return
+
+            if self.writer is None:
+                self.open_writer(self.pa.schema([(field, self.get_arrow_type(kind))
+                                                 for field, (kind, _) in zip(self.fields, columns)]))
+            else:
+                schema = self.pa.schema([(field.name, self.widen_type(field.type, kind))
+                                         for field, (kind, _) in zip(self.schema, columns)])
+
+                if not schema.equals(self.schema):
+                    self.rewrite(schema)
+
+            self.write_arrays([self.pa.array(self.match_type(field.type, kind, values), type = field.type)
+                               for field, (kind, values) in zip(self.schema, columns)])
+        except BaseException:
+            self.discard()
+            raise
+
+    def open_writer(self, schema):
+        self.schema = schema
+        self.written = True
+
+        if self.export_format == "parquet":
+            self.writer = self.pa.parquet.ParquetWriter(self.path, schema)
+        else:
+            self.writer = self.pa.ipc.new_file(self.path, schema)
+
+    def write_arrays(self, arrays):
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema = self.schema)
+
+        if self.export_format == "parquet":
+            self.writer.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def rewrite(self, schema):
+        """Copy the batches written so far into a new file with wider column types"""
+        writer, self.writer = self.writer, None
+        writer.close()
+        fd, old_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(self.path)))
+        os.close(fd)
+        os.replace(self.path, old_path)
+
+        try:
+            self.open_writer(schema)
+
+            for batch in self.read_batches(old_path):
+                self.write_arrays([self.convert_array(array, field.type) for array, field in zip(batch.columns, schema)])
+        finally:
+            os.remove(old_path)
+
+    def read_batches(self, path):
+        if self.export_format == "parquet":
+            with self.pa.parquet.ParquetFile(path) as parquet_file:
+                yield from parquet_file.iter_batches(batch_size = self.batch_size)
+        else:
+            with self.pa.memory_map(path) as source:
+                reader = self.pa.ipc.open_file(source)
+
+                for n in range(reader.num_record_batches):
+                    yield reader.get_batch(n)
+
+    def get_arrow_type(self, kind):
+        # Columns without any values in the first batch are assumed to be strings
+        pa = self.pa
+        return { "int" : pa.int64(), "float" : pa.float64(), "bool" : pa.bool_(),
+                 "datetime" : pa.timestamp("s"), "str" : pa.string(), "null" : pa.string() }[kind]
+
+    def widen_type(self, arrow_type, kind):
+        """Return a type that holds both the values of a column and a batch of the given kind"""
+        pa = self.pa
+        batch_type = self.get_arrow_type(kind)
+
+        if kind == "null" or batch_type == arrow_type or arrow_type == pa.string():
+            return arrow_type
+        elif arrow_type in (pa.int64(), pa.float64()) and batch_type in (pa.int64(), pa.float64()):
+            return pa.float64()
+        else:
+            return pa.string()
+
+    def convert_array(self, array, arrow_type):
+        if array.type == arrow_type:
+            return array
+        elif arrow_type == self.pa.string():
+            return self.pa.array([None if v is None else to_string(v) for v in array.to_pylist()], type = arrow_type)
+        else:
+            return array.cast(arrow_type)
+
+    def match_type(self, arrow_type, kind, values):
+        if arrow_type == self.pa.string() and kind not in ("str", "null"):
+            return [None if v is None else to_string(v) for v in values]
+        else:
+            return values
+
+    def to_numpy(self, kind, values):
+        np = self.np
+
+        if kind == "datetime":
+            return np.array(["NaT" if v is None else v for v in values], dtype = "datetime64[s]")
+        elif kind in ("int", "bool") and None not in values:
+            return np.array(values, dtype = "int64" if kind == "int" else "bool")
+        elif kind in ("int", "float", "bool"):
+            return np.array([np.nan if v is None else v for v in values], dtype = "float64")
+        else:
+            return np.array(["" if v is None else v for v in values], dtype = "str")
+
+    def to_strings(self, values):
+        # Missing values (NaN and NaT) become empty strings
+        if values.dtype.kind == "U":
+            return values
+        else:
+            return self.np.array(["" if v is None or v != v else to_string(v) for v in values.tolist()], dtype = "str")
+
+    def get_npz_type(self, dtypes):
+        """Return the type of a column, or None if it is stored as strings
+
+        Batches without any values have a type of None, and only add missing
+        values to the column.
+        """
+        np = self.np
+        known = [dtype for dtype in dtypes if dtype is not None]
+        kinds = set(dtype.kind for dtype in known)
+
+        if not known:
+            return np.dtype("<U1") if dtypes else np.dtype("float64")
+        elif len(known) < len(dtypes) and kinds <= set("bi"):
+            return np.dtype("float64")
+        elif len(kinds) == 1 or kinds <= set("bif"):
+            return np.result_type(*known)
+        else:
+            return None
+
+    def write_npz(self):
+        """Copy the spooled batches of each column into a compressed .npz archive
+
+        Each column is written as an .npy member, a batch at a time. Numeric
+        batches are promoted as numpy.concatenate would, and columns with any
+        other mix of types are converted to strings, as in normalize_column.
+        Batches without values are filled with the missing value of the type.
+        """
+        np = self.np
+        self.written = True
+
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED, allowZip64 = True) as archive:
+            for field, spool, dtypes in zip(self.fields, self.spools, self.dtypes):
+                dtype, convert = self.get_npz_type(dtypes), None
+
+                # The width of the string type is only known once every batch is converted
+                if dtype is None:
+                    convert = self.to_strings
+                    spool.seek(0)
+                    dtype = np.result_type(*(convert(np.load(spool)).dtype for _ in dtypes))
+
+                header = { "descr" : np.lib.format.dtype_to_descr(dtype), "fortran_order" : False, "shape" : (self.rows,) }
+                spool.seek(0)
+
+                with archive.open(field + ".npy", "w", force_zip64 = True) as member:
+                    np.lib.format.write_array_header_1_0(member, header)
+
+                    for batch_type in dtypes:
+                        values = np.load(spool)
+
+                        if batch_type is None:
+                            values = np.full(len(values), { "f" : np.nan, "M" : "NaT" }.get(dtype.kind, ""), dtype = dtype)
+                        elif convert:
+                            values = convert(values)
+
+                        member.write(values.astype(dtype, copy = False).tobytes())
+
+    def close(self):
+        """Write any remaining records and finish the file"""
+        self.write_batch()
+
+        try:
+            if self.export_format == "npz":
+                self.write_npz()
+            elif self.writer is not None:
+                writer, self.writer = self.writer, None
+                writer.close()
+            else:
+                empty = self.pa.schema([(field, self.pa.string()) for field in self.fields])
+                self.written = True
+
+                if self.export_format == "parquet":
+                    self.pa.parquet.write_table(empty.empty_table(), self.path)
+                else:
+                    self.pa.ipc.new_file(self.path, empty).close()
+        except BaseException:
+            self.discard()
+            raise
+        finally:
+            for spool in self.spools:
+                spool.close()
+
+    def discard(self):
+        """Close the exporter and remove its partially written output"""
+        writer, self.writer = self.writer, None
+
+        try:
+            if writer is not None:
+                writer.close()
+        finally:
+            for spool in self.spools:
+                spool.close()
+
+            if self.written and os.path.exists(self.path):
+                os.remove(self.path)
+
+#
+## Functions
+#
+
+def get_field_accessor(field, translate = None):
+    """Return a function that retrieves a field (by its format_map name) from a record"""
+    if field == "nodelist":
+        return lambda record: "+".join(record.get_nodes())
+    else:
+        return get_accessor(translate(field) if translate else field)
+
+def get_record_field(field, translate = None):
+    """Return the record attribute read for a field"""
+    if field == "nodelist":
+        return "exec_vnode"
+    else:
+        return translate(field) if translate else field
+
+def get_column_batches(records, fields, translate = None, batch_size = EXPORT_BATCH):
+    """Yield dictionaries mapping each field to a list of values from a batch of records
+
+    Values keep the types of the record fields, and missing values are None.
+    """
+    accessors = [get_field_accessor(field, translate) for field in fields]
+    columns = [[] for _ in fields]
+
+    for record in records:
+        for column, accessor in zip(columns, accessors):
+            try:
+                column.append(accessor(record))
+            except (AttributeError, KeyError, TypeError):
+                column.append(None)
+
+        if len(columns[0]) >= batch_size:
+            yield dict(zip(fields, columns))
+            columns = [[] for _ in fields]
+
+    if columns[0]:
+        yield dict(zip(fields, columns))
+
+def get_export_format(path, export_format = None):
+    """Return the export format given, or the one implied by the file extension"""
+    if export_format:
+        return export_format
+
+    try:
+        return EXPORT_FORMATS[os.path.splitext(path)[1].lower()]
+    except KeyError:
+        raise ValueError("cannot infer export format from file name ({}); use --export-format".format(path))
+
+def normalize_column(values):
+    """Find the type of a column and convert its values to match
+
+    Returns:
+        tuple: The column kind (int, float, bool, datetime, str, or null) and
+               the converted values, with None for missing values
+    """
+    kinds = set()
+
+    for value in values:
+        if value is None or value == "":
+            continue
+        elif isinstance(value, bool):
+            kinds.add("bool")
+        elif isinstance(value, int):
+            kinds.add("int")
+        elif isinstance(value, float):
+            kinds.add("float")
+        elif isinstance(value, datetime.datetime):
+            kinds.add("datetime")
+        else:
+            kinds.add("str")
+
+    if not kinds:
+        return "null", [None] * len(values)
+    elif len(kinds) == 1:
+        kind = kinds.pop()
+    elif kinds == {"int", "float"}:
+        kind = "float"
+    else:
+        kind = "str"
+
+    if kind == "str":
+        return kind, [None if v is None or v == "" else (v if isinstance(v, str) else to_string(v)) for v in values]
+    elif kind == "float":
+        return kind, [None if v is None or v == "" else float(v) for v in values]
+    else:
+        return kind, [None if v is None or v == "" else v for v in values]
+
+def to_string(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default = str)
+    else:
+        return str(value)
@@ -0,0 +1,563 @@
+"""
+Compiled job record filters for qhist
+
+Filters are given as simple specifications (job IDs, hosts, a time window, and
+(negation, operator, field, value) tuples) and compiled once into predicates
+with resolved field accessors. Match values are converted to the type of the
+field on first use, and cheap checks against the raw log line are used to skip
+records before they are parsed.
+
+Freeform filters use a small expression language with and/or/not, grouping,
+in-lists and regular expression matches. Expressions are parsed into a tree of
+tuples and compiled into short-circuiting closures, with cheaper clauses
+evaluated first.
+"""
+
+import datetime, operator, re
+
+# Fields that appear as plain key=value tokens in raw accounting records
+TOKEN_FIELDS = ("user", "group", "account", "project", "queue", "jobname")
+
+# Accepted formats when comparing datetime fields to a match value
+DATETIME_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d",
+                    "%Y%m%dT%H%M%S", "%Y%m%dT%H%M", "%Y%m%d")
+
+# Marker for match values that cannot be compared with a field of a given type
+INCOMPARABLE = object()
+
+# Tokens of the filter expression language
+TOKEN_REGEX = re.compile(r"""\s*(?:(?P<string>"[^"]*"|'[^']*')|(?P<op>==|!=|~=|=~|<=|>=|&&|\|\||[=<>();,!~])|(?P<word>[^\s()<>=!~,;"'&|]+))""")
+# Unquoted values after an operator run until whitespace, ";", ")", "&&" or "||"
+RAW_VALUE_REGEX = re.compile(r"""\s*(?P<value>(?:[^\s;)&|"']|&(?!&)|\|(?!\|))(?:[^\s;)&|]|&(?!&)|\|(?!\|))*)""")
+VALUE_OPERATORS = ("==", "=", "!=", "~=", "<=", ">=", "<", ">", "=~", "has", "matches")
+COMPARISONS = { "==" : operator.eq,
+                "="  : operator.eq,
+                "!=" : operator.ne,
+                "~=" : operator.ne,
+                "<=" : operator.le,
+                ">=" : operator.ge,
+                "<"  : operator.lt,
+                ">"  : operator.gt }
+
+#
+## Classes
+#
+
+class RecordFilter:
+    """A predicate that selects job records matching all requested criteria
+
+    The filter is compiled lazily on first use, so instances can be pickled and
+    sent to worker processes, which compile their own copy.
+
+    Args:
+        type_filter (str): Record types to keep (e.g., "E" or "ER")
+        id_filter (list): Short job ID prefixes, any of which may match
+        host_filter (list): Nodes which must all be used by the job
+        data_filters (list): (negation, operator, field, value) tuples, all of
+                             which must match
+        time_filter (list): Start and end datetimes of the record timestamp
+        expression (tuple): A parsed filter expression (see parse_expression)
+    """
+
+    def __init__(self, type_filter = None, id_filter = None, host_filter = None,
+                       data_filters = None, time_filter = None, expression = None):
+        self.type_filter = type_filter
+        self.id_filter = id_filter
+        self.host_filter = host_filter
+        self.data_filters = data_filters or []
+        self.time_filter = time_filter
+        self.expression = expression
+        self._compiled = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_compiled"] = None
+        return state
+
+    def __call__(self, record):
+        if self._compiled is None:
+            self.compile()
+
+        for check in self._compiled[1]:
+            if not check(record):
+                return False
+
+        return True
+
+    def check_line(self, line):
+        """Return False if a raw log line cannot possibly match the filter"""
+        if self._compiled is None:
+            self.compile()
+
+        for check in self._compiled[0]:
+            if not check(line):
+                return False
+
+        return True
+
+    def compile(self):
+        line_checks, record_checks = [], []
+
+        if self.type_filter:
+            types = self.type_filter
+            line_checks.append(lambda line: len(line) > 21 and line[20] in types)
+            record_checks.append(lambda record: record.type in types)
+
+        if self.id_filter:
+            ids = tuple(self.id_filter)
+            line_checks.append(lambda line: line[22:].startswith(ids))
+            record_checks.append(lambda record: record.short_id.startswith(ids))
+
+        if self.time_filter:
+            bounds = [t.strftime("%Y%m%d %H:%M:%S") for t in self.time_filter]
+            time_min, time_max = self.time_filter
+            line_checks.append(lambda line: bounds[0] <= line[6:10] + line[0:2] + line[3:5] + line[10:19] <= bounds[1])
+            record_checks.append(lambda record: time_min <= record.time <= time_max)
+
+        for node in order_nodes(self.get_conjuncts()):
+            line_check = compile_line_check(node)
+
+            if line_check:
+                line_checks.append(line_check)
+
+            record_checks.append(compile_node(node))
+
+        if self.host_filter:
+            hosts = self.host_filter
+            line_checks.append(lambda line: all("(" + host in line for host in hosts))
+            record_checks.append(lambda record: all(host in record.get_nodes() for host in hosts))
+
+        self._compiled = (line_checks, record_checks)
+
+    def to_dict(self):
+        """Return a JSON-serializable description of the filter"""
+        return {    "type_filter"   : self.type_filter,
+                    "id_filter"     : self.id_filter,
+                    "host_filter"   : self.host_filter,
+                    "data_filters"  : [encode_node(("clause",) + tuple(f)) for f in self.data_filters],
+                    "time_filter"   : [t.strftime(DATETIME_FORMATS[0]) for t in self.time_filter] if self.time_filter else None,
+                    "expression"    : encode_node(self.expression) if self.expression else None }
+
+    @classmethod
+    def from_dict(cls, filter_dict):
+        """Create a filter from the output of to_dict"""
+        time_filter = filter_dict.get("time_filter")
+
+        if time_filter:
+            time_filter = [datetime.datetime.strptime(t, DATETIME_FORMATS[0]) for t in time_filter]
+
+        expression = filter_dict.get("expression")
+        return cls(filter_dict.get("type_filter"), filter_dict.get("id_filter"), filter_dict.get("host_filter"),
+                   [decode_node(f)[1:] for f in filter_dict.get("data_filters") or ()], time_filter,
+                   decode_node(expression) if expression else None)
+
+    def get_conjuncts(self):
+        """Return the expression nodes which must all match"""
+        nodes = [("clause",) + tuple(data_filter) for data_filter in self.data_filters]
+
+        if self.expression:
+            if self.expression[0] == "and":
+                nodes.extend(self.expression[1])
+            else:
+                nodes.append(self.expression)
+
+        return nodes
+
+    def get_fields(self):
+        """Return the record attributes used by the filter"""
+        fields = set()
+        nodes = self.get_conjuncts()
+
+        while nodes:
+            node = nodes.pop()
+
+            if node[0] == "clause":
+                fields.add(node[3])
+            elif node[0] == "not":
+                nodes.append(node[1])
+            else:
+                nodes.extend(node[1])
+
+        if self.host_filter:
+            fields.add("exec_vnode")
+
+        return fields
+
+    def get_required_values(self, field):
+        """Return the values a field is restricted to by the filter, if any"""
+        for node in self.get_conjuncts():
+            if node[0] == "clause" and node[3] == field and not node[1]:
+                if node[2] is operator.eq:
+                    return [node[4]]
+                elif node[2] is is_in:
+                    return list(node[4])
+
+        return None
+
+#
+## Functions
+#
+
+def get_accessor(field):
+    """Return a function that retrieves a (possibly nested) field from a record"""
+    if "[" in field:
+        field_dict, field_key = field.split("[", 1)
+        field_key = field_key[:-1]
+        return lambda record: getattr(record, field_dict)[field_key]
+    else:
+        return operator.attrgetter(field)
+
+def coerce_value(expected, value_type):
+    """Convert a match value to the type of a record field"""
+    if isinstance(expected, (int, float)) and value_type in (int, float):
+        return expected
+
+    try:
+        if value_type is int:
+            try:
+                return int(expected)
+            except ValueError:
+                return float(expected)
+        elif value_type is float:
+            return float(expected)
+        elif issubclass(value_type, datetime.datetime):
+            for time_format in DATETIME_FORMATS:
+                try:
+                    return datetime.datetime.strptime(expected, time_format)
+                except ValueError:
+                    pass
+
+            return INCOMPARABLE
+        else:
+            return value_type(expected)
+    except (TypeError, ValueError):
+        return INCOMPARABLE
+
+def is_in(value, targets):
+    return value in targets
+
+def regex_search(value, pattern):
+    return pattern.search(str(value)) is not None
+
+# Names of clause operations when filters are serialized
+OPERATIONS = {  "eq"        : operator.eq,
+                "ne"        : operator.ne,
+                "le"        : operator.le,
+                "ge"        : operator.ge,
+                "lt"        : operator.lt,
+                "gt"        : operator.gt,
+                "contains"  : operator.contains,
+                "in"        : is_in,
+                "regex"     : regex_search }
+
+def encode_node(node):
+    """Convert an expression tree into JSON-serializable lists"""
+    if node[0] == "clause":
+        negation, operation, field, expected = node[1:]
+        name = next(n for n, o in OPERATIONS.items() if o is operation)
+        return ["clause", negation, name, field, list(expected) if operation is is_in else expected]
+    elif node[0] == "not":
+        return ["not", encode_node(node[1])]
+    else:
+        return [node[0], [encode_node(child) for child in node[1]]]
+
+def decode_node(node):
+    """Rebuild an expression tree from the output of encode_node"""
+    if node[0] == "clause":
+        negation, name, field, expected = node[1:]
+
+        if name not in OPERATIONS:
+            raise ValueError("unknown filter operation ({})".format(name))
+
+        return ("clause", bool(negation), OPERATIONS[name], field, tuple(expected) if name == "in" else expected)
+    elif node[0] == "not":
+        return ("not", decode_node(node[1]))
+    elif node[0] in ("and", "or"):
+        return (node[0], [decode_node(child) for child in node[1]])
+    else:
+        raise ValueError("unknown filter node ({})".format(node[0]))
+
+def compile_clause(negation, operation, field, expected):
+    """Compile a single filter clause into a record predicate
+
+    Records which lack the field, or whose value cannot be compared with the
+    match value, do not satisfy the comparison (before any negation).
+    """
+    get_value = get_accessor(field)
+    coerced = {}
+
+    if operation is operator.contains:
+        def compare(value):
+            return expected in str(value)
+    elif operation is regex_search:
+        pattern = re.compile(expected)
+
+        def compare(value):
+            return pattern.search(str(value)) is not None
+    elif operation is is_in:
+        def compare(value):
+            try:
+                targets = coerced[type(value)]
+            except KeyError:
+                targets = coerced[type(value)] = set(coerce_value(e, type(value)) for e in expected)
+
+            return value in targets
+    else:
+        def compare(value):
+            try:
+                target = coerced[type(value)]
+            except KeyError:
+                target = coerced[type(value)] = coerce_value(expected, type(value))
+
+            return target is not INCOMPARABLE and operation(value, target)
+
+    def check(record):
+        try:
+            result = bool(compare(get_value(record)))
+        except (AttributeError, KeyError, TypeError):
+            result = False
+
+        return result != negation
+
+    return check
+
+def compile_node(node):
+    """Compile an expression tree into a short-circuiting record predicate"""
+    if node[0] == "clause":
+        return compile_clause(*node[1:])
+    elif node[0] == "not":
+        check = compile_node(node[1])
+        return lambda record: not check(record)
+
+    checks = [compile_node(child) for child in order_nodes(node[1])]
+
+    if node[0] == "and":
+        def check(record):
+            for child_check in checks:
+                if not child_check(record):
+                    return False
+
+            return True
+    else:
+        def check(record):
+            for child_check in checks:
+                if child_check(record):
+                    return True
+
+            return False
+
+    return check
+
+def get_cost(node):
+    """Roughly estimate the relative cost of evaluating an expression node"""
+    if node[0] == "clause":
+        negation, operation, field, expected = node[1:]
+        cost = 2 if "[" in field else 1
+
+        if operation is regex_search:
+            cost += 4
+        elif operation in (is_in, operator.contains):
+            cost += 1
+
+        return cost
+    elif node[0] == "not":
+        return get_cost(node[1])
+    else:
+        return sum(get_cost(child) for child in node[1])
+
+def order_nodes(nodes):
+    return sorted(nodes, key = get_cost)
+
+def compile_line_check(node):
+    """Compile a cheap test of the raw log line for an expression, if one exists
+
+    The test is a necessary condition only; matching lines are still checked
+    after the record is parsed.
+    """
+    if node[0] in ("and", "or"):
+        checks = [compile_line_check(child) for child in node[1]]
+
+        if node[0] == "and" and any(checks):
+            checks = [c for c in checks if c]
+            return lambda line: all(check(line) for check in checks)
+        elif node[0] == "or" and all(checks):
+            return lambda line: any(check(line) for check in checks)
+        else:
+            return None
+    elif node[0] != "clause":
+        return None
+
+    negation, operation, field, expected = node[1:]
+
+    if negation or field not in TOKEN_FIELDS:
+        return None
+
+    if operation is operator.contains and isinstance(expected, str):
+        return lambda line: expected in line
+    elif operation in (operator.eq, is_in):
+        values = [expected] if operation is operator.eq else list(expected)
+
+        if not all(isinstance(v, str) for v in values):
+            return None
+
+        if field == "account":
+            values += ['"{}"'.format(v) for v in values]
+
+        tokens = tuple("{}{}={}{}".format(p, field, v, s) for p in (";", " ") for v in values for s in (" ", "\n"))
+        ends = tuple("{}={}".format(field, v) for v in values)
+
+        return lambda line: any(token in line for token in tokens) or line.endswith(ends)
+    else:
+        return None
+
+def tokenize(text):
+    tokens, position = [], 0
+    text = text.rstrip()
+
+    while position < len(text):
+        # Values such as select statements may themselves contain operator characters
+        if tokens and tokens[-1][0] == "op" and tokens[-1][1] in VALUE_OPERATORS:
+            match = RAW_VALUE_REGEX.match(text, position)
+
+            if match:
+                tokens.append(("value", match.group("value")))
+                position = match.end()
+                continue
+
+        match = TOKEN_REGEX.match(text, position)
+
+        if not match or match.end() == position:
+            raise ValueError("unexpected character in filter at position {}: {}".format(position, text[position:]))
+
+        if match.group("string"):
+            tokens.append(("value", match.group("string")[1:-1]))
+        elif match.group("op"):
+            tokens.append(("op", match.group("op")))
+        else:
+            word = match.group("word")
+
+            if word.lower() in ("and", "or", "not", "in", "has", "matches"):
+                tokens.append(("op", word.lower()))
+            else:
+                tokens.append(("value", word))
+
+        position = match.end()
+
+    return tokens
+
+def parse_expression(text, translate = None):
+    """Parse a freeform filter expression into a tree of tuples
+
+    Grammar (keywords are case-insensitive):
+        expr        := term (("or" | "||") term)*
+        term        := factor (("and" | "&&" | ";") factor)*
+        factor      := ("not" | "!" | "~") factor | "(" expr ")" | comparison
+        comparison  := FIELD OP VALUE | FIELD ["not"] "in" "(" VALUE ("," VALUE)* ")"
+        OP          := "==" | "=" | "!=" | "~=" | "<" | "<=" | ">" | ">=" | "has" |
+                       "=~" | "matches"
+
+    Args:
+        text (str): The filter expression
+        translate (function): Maps field names to record attributes
+
+    Returns:
+        tuple: ("and"|"or", [nodes]), ("not", node), or
+               ("clause", negation, operation, field, value)
+    """
+    tokens = tokenize(text)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def take(kind = None, value = None):
+        nonlocal position
+        token = peek()
+
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            raise ValueError("expected {} in filter but found {}".format(value or kind, token[1] or "end of input"))
+
+        position += 1
+        return token[1]
+
+    def parse_or():
+        nodes = [parse_and()]
+
+        while peek() in (("op", "or"), ("op", "||")):
+            take()
+            nodes.append(parse_and())
+
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and():
+        nodes = [parse_factor()]
+
+        while peek() in (("op", "and"), ("op", "&&"), ("op", ";")):
+            take()
+
+            if peek()[0] is None:
+                break
+
+            nodes.append(parse_factor())
+
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_factor():
+        if peek() in (("op", "not"), ("op", "!"), ("op", "~")):
+            take()
+            node = parse_factor()
+
+            if node[0] == "clause":
+                return ("clause", not node[1]) + node[2:]
+            else:
+                return ("not", node)
+        elif peek() == ("op", "("):
+            take()
+            node = parse_or()
+            take("op", ")")
+            return node
+        else:
+            return parse_comparison()
+
+    def parse_comparison():
+        field = take("value")
+        field = translate(field) if translate else field
+        negation = False
+        op = take("op")
+
+        if op == "not":
+            negation = True
+            op = take("op", "in")
+
+        if op == "in":
+            take("op", "(")
+            values = [take("value")]
+
+            while peek() == ("op", ","):
+                take()
+                values.append(take("value"))
+
+            take("op", ")")
+            return ("clause", negation, is_in, field, tuple(values))
+        elif op == "has":
+            return ("clause", negation, operator.contains, field, take("value"))
+        elif op in ("=~", "matches"):
+            pattern = take("value")
+
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError("invalid regular expression in filter ({})".format(e))
+
+            return ("clause", negation, regex_search, field, pattern)
+        elif op in COMPARISONS:
+            return ("clause", negation, COMPARISONS[op], field, take("value"))
+        else:
+            raise ValueError("unknown operator in filter: {}".format(op))
+
+    node = parse_or()
+
+    if position < len(tokens):
+        raise ValueError("unexpected token in filter: {}".format(tokens[position][1]))
+
+    return node
@@ -0,0 +1,165 @@
+"""
+Reading compressed daily accounting logs for qhist
+
+Sites often compress logs once they are no longer written. If the plain log for
+a day is missing, a sibling with a .gz, .zst, or .xz suffix is read instead.
+Compressed logs are decompressed as a stream in large blocks by a background
+thread, so decompression overlaps with parsing and no temporary files are
+written. Reading .zst logs requires the zstandard package (or Python 3.14).
+"""
+
+import io, os, queue, threading
+
+# Constants
+COMPRESSED_SUFFIXES = (".gz", ".zst", ".xz")
+READ_BLOCK = 1 << 20
+PREFETCH_BLOCKS = 4
+
+#
+## Classes
+#
+
+class PrefetchReader(io.RawIOBase):
+    """A raw stream that reads ahead from a decompressing file in a thread
+
+    Decompressors release the GIL while they work, so blocks are decompressed
+    while the consumer parses earlier ones. At most a few blocks are held at
+    once. Errors raised while reading are raised again to the consumer.
+
+    Args:
+        source (file): The decompressing file object
+        block_size (int): Number of decompressed bytes read at a time
+        prefetch (int): Maximum number of blocks read ahead
+        files (tuple): Other files to close along with the source
+    """
+
+    def __init__(self, source, block_size = READ_BLOCK, prefetch = PREFETCH_BLOCKS, files = ()):
+        self.source = source
+        self.files = files
+        self.blocks = queue.Queue(prefetch)
+        self.block = memoryview(b"")
+        self.eof = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target = self.fill, args = (block_size,), daemon = True)
+        self.thread.start()
+
+    def readable(self):
+        return True
+
+    def fill(self, block_size):
+        try:
+            while not self.stopping.is_set():
+                block = self.source.read(block_size)
+                self.put(block)
+
+                if not block:
+                    return
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        # Waits for the consumer unless the reader is closed
+        while not self.stopping.is_set():
+            try:
+                self.blocks.put(item, timeout = 0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readinto(self, buffer):
+        while not self.block:
+            if self.eof:
+                return 0
+
+            item = self.blocks.get()
+
+            if isinstance(item, Exception):
+                self.eof = True
+                raise item
+            elif not item:
+                self.eof = True
+                return 0
+
+            self.block = memoryview(item)
+
+        size = min(len(buffer), len(self.block))
+        buffer[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopping.set()
+            self.thread.join()
+
+            for f in (self.source,) + self.files:
+                f.close()
+
+        super().close()
+
+#
+## Functions
+#
+
+def is_compressed(data_file):
+    return data_file.endswith(COMPRESSED_SUFFIXES)
+
+def strip_suffix(file_name):
+    """Return the name of a log without any compression suffix"""
+    for suffix in COMPRESSED_SUFFIXES:
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+
+    return file_name
+
+def find_log_file(data_file):
+    """Return the path of a daily log, or of a compressed copy if only that exists"""
+    if os.path.exists(data_file):
+        return data_file
+
+    for suffix in COMPRESSED_SUFFIXES:
+        if os.path.exists(data_file + suffix):
+            return data_file + suffix
+
+    return data_file
+
+def open_decompressor(data_file, block_size = READ_BLOCK):
+    """Open a compressed log as a binary stream of decompressed data
+
+    Returns:
+        tuple: The decompressing file and the underlying compressed file
+    """
+    log_file = open(data_file, "rb", buffering = block_size)
+
+    try:
+        if data_file.endswith(".gz"):
+            import gzip
+            return gzip.GzipFile(fileobj = log_file), log_file
+        elif data_file.endswith(".xz"):
+            import lzma
+            return lzma.LZMAFile(log_file), log_file
+
+        try:
+            from compression import zstd
+            return zstd.ZstdFile(log_file), log_file
+        except ImportError:
+            pass
+
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ValueError("reading {} requires the {} package".format(data_file, e.name))
+
+        return zstandard.ZstdDecompressor().stream_reader(log_file, read_size = block_size), log_file
+    except BaseException:
+        log_file.close()
+        raise
+
+def open_log(data_file, block_size = READ_BLOCK, prefetch = PREFETCH_BLOCKS):
+    """Open a plain or compressed daily log as text, like open(data_file, "r")"""
+    if not is_compressed(data_file):
+        return open(data_file, "r")
+
+    source, log_file = open_decompressor(data_file, block_size)
+    reader = PrefetchReader(source, block_size, prefetch, (log_file,))
+    return io.TextIOWrapper(io.BufferedReader(reader, block_size))
@@ -4,23 +4,26 @@ qhist module for querying PBS Pro historical job records
 Todo:
     * Derived fields specified on the command-line or in config
     * More statistics
-    * Client-server mode of operation
-    * Memory-friendly sorting
 """
 
-import sys, os, argparse, datetime, signal, string, _string, json, operator, re, importlib, textwrap
+import sys, os, argparse, datetime, signal, string, _string, json, operator, re
+import itertools, time, functools, math
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from json.decoder import JSONDecodeError
-from pbsparse import get_pbs_records
-from glob import glob
+from json.encoder import encode_basestring_ascii
+from pbsparse import PbsRecord
+from .filters import RecordFilter, parse_expression, COMPARISONS
 
-
-# Use default signal behavior on system rather than throwing IOError
-signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+# Modules only needed by some modes (e.g., the record cache, sorting, grouped
+# statistics, exports, compressed logs, parallel reads, and orjson) are imported
+# when first used, as startup time dominates small queries. orjson is False
+# until it is imported.
+orjson = False
 
 # Constants
 ONE_DAY = datetime.timedelta(days = 1)
+TIME_DIVISORS = { "s" : 1.0, "m" : 60.0, "h" : 3600.0, "d" : 86400.0 }
 EMPTY_DATETIME = datetime.datetime(1,1,1)
 
 # Long-form help statements
@@ -53,13 +56,19 @@ The following variables are available:
 """
 
 filter_help = """
-This option allows you to filter job data by a semicolon-delimited list of fields
-and expressions. Note that '<', '>', and '~' (not) will be interpreted by the
-shell and thus you should encapsulate your expression in quotes.
+This option allows you to filter job data by an expression of fields and
+comparisons. Comparisons may be combined with "and" (or ";"), "or", and "not"
+(or "~"), and grouped using parentheses. Available comparisons are ==, ~= (not
+equal), <, <=, >, >=, "has" (contains), "in (a,b,...)", and "=~" (regular
+expression search). Values containing spaces or special characters should be
+quoted. Note that '<', '>', and '~' (not) will be interpreted by the shell and
+thus you should encapsulate your expression in quotes.
 
 Examples:
     qhist --filter="cputype==milan;ompthreads>1"
     qhist --filter="~queue==cpu"
+    qhist --filter="(queue==main or queue==preempt) and status~=0"
+    qhist --filter="user in (alice,bob) and name =~ '^wrf'"
 
 The following fields are available:
 """
@@ -110,6 +119,117 @@ class FillFormatter(string.Formatter):
         else:
             return " " * (len(format(EMPTY_DATETIME, format_spec)) - len(self.fill_value)) + self.fill_value
 
+class RowRenderer:
+    """Render rows of a table format that is compiled only once
+
+    Output matches FillFormatter(fill_value).format(fmt_spec, **data), but the
+    format string is parsed, and the field lookups, format specs, and fill
+    strings are resolved, when the renderer is created rather than for every
+    row. Conversions (e.g., "!r") are not applied to the fill value.
+
+    Args:
+        fmt_spec (str): The table format (with fields already translated)
+        fill_value (str): Value shown for fields missing from a row
+    """
+
+    def __init__(self, fmt_spec, fill_value = "-"):
+        self.fmt_spec = fmt_spec
+        self.fill_value = fill_value
+        self.template = ""
+        self.fields = []
+
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(fmt_spec):
+            self.template += literal.replace("%", "%%")
+
+            if field_name is None:
+                continue
+            elif not field_name or "{" in format_spec:
+                # Positional fields and nested specs are left to FillFormatter
+                self.fields = None
+                return
+
+            self.template += "%s"
+            self.fields.append(self.compile_field(field_name, format_spec, conversion))
+
+    def __call__(self, data):
+        if self.fields is None:
+            return FillFormatter(fill_value = self.fill_value).format(self.fmt_spec, **data)
+
+        return self.template % tuple([render(data) for render in self.fields])
+
+    def compile_field(self, field_name, format_spec, conversion):
+        first, rest = _string.formatter_field_name_split(field_name)
+        rest = tuple(rest)
+        convert = string.Formatter().convert_field
+
+        try:
+            fill = FillFormatter(fill_value = self.fill_value).format_field("fill_value", format_spec)
+        except ValueError:
+            fill = None
+
+        def render(data):
+            try:
+                value = data[first]
+
+                for is_attr, key in rest:
+                    if is_attr:
+                        value = getattr(value, key)
+                    else:
+                        value = value[key]
+            except KeyError:
+                if fill is None:
+                    FillFormatter(fill_value = self.fill_value).format_field("fill_value", format_spec)
+
+                return fill
+
+            if conversion:
+                value = convert(value, conversion)
+
+            try:
+                return format(value, format_spec)
+            except:
+                print(value, format_spec)
+                sys.exit()
+
+        return render
+
+class JsonWriter:
+    """Stream job records to a file as one JSON document or as NDJSON
+
+    Document output has the same layout as before, but each job is encoded
+    directly at its final indentation as it arrives. NDJSON output writes each
+    job as a compact object on its own line, using orjson if it is installed.
+
+    Args:
+        file (file): The file-like object to write to
+        ndjson (bool): Write newline-delimited JSON instead of a document
+    """
+
+    def __init__(self, file = None, ndjson = False):
+        self.file = file or sys.stdout
+        self.ndjson = ndjson
+        self.first_job = True
+
+    def begin(self):
+        if not self.ndjson:
+            self.file.write('{{\n    "timestamp":{},\n    "Jobs":{{\n'.format(int(datetime.datetime.today().timestamp())))
+
+    def write(self, job):
+        if self.ndjson:
+            json_dict = { "id" : job.id }
+            json_dict.update(get_json_dict(job))
+            self.file.write(dump_compact(json_dict) + "\n")
+        else:
+            if not self.first_job:
+                self.file.write(",\n")
+
+            self.file.write("        " + encode_basestring_ascii(job.id) + ": " + encode_json(get_json_dict(job), 2))
+            self.first_job = False
+
+    def end(self):
+        if not self.ndjson:
+            self.file.write("\n    }\n}\n")
+
 class QhistConfig:
     def __init__(self, default_config = None, time_format = "h"):
         if not default_config:
@@ -168,12 +288,27 @@ class QhistConfig:
 
         if not hasattr(self, "pbs_log_start"):
             try:
-                self.pbs_log_start = sorted(f for f in os.listdir(self.pbs_log_path) if os.path.isfile(os.path.join(self.pbs_log_path, f)))[0]
-            except FileNotFoundError:
-                exit("Error: log directory nof found ({})".format(self.pbs_log_path))
+                self.pbs_log_start = get_first_log(self.pbs_log_path)
             except AttributeError:
                 pass
 
+        for name, source in self.pbs_log_sources.items():
+            if "pbs_log_path" not in source:
+                exit("Error: log source {} has no pbs_log_path".format(name))
+            elif "pbs_log_start" not in source:
+                source["pbs_log_start"] = get_first_log(source["pbs_log_path"])
+
+    def get_log_sources(self):
+        """Return the name, log directory, and first log date of each log source
+
+        Without named sources in pbs_log_sources, the logs in pbs_log_path are
+        the only source and records are not given a source name.
+        """
+        if self.pbs_log_sources:
+            return [(name, source["pbs_log_path"], source["pbs_log_start"]) for name, source in self.pbs_log_sources.items()]
+        else:
+            return [(None, self.pbs_log_path, self.pbs_log_start)]
+
     def translate_format(self, format_str):
         new_format = ""
         si = 1
@@ -321,10 +456,121 @@ class QhistConfig:
 
         return new_format + format_str[(si - 1):]
 
+class OutputWriter:
+    """A file-like object that collects output and writes it in large chunks
+
+    Writing rows one at a time is costly when many jobs are sent to a pipe or
+    file, so text is joined and written to the stream once the buffer fills or
+    the writer is flushed. With line buffering, output is written as soon as
+    each line is complete (e.g., when following logs interactively).
+
+    Args:
+        stream (file): The stream to write to (default: sys.stdout)
+        buffer_size (int): Number of characters collected before writing
+        line_buffering (bool): Write output after every complete line
+    """
+
+    def __init__(self, stream = None, buffer_size = 1 << 18, line_buffering = False):
+        self.stream = stream or sys.stdout
+        self.buffer_size = buffer_size
+        self.line_buffering = line_buffering
+        self.chunks = []
+        self.size = 0
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+
+        if self.size >= self.buffer_size or (self.line_buffering and text.endswith("\n")):
+            self.flush()
+
+        return len(text)
+
+    def flush(self):
+        if self.chunks:
+            self.stream.write("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+class LogWindow:
+    """The lines between two byte offsets of a daily log
+
+    Lines are decoded as they are read, either forwards or (if reverse is set)
+    backwards in large blocks. The log is closed on exit.
+
+    Args:
+        log_file (file): The log, opened in binary mode
+        start (int): The offset of the first line
+        end (int): The offset just past the last line
+        reverse (bool): Yield lines from last to first
+        block_size (int): Number of bytes read at a time when reversing
+    """
+
+    def __init__(self, log_file, start, end, reverse = False, block_size = 1 << 20):
+        self.log_file = log_file
+        self.start = start
+        self.end = end
+        self.reverse = reverse
+        self.block_size = block_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.log_file.close()
+
+    def __iter__(self):
+        if self.reverse:
+            for line in self.read_reversed():
+                yield line.decode()
+        else:
+            self.log_file.seek(self.start)
+            remaining = self.end - self.start
+
+            for line in self.log_file:
+                if remaining <= 0:
+                    break
+
+                remaining -= len(line)
+                yield line.decode()
+
+    def read_reversed(self):
+        position, partial = self.end, b""
+
+        while position > self.start:
+            block_start = max(self.start, position - self.block_size)
+            self.log_file.seek(block_start)
+            lines = (self.log_file.read(position - block_start) + partial).split(b"\n")
+            position = block_start
+
+            # The first line of a block may continue in the previous block
+            partial = lines[0]
+
+            for line in reversed(lines[1:]):
+                if line:
+                    yield line
+
+        if partial:
+            yield partial
+
 #
 ## Functions
 #
 
+def get_first_log(log_path):
+    """Return the date of the oldest daily log in a directory"""
+    from .logs import strip_suffix
+
+    try:
+        return strip_suffix(sorted(f for f in os.listdir(log_path) if os.path.isfile(os.path.join(log_path, f)))[0])
+    except FileNotFoundError:
+        exit("Error: log directory nof found ({})".format(log_path))
+
 def get_time_bounds(log_start, log_format, period = None, days = 0):
     cur_date  = datetime.datetime.today()
 
@@ -357,12 +603,37 @@ def get_time_bounds(log_start, log_format, period = None, days = 0):
 
     return bounds
 
+@functools.lru_cache(maxsize = 32)
+def get_renderer(fmt_spec, fill_value = "-"):
+    return RowRenderer(fmt_spec, fill_value)
+
+def get_format_fields(fmt_spec):
+    """Return the record attributes used by a table format, or None if unknown"""
+    fields = set()
+
+    for literal, field_name, format_spec, conversion in string.Formatter().parse(fmt_spec):
+        if field_name is None:
+            continue
+        elif not field_name or "{" in format_spec:
+            return None
+
+        first, rest = _string.formatter_field_name_split(field_name)
+        key = next(rest, None)
+
+        if isinstance(first, int):
+            return None
+        elif key and not key[0]:
+            fields.add("{}[{}]".format(first, key[1]))
+        else:
+            fields.add(first)
+
+    return fields
+
 def tabular_output(data, fmt_spec, fill_value = "-"):
-    formatter = FillFormatter(fill_value = fill_value)
-    return formatter.format(fmt_spec, **data)
+    return get_renderer(fmt_spec, fill_value)(data)
 
-def list_output(job, fields, labels, format_str, nodes = False):
-    print(job.id)
+def list_output(job, fields, labels, format_str, nodes = False, file = None):
+    print(job.id, file = file)
 
     for field in fields:
         try:
@@ -373,18 +644,18 @@ def list_output(job, fields, labels, format_str, nodes = False):
                 value = getattr(job, field)
 
             if isinstance(value, float):
-                print(format_str.format(labels[field], "{:.2f}".format(value)))
+                print(format_str.format(labels[field], "{:.2f}".format(value)), file = file)
             else:
-                print(format_str.format(labels[field], value))
+                print(format_str.format(labels[field], value), file = file)
         except (AttributeError, KeyError) as e:
-            print(format_str.format(labels[field], "N/A"))
+            print(format_str.format(labels[field], "N/A"), file = file)
 
     if nodes:
-        print(format_str.format("Node List", "{}\n".format(",".join(job.get_nodes()))))
+        print(format_str.format("Node List", "{}\n".format(",".join(job.get_nodes()))), file = file)
     else:
-        print()
+        print(file = file)
 
-def csv_output(job, fields):
+def csv_output(job, fields, file = None):
     values = []
 
     for field in fields:
@@ -399,19 +670,117 @@ def csv_output(job, fields):
         except (AttributeError, KeyError) as e:
             values.append("")
 
-    print(",".join(values))
+    print(",".join(values), file = file)
 
-def json_output(job):
+def get_json_dict(job):
+    from .records import get_attributes
     json_dict = {}
 
-    for key, value in job.__dict__.items():
+    for key, value in get_attributes(job).items():
         if not key.startswith("_") and key != "id":
             if isinstance(value, datetime.datetime):
                 json_dict[key] = str(value)
             else:
                 json_dict[key] = value
 
-    return json.dumps({job.id : json_dict}, indent = 4)
+    return json_dict
+
+def json_output(job):
+    return json.dumps({job.id : get_json_dict(job)}, indent = 4)
+
+def encode_json(value, level = 0):
+    """Encode a value as indented JSON, starting at the given indentation level
+
+    The result is the same as json.dumps(value, indent = 4) would produce if it
+    were nested that many levels deep in a document.
+    """
+    if isinstance(value, dict):
+        if not value:
+            return "{}"
+
+        inner = "\n" + "    " * (level + 1)
+        items = (encode_basestring_ascii(str(k)) + ": " + encode_json(v, level + 1) for k, v in value.items())
+        return "{" + inner + ("," + inner).join(items) + "\n" + "    " * level + "}"
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            return "[]"
+
+        inner = "\n" + "    " * (level + 1)
+        return "[" + inner + ("," + inner).join(encode_json(v, level + 1) for v in value) + "\n" + "    " * level + "]"
+    elif type(value) is str:
+        return encode_basestring_ascii(value)
+    elif type(value) is int or (type(value) is float and math.isfinite(value)):
+        return repr(value)
+    else:
+        return json.dumps(value)
+
+def group_output(aggregator, labels, mode = "table", header = True, file = None):
+    """Print the results of grouped statistics in table, csv, json, or ndjson form"""
+    group_labels = [labels.get(f, f.capitalize()) for f in aggregator.group_fields]
+    stat_labels = aggregator.stat_labels
+    results = list(aggregator.results())
+
+    if mode == "csv":
+        if header:
+            print(",".join(group_labels + stat_labels), file = file)
+
+        for key, values in results:
+            print(",".join(list(key) + ["" if v is None else str(v) for v in values]), file = file)
+    elif mode == "ndjson":
+        for key, values in results:
+            group = OrderedDict(zip(aggregator.group_fields, key))
+            group.update(zip(stat_labels, values))
+            print(dump_compact(group), file = file)
+    elif mode == "json":
+        groups = []
+
+        for key, values in results:
+            group = OrderedDict(zip(aggregator.group_fields, key))
+            group.update(zip(stat_labels, values))
+            groups.append(group)
+
+        print(json.dumps({  "timestamp" : int(datetime.datetime.today().timestamp()),
+                            "Groups"    : groups }, indent = 4), file = file)
+    else:
+        specs, header_specs, widths = [], [], []
+
+        for n, label in enumerate(group_labels):
+            width = max([len(label)] + [len(key[n]) for key, _ in results])
+            specs.append("{{g{0}:{1}.{1}}}".format(n, width))
+            header_specs.append("{{:{0}.{0}}}".format(width))
+            widths.append(width)
+
+        for n, (label, stat_format) in enumerate(zip(stat_labels, aggregator.stat_formats)):
+            width = max(len(label), 10)
+            specs.append("{{s{}:>{}{}}}".format(n, width, stat_format))
+            header_specs.append("{{:>{0}.{0}}}".format(width))
+            widths.append(width)
+
+        table_format = " ".join(specs)
+
+        if header:
+            print(" ".join(header_specs).format(*(group_labels + stat_labels)), file = file)
+            print(" ".join("-" * width for width in widths), file = file)
+
+        for key, values in results:
+            row = { "g{}".format(n) : v for n, v in enumerate(key) }
+            row.update(("s{}".format(n), v) for n, v in enumerate(values) if v is not None)
+            print(tabular_output(row, table_format), file = file)
+
+def dump_compact(data):
+    """Encode data as compact JSON on a single line, using orjson if available"""
+    global orjson
+
+    if orjson is False:
+        try:
+            import orjson
+        except ImportError:
+            orjson = None
+
+    if orjson:
+        return orjson.dumps(data).decode()
+    else:
+        return json.dumps(data, separators = (",", ":"), ensure_ascii = False)
 
 def keep_going(bounds, log_date, reverse = False):
     if reverse:
@@ -419,30 +788,780 @@ def keep_going(bounds, log_date, reverse = False):
     else:
         return log_date <= bounds[1]
 
+def get_log_dates(bounds, reverse = False):
+    if reverse:
+        log_date = bounds[1]
+    else:
+        log_date = bounds[0]
+
+    while keep_going(bounds, log_date, reverse):
+        yield log_date
+
+        if reverse:
+            log_date -= ONE_DAY
+        else:
+            log_date += ONE_DAY
+
+def get_record_factory(CustomRecord = None, fields = None):
+    """Return the callable used to construct records from log lines
+
+    If the fields needed from each record are known, records are built
+    lazily from only those fields (unless a custom record class is used).
+    """
+    if fields is not None and CustomRecord is None:
+        from .records import LazyRecord
+        return functools.partial(LazyRecord, fields = fields)
+    else:
+        return CustomRecord or PbsRecord
+
+def read_log(data_file, CustomRecord = None, process = False, record_filter = None,
+             reverse = False, time_divisor = 1.0, fields = None, timer = None, sources = None):
+    """Yield the records in a daily log that match a filter
+
+    Raw lines are checked against the filter before records are constructed,
+    so most non-matching lines are never parsed. If a QueryTimer is given, the
+    stages of reading the log are timed. If the log belongs to a named source
+    in sources, records are given its name before they are filtered.
+    """
+    from .logs import is_compressed, open_log
+    compressed = is_compressed(data_file)
+
+    # Compressed logs can only be streamed forwards, so matches are reversed after reading
+    if compressed and reverse:
+        yield from reversed(list(read_log(data_file, CustomRecord, process, record_filter, False, time_divisor,
+                                          fields, timer, sources)))
+        return
+
+    try:
+        if compressed:
+            cm = open_log(data_file)
+        elif record_filter and record_filter.time_filter:
+            cm = open_time_window(data_file, record_filter.time_filter, reverse)
+        elif reverse:
+            from pbsparse.pbsparse import ReverseOpen
+            cm = ReverseOpen(data_file)
+        else:
+            cm = open(data_file, "r")
+    except FileNotFoundError:
+        print("Warning: no PBS records found for date in time range ({})".format(data_file), file = sys.stderr)
+
+        if timer:
+            timer.get_file_stats(data_file, "missing")
+
+        return
+    except ValueError as e:
+        print("Warning: {}".format(e), file = sys.stderr)
+        return
+
+    Record = get_record_factory(CustomRecord, fields)
+    source = sources.get(data_file) if sources else None
+
+    with cm as records:
+        if timer:
+            yield from timer.time_records(records, data_file, Record, process, record_filter, time_divisor, reverse,
+                                          source)
+            return
+
+        for line_number, record in enumerate(records):
+            if record_filter and not record_filter.check_line(record):
+                continue
+
+            event = Record(record, process, time_divisor = time_divisor, location = line_number)
+
+            if source:
+                event.source = source
+
+            if not record_filter or record_filter(event):
+                yield event
+
+def get_line_time(line):
+    """Return the time stamp of a raw log line in sortable form (YYYYmmdd HH:MM:SS)"""
+    return line[6:10] + line[0:2] + line[3:5] + line[10:19]
+
+def get_line_start(log_file, offset):
+    """Seek to the first line that starts at or after an offset and return its offset"""
+    if offset > 0:
+        log_file.seek(offset - 1)
+        log_file.readline()
+    else:
+        log_file.seek(0)
+
+    return log_file.tell()
+
+def find_time_offset(log_file, size, time_stamp, after = False):
+    """Find the first line of a log at (or after) a time with a binary search by offset
+
+    Args:
+        log_file (file): A daily log opened in binary mode
+        size (int): The size of the log in bytes
+        time_stamp (bytes): The time in sortable form (YYYYmmdd HH:MM:SS)
+        after (bool): Find the first line after the time rather than at it
+
+    Returns:
+        int: The offset of the line, or the size of the log if there is none
+    """
+    low, high = 0, size
+
+    while low < high:
+        middle = (low + high) // 2
+        get_line_start(log_file, middle)
+        line = log_file.readline()
+
+        if line and (get_line_time(line) <= time_stamp if after else get_line_time(line) < time_stamp):
+            low = middle + 1
+        else:
+            high = middle
+
+    return get_line_start(log_file, low)
+
+def open_time_window(data_file, time_filter, reverse = False):
+    """Open only the lines of a daily log that fall within a time window
+
+    PBS appends records in time order, so the first and last lines in the
+    window are found by a binary search on byte offsets instead of scanning the
+    log. Logs that lie entirely within the window are opened as usual.
+    """
+    log_file = open(data_file, "rb")
+
+    try:
+        size = os.fstat(log_file.fileno()).st_size
+        bounds = [t.strftime("%Y%m%d %H:%M:%S").encode() for t in time_filter]
+        start = find_time_offset(log_file, size, bounds[0])
+        end = find_time_offset(log_file, size, bounds[1], after = True)
+    except BaseException:
+        log_file.close()
+        raise
+
+    if start == 0 and end == size:
+        from pbsparse.pbsparse import ReverseOpen
+        log_file.close()
+        return ReverseOpen(data_file) if reverse else open(data_file, "r")
+    else:
+        return LogWindow(log_file, start, end, reverse)
+
+def read_appended(data_file, offset = 0, CustomRecord = None, process = False, record_filter = None,
+                  time_divisor = 1.0, fields = None, **record_opts):
+    """Parse the complete lines of a log from a byte offset onwards
+
+    A trailing partial line (one still being written) is left for the next
+    read. If the log has been truncated, it is read again from the start.
+
+    Returns:
+        tuple: The matching records and the offset at which to resume reading
+    """
+    Record = get_record_factory(CustomRecord, fields)
+    records = []
+
+    try:
+        log_file = open(data_file, "rb")
+    except FileNotFoundError:
+        return records, offset
+
+    with log_file:
+        if os.fstat(log_file.fileno()).st_size < offset:
+            offset = 0
+
+        log_file.seek(offset)
+
+        for line in log_file:
+            if not line.endswith(b"\n"):
+                break
+
+            location = offset
+            offset += len(line)
+            record = line.decode().rstrip("\n")
+
+            if record_filter and not record_filter.check_line(record):
+                continue
+
+            event = Record(record, process, time_divisor = time_divisor, location = location)
+
+            if not record_filter or record_filter(event):
+                records.append(event)
+
+    return records, offset
+
+def follow_logs(log_path, date_format, record_opts, interval = 2.0):
+    """Yield batches of records as they are appended to the current daily log
+
+    Only newly appended lines are parsed on each poll. Once the next day's log
+    appears, the remainder of the previous log is read before switching over.
+    Following stops on a keyboard interrupt.
+    """
+    data_file = os.path.join(log_path, datetime.datetime.today().strftime(date_format))
+    offset = 0
+
+    try:
+        while True:
+            records, offset = read_appended(data_file, offset, **record_opts)
+
+            if records:
+                yield records
+
+            next_file = os.path.join(log_path, datetime.datetime.today().strftime(date_format))
+
+            if next_file != data_file and os.path.isfile(next_file):
+                records, offset = read_appended(data_file, offset, **record_opts)
+
+                if records:
+                    yield records
+
+                data_file, offset = next_file, 0
+            else:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        return
+
+def filter_records(records, record_filter = None, reverse = False, **record_opts):
+    """Select already parsed records using a record filter"""
+    if reverse:
+        records = reversed(records)
+
+    if record_filter:
+        return filter(record_filter, records)
+    else:
+        return iter(records)
+
+def get_index_criteria(record_filter):
+    """Find the job, user, account, and host filters that can be answered by the index"""
+    criteria = []
+
+    if record_filter.id_filter:
+        criteria.append(("id", record_filter.id_filter))
+
+    # Jobs must have used every host in the filter
+    if record_filter.host_filter:
+        criteria.extend(("host", [host]) for host in record_filter.host_filter)
+
+    for field in ("user", "account"):
+        values = record_filter.get_required_values(field)
+
+        if values:
+            criteria.append((field, values))
+
+    return criteria
+
+def get_indexed_records(data_file, offsets, CustomRecord = None, process = False, time_divisor = 1.0,
+                        fields = None, sources = None, **record_opts):
+    """Read only the records found at the given byte offsets of a log"""
+    Record = get_record_factory(CustomRecord, fields)
+    records = []
+
+    with open(data_file, "rb") as log_file:
+        for offset in offsets:
+            log_file.seek(offset)
+            record = log_file.readline().decode().rstrip("\n")
+            records.append(Record(record, process, time_divisor = time_divisor, location = offset))
+
+    set_source(records, sources.get(data_file) if sources else None)
+    return filter_records(records, **record_opts)
+
+def set_source(records, source):
+    """Give records the name of the log source they were read from, if it has one"""
+    if source:
+        for record in records:
+            record.source = source
+
+def get_log_records(data_file, record_opts, cache = None):
+    """Return the records of a daily log, using the index or record cache if possible"""
+    record_filter = record_opts.get("record_filter")
+    type_filter = record_filter.type_filter if record_filter else None
+
+    if cache and cache.usable(type_filter) and os.path.isfile(data_file):
+        timer = record_opts.get("timer")
+
+        if timer:
+            return timer.time_cached(data_file, lambda: get_cached_records(data_file, record_opts, cache))
+        else:
+            return get_cached_records(data_file, record_opts, cache)
+    else:
+        return read_log(data_file, **record_opts)
+
+def get_cached_records(data_file, record_opts, cache):
+    """Return the records of a daily log from the index or record cache, filling the cache if needed"""
+    from .logs import is_compressed
+    record_filter = record_opts.get("record_filter")
+
+    # Index offsets refer to plain logs
+    if record_filter and not is_compressed(data_file):
+        criteria = get_index_criteria(record_filter)
+    else:
+        criteria = None
+
+    if criteria:
+        offsets = cache.index.lookup(data_file, criteria)
+
+        if offsets is not None:
+            return get_indexed_records(data_file, offsets, **record_opts)
+
+    Record = record_opts["CustomRecord"] or PbsRecord
+    source = record_opts.get("sources", {}).get(data_file)
+    records = cache.load(data_file, Record, record_opts["time_divisor"], source)
+
+    if records is None:
+        from .cache import CACHE_EVENTS
+        records = list(read_log(data_file, Record, True, RecordFilter(CACHE_EVENTS),
+                                time_divisor = record_opts["time_divisor"]))
+        cache.store(data_file, records, Record, record_opts["time_divisor"], source)
+
+    set_source(records, source)
+    return filter_records(records, **record_opts)
+
+def read_log_day(data_file, record_opts, cache = None):
+    """Read a daily log in a worker, returning its statistics if the query is timed"""
+    records = list(get_log_records(data_file, record_opts, cache))
+    timer = record_opts.get("timer")
+
+    # Workers time a copy of the timer, so the file statistics are sent back
+    return records, timer.files.get(data_file) if timer else None
+
+def init_worker(search_paths):
+    for search_path in search_paths:
+        if search_path not in sys.path:
+            sys.path.append(search_path)
+
+def get_daily_records(data_files, record_opts, processes = 1, search_paths = (), cache = None):
+    """Yield the records from each daily log in the order given
+
+    When more than one process is requested, logs are parsed by a pool of
+    workers ahead of the consumer, but results are still yielded in order. The
+    number of outstanding days is capped to limit memory usage.
+    """
+    if processes <= 1 or len(data_files) <= 1:
+        for data_file in data_files:
+            yield get_log_records(data_file, record_opts, cache)
+
+        return
+
+    import multiprocessing
+    pending = deque()
+    remaining = iter(data_files)
+    pool = multiprocessing.Pool(min(processes, len(data_files)), init_worker, (search_paths,))
+
+    timer = record_opts.get("timer")
+
+    try:
+        for data_file in remaining:
+            pending.append((data_file, pool.apply_async(read_log_day, (data_file, record_opts, cache))))
+
+            if len(pending) == 2 * processes:
+                break
+
+        while pending:
+            done_file, result = pending.popleft()
+            jobs, file_stats = result.get()
+            data_file = next(remaining, None)
+
+            if file_stats:
+                timer.files[done_file] = file_stats
+
+            if data_file:
+                pending.append((data_file, pool.apply_async(read_log_day, (data_file, record_opts, cache))))
+
+            yield jobs
+    finally:
+        pool.terminate()
+
+def get_served_records(served_days, data_files, read_days, source = None, timer = None):
+    """Yield the records of each day from qhistd, reading the remaining logs if it stops responding
+
+    Args:
+        served_days (generator): Lists of the records of each day from query_server
+        data_files (list): The daily logs, in the same order as the served days
+        read_days (function): Returns the records of each of a list of daily logs
+        source (str): The name of the log source, if it has one
+        timer (QueryTimer): Count the served records of each log
+    """
+    import socket
+    done = 0
+
+    try:
+        for records in served_days:
+            set_source(records, source)
+            yield timer.count_served(records) if timer else records
+            done += 1
+    except socket.timeout:
+        print("Warning: qhistd did not respond in time, so logs are read directly", file = sys.stderr)
+        yield from read_days(data_files[done:])
+
+def get_source_files(sources, log_dates, date_format, names = None):
+    """Find the daily logs of each log source, ordered by date
+
+    Sources that are excluded by name, and dates before the first log of a
+    source, are skipped.
+
+    Returns:
+        tuple: The log files, a mapping of each log file to its source name,
+               and the number of log files for each date
+    """
+    from .logs import find_log_file
+    data_files, file_sources, day_sizes = [], {}, []
+
+    if names is not None:
+        names = set(str(name) for name in names)
+        sources = [source for source in sources if source[0] in names]
+
+    starts = [datetime.datetime.strptime(log_start, date_format) for _, _, log_start in sources]
+
+    for log_date in log_dates:
+        day_start = datetime.datetime.strptime(log_date, date_format)
+        day_size = 0
+
+        for (name, log_path, _), log_start in zip(sources, starts):
+            if day_start >= log_start:
+                data_file = find_log_file(os.path.join(log_path, log_date))
+                data_files.append(data_file)
+                file_sources[data_file] = name
+                day_size += 1
+
+        day_sizes.append(day_size)
+
+    return data_files, file_sources, day_sizes
+
+def merge_sources(daily_records, day_sizes, reverse = False):
+    """Merge the records of each day's logs from multiple sources by time
+
+    Each log is already in time order (or reverse order), so the logs of a day
+    are merged lazily. Records with the same time keep the order of sources.
+    """
+    import heapq
+    daily_records = iter(daily_records)
+    get_time = operator.attrgetter("time")
+
+    for day_size in day_sizes:
+        day_records = [next(daily_records) for _ in range(day_size)]
+
+        if day_size == 1:
+            yield day_records[0]
+        elif day_size > 1:
+            yield heapq.merge(*day_records, key = get_time, reverse = reverse)
+
+def get_config(time_format = "h"):
+    """Load the default configuration followed by any server configuration"""
+    my_path = os.path.dirname(__file__)
+    config = QhistConfig(time_format = time_format)
+
+    # There are multiple ways to specify additional custom settings from here on
+    # We check them in order of their precedence here
+    if "QHIST_SERVER_CONFIG" in os.environ:
+        config.load_config(os.environ["QHIST_SERVER_CONFIG"])
+    else:
+        config_path = os.path.join(my_path, 'cfg', 'server.json')
+
+        if os.path.isfile(config_path):
+            config.load_config(config_path)
+        elif os.path.isfile("/etc/qhist/server.json"):
+            config.load_config("/etc/qhist/server.json")
+
+    # After all of this, we need to check if settings exist
+    if not hasattr(config, "pbs_log_path") and not config.pbs_log_sources:
+        exit("Error: path to PBS accounting logs not set by config file.")
+
+    return config
+
+def get_record_class(config):
+    """Import the custom record class named by the config from extensions
+
+    Extensions whose source defines the class are imported first, so other
+    extension modules are normally not imported at all.
+
+    Returns:
+        tuple: The record class (None for PbsRecord) and a list of paths that
+               must be searched to import it
+    """
+    my_path = os.path.dirname(__file__)
+    CustomRecord = None
+    search_paths = []
+
+    if config.record_class != "PbsRecord":
+        import importlib
+
+        extensions_path = os.path.join(my_path, "extensions")
+        class_regex = re.compile(r"^class\s+{}\b".format(re.escape(config.record_class)), re.MULTILINE)
+        extensions = []
+
+        try:
+            extension_files = [f for f in os.listdir(extensions_path) if f.endswith(".py")]
+        except FileNotFoundError:
+            extension_files = []
+
+        for extension_file in extension_files:
+            with open(os.path.join(extensions_path, extension_file)) as source_file:
+                defines_class = bool(class_regex.search(source_file.read()))
+
+            extensions.append((not defines_class, extension_file[:-3]))
+
+        if extensions:
+            sys.path.append(extensions_path)
+            search_paths.append(extensions_path)
+
+            for _, extension in sorted(extensions):
+                try:
+                    CustomRecord = importlib.import_module(extension).__getattribute__(config.record_class)
+                    break
+                except AttributeError:
+                    pass
+
+        if not CustomRecord:
+            exit("Error: given custom record class not found in code extensions ({})".format(config.record_class))
+
+    return CustomRecord, search_paths
+
+def get_data_filters(filters, translate = None):
+    """Convert a mapping of fields to match values into record filter clauses
+
+    String values follow the command-line conventions: a leading "~" selects
+    jobs without the value, and a leading "*" selects jobs whose value contains
+    the rest. A (comparison, value) pair such as (">", 0.5) is also accepted.
+    """
+    data_filters = []
+
+    for field, value in filters.items():
+        field = translate(field) if translate else field
+
+        if isinstance(value, tuple):
+            comparison, value = value
+
+            if comparison not in COMPARISONS:
+                raise ValueError("unknown comparison in filter: {}".format(comparison))
+
+            data_filters.append((False, COMPARISONS[comparison], field, value))
+        elif isinstance(value, str) and value[:1] == "~":
+            data_filters.append((False, operator.ne, field, value[1:]))
+        elif isinstance(value, str) and value[:1] == "*":
+            data_filters.append((False, operator.contains, field, value[1:]))
+        else:
+            data_filters.append((False, operator.eq, field, value))
+
+    return data_filters
+
+def query(period = None, days = 0, events = "E", jobs = None, hosts = None, filters = None, expression = None,
+          reverse = False, sort_by = None, top = None, fields = None, batch_size = 10000, time_units = "h",
+          follow = False, config = None, use_cache = True, use_server = True, processes = None, attributes = None,
+          timer = None, arrays = "expand"):
+    """Query the PBS accounting records of finished jobs
+
+    This is the interface used by the qhist command, for programs that want
+    records without running qhist and parsing its output. Logs are read
+    lazily as the result is consumed. Invalid arguments raise a ValueError.
+
+    Args:
+        period (str): Date range (YYYYmmdd-YYYYmmdd, optionally with THHMMSS
+                      times) or a single day (YYYYmmdd)
+        days (int): Number of days prior to today to search if no period given
+        events (str): Record types to return (E=end, R=requeue)
+        jobs (list): Only return records for these job IDs
+        hosts (list): Only return jobs that ran on these nodes
+        filters (dict): Field values to match (e.g., {"user" : "~alice",
+                        "waittime" : (">", 0.5)}), using command-line prefixes
+        expression (str): A filter expression, as accepted by --filter
+        reverse (bool): Return records from newest to oldest
+        sort_by (str): Sort records by this field (in descending order if reverse)
+        top (int): Only return the first N records
+        fields (list): Return batches of these fields instead of records
+        batch_size (int): Maximum number of records in each batch of fields
+        time_units (str): Units of time deltas (s, m, h, or d)
+        follow (bool): Continue returning records as jobs finish
+        config (QhistConfig): Settings to use (default: site configuration)
+        use_cache (bool): Use the record cache, if one is configured
+        use_server (bool): Use the qhistd service, if configured and running
+        processes (int): Number of processes used to read daily logs
+        attributes (list): Record attributes that will be used (e.g., "user",
+                           "Resource_List[ncpus]"); if given, only these are
+                           parsed up front and the rest on first access
+        timer (QueryTimer): Collect stage times and per-log statistics
+        arrays (str): "collapse" to roll up the subjobs of each job array into
+                      one record (see arrays.collapse_arrays), or "expand"
+
+    Returns:
+        iterator: Job records, or dictionaries mapping each field to a list
+                  of values if fields are given
+    """
+    if time_units not in TIME_DIVISORS:
+        raise ValueError("unknown time units ({})".format(time_units))
+    elif arrays not in ("expand", "collapse"):
+        raise ValueError("unknown array mode ({})".format(arrays))
+
+    config = config or get_config(time_units)
+    CustomRecord, search_paths = get_record_class(config)
+    time_divisor = TIME_DIVISORS[time_units]
+
+    # Time bounds, if set
+    time_filters = None
+
+    if period and "T" in period:
+        if "-" not in period:
+            print("Warning: Time only valid when specifying period range. Ignoring...", file = sys.stderr)
+        else:
+            time_filters = []
+            input_format = "%Y%m%dT%H%M%S"
+
+            for bound in period.split("-"):
+                time_filters.append(datetime.datetime.strptime(bound, input_format[0:(len(bound) - 2)]))
+
+    if jobs:
+        id_filter = [job.split(".")[0] if "." in job else job for job in jobs]
+    else:
+        id_filter = None
+
+    data_filters = get_data_filters(filters or {}, config.translate_field)
+
+    if expression:
+        filter_expression = parse_expression(expression, config.translate_field)
+    else:
+        filter_expression = None
+
+    record_filter = RecordFilter(events, id_filter, hosts or None, data_filters, time_filters, filter_expression)
+    sources = config.get_log_sources()
+    log_start = min((source[2] for source in sources), key = lambda d: datetime.datetime.strptime(d, config.pbs_date_format))
+    bounds = get_time_bounds(log_start, config.pbs_date_format, period = period, days = days)
+    log_dates = [datetime.datetime.strftime(log_date, config.pbs_date_format) for log_date in get_log_dates(bounds, reverse)]
+    record_opts = { "CustomRecord"  : CustomRecord,
+                    "process"       : True,
+                    "record_filter" : record_filter,
+                    "reverse"       : reverse,
+                    "time_divisor"  : time_divisor }
+
+    if len(sources) > 1:
+        data_files, record_opts["sources"], day_sizes = get_source_files(sources, log_dates, config.pbs_date_format,
+                                                                         record_filter.get_required_values("source"))
+    else:
+        from .logs import find_log_file
+        data_files, day_sizes = [find_log_file(os.path.join(sources[0][1], log_date)) for log_date in log_dates], None
+
+        if sources[0][0]:
+            record_opts["sources"] = { data_file : sources[0][0] for data_file in data_files }
+
+    if timer:
+        timer.set_logs({ name : log_path for name, log_path, _ in sources }, config.pbs_date_format)
+        record_opts["timer"] = timer
+
+    # Records are built from only the fields that will be used, if known
+    if fields:
+        from .export import get_record_field
+        attributes = set(attributes or ()) | set(get_record_field(f, config.translate_field) for f in fields)
+
+    if attributes is not None:
+        from .records import expand_fields
+        attributes = set(attributes) | record_filter.get_fields()
+
+        if sort_by:
+            attributes.add(config.translate_field(sort_by))
+
+        if arrays == "collapse":
+            from .arrays import ARRAY_FIELDS
+            attributes.update(ARRAY_FIELDS)
+
+        record_opts["fields"] = expand_fields(attributes)
+
+    # In follow mode, the current day is read incrementally after any prior days
+    if follow:
+        if reverse or sort_by:
+            raise ValueError("following new jobs cannot be combined with reverse order or sorting")
+        elif len(sources) > 1:
+            raise ValueError("following new jobs is not supported with multiple log sources")
+        elif log_dates[-1] != datetime.datetime.today().strftime(config.pbs_date_format):
+            raise ValueError("following new jobs requires a time range that ends on the current day")
+
+        log_dates, data_files = log_dates[:-1], data_files[:-1]
+
+    if config.cache_path and use_cache:
+        from .cache import RecordCache
+        cache = RecordCache(config.cache_path, config.pbs_date_format)
+    else:
+        cache = None
+
+    # Logs from multiple sources are read concurrently unless a number of processes is set
+    if processes is None:
+        processes = max(config.jobs_parallel, len(sources) if day_sizes else 1)
+
+    daily_records = None
+
+    # Use the qhistd service if one is configured and reachable (it serves a single log directory)
+    if config.server_socket and log_dates and use_server and not day_sizes:
+        from .server import query_server, QhistServer
+
+        if QhistServer.store_usable(record_filter):
+            try:
+                served_days = query_server(config.server_socket, log_dates, record_filter, reverse, time_divisor,
+                                           CustomRecord, config.server_timeout)
+            except OSError:
+                pass
+            else:
+                read_days = lambda remaining: get_daily_records(remaining, record_opts, processes, search_paths, cache)
+                daily_records = get_served_records(served_days, data_files, read_days, sources[0][0], timer)
+
+    if daily_records is None:
+        daily_records = get_daily_records(data_files, record_opts, processes, search_paths, cache)
+
+        if day_sizes:
+            daily_records = merge_sources(daily_records, day_sizes, reverse)
+
+    if follow:
+        daily_records = itertools.chain(daily_records, follow_logs(sources[0][1], config.pbs_date_format,
+                                                                   record_opts, config.follow_interval))
+
+    records = itertools.chain.from_iterable(daily_records)
+
+    # Arrays are rolled up before sorting, so that each array is sorted (and counted by top) as one record
+    if arrays == "collapse":
+        from .arrays import collapse_arrays
+        records = collapse_arrays(records, reverse)
+
+    if sort_by:
+        from .sorting import sort_records
+        records = sort_records(records, config.translate_field(sort_by), reverse, top, config.sort_memory_limit)
+    elif top is not None:
+        records = itertools.islice(records, top)
+
+    if fields:
+        from .export import get_column_batches
+        return get_column_batches(records, fields, config.translate_field, batch_size)
+    else:
+        return records
+
 def get_parser():
     # Argument dictionary storage
     help_dict = {   "account"   : "filter jobs by a specific account/project code",
+                    "arrays"    : "show each subjob of job arrays (expand) or one summary row per array (collapse)",
                     "average"   : "print average resource statistics in default/wide mode",
                     "csv"       : "output jobs in csv format",
                     "days"      : "number of days prior to search (default = 0)",
                     "events"    : "list of events to display (E=end, R=requeue)",
+                    "export"    : "write typed columns of job data to a file instead of printing jobs",
+                    "expformat" : "format of the export file (default: inferred from the file extension)",
                     "filter"    : "specify a freeform filter (--filter=help for more)",
+                    "follow"    : "after printing jobs, wait for and print jobs as they finish",
                     "format"    : "use custom format (--format=help for more)",
+                    "group"     : "print statistics grouped by a comma-delimited list of fields (day and month also allowed)",
+                    "interval"  : "length of utilization intervals (e.g., 15m, 1h, or 1d; default = 1h)",
                     "hosts"     : "only print jobs that ran on specified comma-delimited list of nodes",
                     "json"      : "output jobs in json format",
+                    "ndjson"    : "output jobs as newline-delimited json (one compact object per line)",
+                    "linebuf"   : "write each line of output immediately (e.g., with --follow)",
+                    "parallel"  : "number of processes used to read daily logs",
                     "jobs"      : "one or more job IDs",
                     "list"      : "display untruncated output in list format",
                     "mode"      : "output mode",
                     "name"      : "only print jobs that have the specified job name",
                     "nodes"     : "show list of nodes for each job",
+                    "nodereport": "print job counts, busy hours, and failed jobs for each node (only HOSTs with --hosts)",
+                    "nocache"   : "do not read or write the record cache",
                     "noheader"  : "do not display a header for tabular output",
+                    "noserver"  : "read logs directly instead of querying the qhistd service",
                     "period"    : "specify time range (YYYYmmdd-YYYYmmdd or YYYYmmdd for a single day)",
+                    "profile"   : "profile the run with cProfile and print the costliest functions to stderr (or save the profile to FILE)",
                     "queue"     : "filter jobs by a specific queue",
-                    "reverse"   : "print jobs in reverse order",
+                    "reverse"   : "print jobs in reverse order (or descending order when sorting)",
+                    "sort"      : "sort jobs by the given field (--format=help for fields)",
+                    "stats"     : "comma-delimited statistics to compute (e.g., count,sum(numcpus*elapsed),p95(memory))",
+                    "timing"    : "print the time spent in each stage and statistics for each log to stderr",
                     "status"    : "if exit status given, filter jobs; otherwise, add status column",
                     "time"      : "display time deltas in seconds, minutes, or hours (default)",
+                    "top"       : "only print the first N jobs (in sorted order if sorting)",
                     "units"     : "add units to tabular or csv headers",
                     "user"      : "filter jobs by a specific user",
+                    "util"      : "print the average running jobs and busy CPUs, GPUs, and nodes in each interval",
                     "wait"      : "show jobs with queue waits above value in minutes",
                     "wide"      : "use wide table columns and show job names" }
 
@@ -452,25 +1571,43 @@ def get_parser():
     # Optional arguments
     parser.add_argument("-A", "--account",  help = help_dict["account"])
     parser.add_argument("-a", "--average",  help = help_dict["average"],     action = "store_true")
+    parser.add_argument("--arrays",         help = help_dict["arrays"],      default = "expand", choices = ["expand", "collapse"])
     parser.add_argument("-c", "--csv",      help = help_dict["csv"],         action = "store_true")
     parser.add_argument("-d", "--days",     help = help_dict["days"],        default = 0)
     parser.add_argument("-e", "--events",   help = help_dict["events"],      default = "E")
+    parser.add_argument("--export",         help = help_dict["export"],      metavar = "FILE")
+    parser.add_argument("--export-format",  help = help_dict["expformat"],   choices = ["parquet", "arrow", "npz"])
     parser.add_argument("-F", "--filter",   help = help_dict["filter"])
     parser.add_argument("-f", "--format",   help = help_dict["format"])
+    parser.add_argument("--follow",         help = help_dict["follow"],      action = "store_true")
+    parser.add_argument("-g", "--group-by", help = help_dict["group"],       metavar = "FIELDS")
     parser.add_argument("-H", "--hosts",    help = help_dict["hosts"],       nargs = "*", metavar = "HOST")
+    parser.add_argument("--interval",       help = help_dict["interval"],    default = "1h")
     parser.add_argument("-J", "--json",     help = help_dict["json"],        action = "store_true")
     parser.add_argument("-j", "--jobs",     help = help_dict["jobs"],        nargs = "*", metavar = "JOBID")
+    parser.add_argument("--jobs-parallel",  help = help_dict["parallel"],    type = int, metavar = "N")
     parser.add_argument("-l", "--list",     help = help_dict["list"],        action = "store_true")
+    parser.add_argument("--line-buffered",  help = help_dict["linebuf"],     action = "store_true")
     parser.add_argument("-N", "--name",     help = help_dict["name"],        dest = "jobname")
     parser.add_argument("-n", "--nodes",    help = help_dict["nodes"],       action = "store_true")
+    parser.add_argument("--node-report",    help = help_dict["nodereport"],  action = "store_true")
+    parser.add_argument("--nocache",        help = help_dict["nocache"],     action = "store_true")
+    parser.add_argument("--ndjson",         help = help_dict["ndjson"],      action = "store_true")
     parser.add_argument("--noheader",       help = help_dict["noheader"],    action = "store_true")
+    parser.add_argument("--noserver",       help = help_dict["noserver"],    action = "store_true")
     parser.add_argument("-p", "--period",   help = help_dict["period"])
+    parser.add_argument("--profile",        help = help_dict["profile"],     nargs = "?", const = "-", metavar = "FILE")
     parser.add_argument("-q", "--queue",    help = help_dict["queue"])
     parser.add_argument("-r", "--reverse",  help = help_dict["reverse"],     action = "store_true")
+    parser.add_argument("--stats",          help = help_dict["stats"])
+    parser.add_argument("--stats-timing",   help = help_dict["timing"],      nargs = "?", const = "text", choices = ["text", "json"])
+    parser.add_argument("-S", "--sort-by",  help = help_dict["sort"],        metavar = "FIELD")
     parser.add_argument("-s", "--status",   help = help_dict["status"],      nargs = "?", dest = "Exit_status", const = "field")
     parser.add_argument("-t", "--time",     help = help_dict["time"],        default = "h", choices = ["s","m","h","d"])
+    parser.add_argument("--top",            help = help_dict["top"],         type = int, metavar = "N")
     parser.add_argument("-U", "--units",    help = help_dict["units"],       action = "store_true")
     parser.add_argument("-u", "--user",     help = help_dict["user"])
+    parser.add_argument("--utilization",    help = help_dict["util"],        action = "store_true")
     parser.add_argument("-W", "--wait",     help = help_dict["wait"])
     parser.add_argument("-w", "--wide",     help = help_dict["wide"],        action = "store_true")
 
@@ -481,52 +1618,40 @@ def get_parser():
 #
 
 def main():
-    my_path = os.path.dirname(__file__)
+    # Use default signal behavior on system rather than throwing IOError
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
 
     # Handle job ID and log path arguments
     parser = get_parser()
     args = parser.parse_args()
 
-    # Load the default configuration settings
-    config = QhistConfig(time_format = args.time)
+    if args.profile:
+        import cProfile, pstats
+        profiler = cProfile.Profile()
 
-    # There are multiple ways to specify additional custom settings from here on
-    # We check them in order of their precedence here
-    if "QHIST_SERVER_CONFIG" in os.environ:
-        config.load_config(os.environ["QHIST_SERVER_CONFIG"])
+        try:
+            profiler.runcall(run, args)
+        finally:
+            if args.profile == "-":
+                pstats.Stats(profiler, stream = sys.stderr).sort_stats("cumulative").print_stats(30)
+            else:
+                profiler.dump_stats(args.profile)
     else:
-        config_path = os.path.join(my_path, 'cfg', 'server.json')
-
-        if os.path.isfile(config_path):
-            config.load_config(config_path)
-        elif os.path.isfile("/etc/qhist/server.json"):
-            config.load_config("/etc/qhist/server.json")
-
-    # After all of this, we need to check if settings exist
-    if not hasattr(config, "pbs_log_path"):
-        exit("Error: path to PBS accounting logs not set by config file.")
-
-    # If a custom record type is defined, we should import extensions
-    CustomRecord = None
-
-    if config.record_class != "PbsRecord":
-        extensions_path = os.path.join(my_path, "extensions")
-        extension_files = glob(extensions_path + "/*.py")
-
-        if extension_files:
-            sys.path.append(os.path.join(my_path, "extensions"))
+        run(args)
 
-            for extension_file in extension_files:
-                extension = re.search(".*/(.*).py", extension_file).group(1)
+def run(args):
+    """Run the qhist command with parsed arguments"""
+    if args.stats_timing:
+        from .timing import QueryTimer
+        timer = QueryTimer()
+    else:
+        timer = None
 
-                try:
-                    CustomRecord = importlib.import_module(extension).__getattribute__(config.record_class)
-                    break
-                except AttributeError:
-                    pass
+    # Load the default configuration settings and any server settings
+    config = get_config(args.time)
 
-        if not CustomRecord:
-            exit("Error: given custom record class not found in code extensions ({})".format(config.record_class))
+    if timer:
+        timer.stages["config"] = time.perf_counter() - timer.start
 
     # Long-form help
     if args.format == "help":
@@ -546,37 +1671,17 @@ def main():
         print()
         sys.exit()
 
-    # Time format option
-    if args.time == "h":
-        time_divisor = 3600.0
-    elif args.time == "m":
-        time_divisor = 60.0
-    elif args.time == "s":
-        time_divisor = 1.0
-    elif args.time == "d":
-        time_divisor = 86400.0
-
-    # Time bounds, if set
-    time_filters = None
-
-    if args.period and "T" in args.period:
-        if "-" not in args.period:
-            print("Warning: Time only valid when specifying period range. Ignoring...", file = sys.stderr)
-        else:
-            time_filters = []
-            input_format = "%Y%m%dT%H%M%S"
-
-            for bound in args.period.split("-"):
-                time_filters.append(datetime.datetime.strptime(bound, input_format[0:(len(bound) - 2)]))
+    # Output is collected and written in large chunks (by line when following)
+    out = OutputWriter(line_buffering = args.line_buffered or args.follow)
 
     # Collect filter parameters
     if args.jobs:
         if len(args.jobs) == 1:
-            id_filter = [job.split(".")[0] if "." in job else job for job in args.jobs[0].split(",")]
+            jobs = args.jobs[0].split(",")
         else:
-            id_filter = [job.split(".")[0] if "." in job else job for job in args.jobs]
+            jobs = args.jobs
     else:
-        id_filter = None
+        jobs = None
 
     if args.hosts:
         if len(args.hosts) == 1:
@@ -586,48 +1691,98 @@ def main():
     else:
         host_filter = None
 
-    data_filters = []
-    ops = OrderedDict([("==",    operator.eq),
-                       ("~=",    operator.ne),
-                       ("<=",    operator.le),
-                       (">=",    operator.ge),
-                       ("=",     operator.eq),
-                       ("<",     operator.lt),
-                       (">",     operator.gt),
-                       (" has ", operator.contains)])
+    filters = {}
 
     for arg_filter in ("account", "jobname", "queue", "user", "Exit_status"):
         filter_value = getattr(args, arg_filter)
 
-        if filter_value:
-            if filter_value[0] == "~":
-                data_filters.append((False, operator.ne, arg_filter, filter_value[1:]))
-            elif filter_value[0] == "*":
-                data_filters.append((False, operator.contains, arg_filter, filter_value[1:]))
-            elif not filter_value == "field":
-                data_filters.append((False, operator.eq, arg_filter, filter_value))
+        if filter_value and filter_value != "field":
+            filters[arg_filter] = filter_value
 
     if args.wait:
         if args.wait[0] == "~":
-            data_filters.append((False, operator.le, "waittime", float(args.wait[1:]) / 60))
+            filters["waittime"] = ("<=", float(args.wait[1:]) / 60)
         else:
-            data_filters.append((False, operator.gt, "waittime", float(args.wait) / 60))
-
-    if args.filter:
-        for fexpr in args.filter.split(";"):
-            for op in ops:
-                if op in fexpr:
-                    if fexpr[0] == "~":
-                        negation = True
-                        field, match = [e.strip() for e in fexpr[1:].split(op)]
-                    else:
-                        negation = False
-                        field, match = [e.strip() for e in fexpr.split(op)]
+            filters["waittime"] = (">", float(args.wait) / 60)
 
-                    data_filters.append((negation, ops[op], config.translate_field(field), match))
-                    break
+    # Grouped statistics (or the per-node report or utilization series) replace the per-job output
+    if args.node_report or args.utilization:
+        if args.group_by or args.stats or (args.node_report and args.utilization):
+            exit("Error: --node-report and --utilization cannot be combined with each other or grouped statistics")
+
+        if args.node_report:
+            from .stats import NodeAggregator
+            aggregator = NodeAggregator(TIME_DIVISORS[args.time], host_filter)
 
-    if args.list or args.csv or args.json:
+            # The report covers jobs on any of the hosts, while the query filter requires all of them
+            if host_filter and len(host_filter) > 1:
+                host_filter = None
+        else:
+            from .stats import UtilizationSeries, get_interval
+
+            try:
+                aggregator = UtilizationSeries(get_interval(args.interval))
+            except ValueError as e:
+                exit("Error: {}".format(e))
+    elif args.group_by or args.stats:
+        group_fields = args.group_by.split(",") if args.group_by else []
+
+        if args.stats:
+            stats = args.stats.split(",")
+        else:
+            stats = config.group_stats
+
+        from .stats import GroupAggregator
+
+        try:
+            aggregator = GroupAggregator(group_fields, stats, config.translate_field)
+        except ValueError as e:
+            exit("Error: {}".format(e))
+    else:
+        aggregator = None
+
+    # Columnar export also replaces the per-job output
+    if args.export:
+        if aggregator:
+            exit("Error: --export cannot be combined with grouped statistics")
+
+        if args.format:
+            export_fields = args.format.split(",")
+        else:
+            export_fields = list(config.long_fields)
+
+        if args.nodes and "nodelist" not in export_fields:
+            export_fields.append("nodelist")
+
+        from .export import ColumnExporter, get_export_format
+
+        try:
+            export_format = get_export_format(args.export, args.export_format)
+            exporter = ColumnExporter(args.export, export_format, export_fields, config.translate_field)
+        except ValueError as e:
+            exit("Error: {}".format(e))
+    else:
+        exporter = None
+
+    if args.follow and aggregator:
+        exit("Error: --follow cannot be combined with grouped statistics")
+    elif args.arrays == "collapse" and aggregator:
+        exit("Error: --arrays collapse cannot be combined with grouped statistics")
+
+    # Only the record fields used by the output are parsed up front (JSON uses all)
+    attributes = None
+
+    if exporter:
+        # Field names are stored in the export file rather than printed
+        attributes = exporter.record_fields
+    elif aggregator:
+        attributes = aggregator.record_fields
+
+        if args.wide:
+            labels = config.wide_labels
+        else:
+            labels = config.default_labels
+    elif args.list or args.csv or args.json or args.ndjson:
         max_width = 0
 
         if args.format:
@@ -636,7 +1791,13 @@ def main():
             fields = [config.translate_field(f) for f in field_list]
         else:
             labels = {config.translate_field(f) : config.wide_labels[f] for f in config.long_fields}
-            fields = config.long_fields_data
+            fields = list(config.long_fields_data)
+
+            # Rolled up arrays also show the subjob counts and ranges
+            if args.arrays == "collapse":
+                for f in ("subjobs", "statuses", "minelapsed", "maxelapsed", "minmemory", "maxmemory"):
+                    labels[config.translate_field(f)] = config.wide_labels[f]
+                    fields.append(config.translate_field(f))
 
         if args.list:
             for l in labels.values():
@@ -647,20 +1808,26 @@ def main():
 
             list_format = "   {:" + str(max_width) + "} = {}"
 
-        if args.list or args.json:
+        if args.list or args.json or args.ndjson:
             try:
                 fields.remove("id")
             except ValueError:
                 pass
+
+            if args.list:
+                attributes = set(fields)
         else:
             if args.nodes and "nodelist" not in fields:
                 fields.append("nodelist")
 
             if not args.noheader:
                 if args.units:
-                    print(",".join(labels[f] for f in fields))
+                    print(",".join(labels[f] for f in fields), file = out)
                 else:
-                    print(",".join(labels[f].split('(')[0].rstrip() for f in fields))
+                    print(",".join(labels[f].split('(')[0].rstrip() for f in fields), file = out)
+
+            from .export import get_record_field
+            attributes = set(get_record_field(f) for f in fields)
     else:
         format_type = "default"
 
@@ -672,7 +1839,9 @@ def main():
         if args.wide:
             format_type = "wide"
 
-        if args.Exit_status == "field":
+        if args.arrays == "collapse":
+            format_type += "_arrays"
+        elif args.Exit_status == "field":
             format_type += "_status"
 
         if args.format:
@@ -680,20 +1849,24 @@ def main():
                 user_format = "{short_id:7.7} " + config.legacy_translate(args.format)
 
                 if not args.noheader:
-                    print(config.generate_header(format_type, custom_format = user_format, units = "inline", divider = False))
+                    print(config.generate_header(format_type, custom_format = user_format, units = "inline", divider = False), file = out)
             else:
                 user_format = args.format
 
                 if not args.noheader:
-                    print(config.generate_header(format_type, custom_format = user_format, units = units))
+                    print(config.generate_header(format_type, custom_format = user_format, units = units), file = out)
 
             table_format = config.translate_format(user_format)
         else:
             if not args.noheader:
-                print(config.generate_header(format_type, units = units))
+                print(config.generate_header(format_type, units = units), file = out)
 
             table_format = config.table_format_data[format_type]
 
+        from .records import get_mapping
+        render_row = RowRenderer(table_format)
+        attributes = get_format_fields(table_format)
+
         if args.average:
             num_jobs = 0
             averages = {"Resource_List" : {}, "resources_used" : {}}
@@ -707,45 +1880,56 @@ def main():
 
             averages_format = re.sub(r"(\d+)d", r"\1.2f", table_format)
 
-    # Begin iterating over log data within specified time bounds
-    bounds = get_time_bounds(config.pbs_log_start, config.pbs_date_format, period = args.period, days = args.days)
-
-    if args.reverse:
-        log_date = bounds[1]
-    else:
-        log_date = bounds[0]
-
-    if args.json:
-        print("{")
-        print('    "timestamp":{},'.format(int(datetime.datetime.today().timestamp())))
-        print('    "Jobs":{')
+            if attributes is not None:
+                attributes.update("{}[{}]".format(c, f) for c in averages for f in averages[c])
 
+    if attributes is not None and args.nodes:
+        attributes.add("exec_vnode")
 
-    while keep_going(bounds, log_date, args.reverse):
-        data_date = datetime.datetime.strftime(log_date, config.pbs_date_format)
-        data_file = os.path.join(config.pbs_log_path, data_date)
-        jobs = get_pbs_records(data_file, CustomRecord, True, args.events,
-                               id_filter, host_filter, data_filters, time_filters,
-                               args.reverse, time_divisor)
+    # Records are read lazily as output is written; sorting does not apply to grouped statistics
+    try:
+        records = query(period = args.period, days = args.days, events = args.events, jobs = jobs, hosts = host_filter,
+                        filters = filters, expression = args.filter, reverse = args.reverse,
+                        sort_by = None if aggregator else args.sort_by, top = None if aggregator else args.top,
+                        time_units = args.time, follow = args.follow, config = config, use_cache = not args.nocache,
+                        use_server = not args.noserver, processes = args.jobs_parallel,
+                        attributes = attributes, timer = timer, arrays = args.arrays)
+    except ValueError as e:
+        exit("Error: {}".format(e))
+
+    if timer:
+        records = timer.count_emitted(records)
+        output_start = time.perf_counter()
+        timer.stages["setup"] = output_start - timer.start - timer.stages["config"]
+
+    if (args.json or args.ndjson) and not (aggregator or exporter):
+        json_writer = JsonWriter(out, args.ndjson)
+        json_writer.begin()
 
-        if args.list:
-            for job in jobs:
-                list_output(job, fields, labels, list_format, nodes = args.nodes)
+    try:
+        if aggregator:
+            for job in records:
+                if '[]' not in job.id:
+                    aggregator.add(job)
+        elif exporter:
+            try:
+                for job in records:
+                    exporter.add(job)
+            except ValueError as e:
+                exporter.discard()
+                exit("Error: {}".format(e))
+        elif args.list:
+            for job in records:
+                list_output(job, fields, labels, list_format, nodes = args.nodes, file = out)
         elif args.csv:
-            for job in jobs:
-                csv_output(job, fields)
-        elif args.json:
-            first_job = True
-
-            for job in jobs:
-                if not first_job:
-                    print(",")
-
-                print(textwrap.indent(json_output(job)[2:-2], "    "), end = "")
-                first_job = False
+            for job in records:
+                csv_output(job, fields, file = out)
+        elif args.json or args.ndjson:
+            for job in records:
+                json_writer.write(job)
         elif args.nodes:
             if args.average:
-                for job in jobs:
+                for job in records:
                     if '[]' not in job.id:
                         for category in averages:
                             for field in averages[category]:
@@ -753,46 +1937,63 @@ def main():
 
                         num_jobs += 1
 
-                    print("{}\n    {}".format(tabular_output(vars(job), table_format), ",".join(job.get_nodes())))
+                    print("{}\n    {}".format(render_row(get_mapping(job)), ",".join(job.get_nodes())), file = out)
             else:
-                for job in jobs:
-                    print("{}\n    {}".format(tabular_output(vars(job), table_format), ",".join(job.get_nodes())))
+                for job in records:
+                    print("{}\n    {}".format(render_row(get_mapping(job)), ",".join(job.get_nodes())), file = out)
         else:
             if args.average:
-                for job in jobs:
+                for job in records:
                     if '[]' not in job.id:
                         for category in averages:
                             for field in averages[category]:
                                 averages[category][field] += getattr(job, category)[field]
 
                         num_jobs += 1
-                    print(tabular_output(vars(job), table_format))
+                    print(render_row(get_mapping(job)), file = out)
             else:
-                for job in jobs:
-                    print(tabular_output(vars(job), table_format))
-
-        if args.reverse:
-            log_date -= ONE_DAY
+                for job in records:
+                    print(render_row(get_mapping(job)), file = out)
+    finally:
+        out.flush()
+
+    if aggregator:
+        if args.csv:
+            group_output(aggregator, labels, "csv", not args.noheader, file = out)
+        elif args.json:
+            group_output(aggregator, labels, "json", file = out)
+        elif args.ndjson:
+            group_output(aggregator, labels, "ndjson", file = out)
         else:
-            log_date += ONE_DAY
-
-    if args.json:
-        print("\n    }\n}")
+            group_output(aggregator, labels, header = not args.noheader, file = out)
+    elif exporter:
+        try:
+            exporter.close()
+        except ValueError as e:
+            exit("Error: {}".format(e))
+    elif args.json or args.ndjson:
+        json_writer.end()
 
     try:
-        if args.average and num_jobs > 0:
+        if args.average and not aggregator and num_jobs > 0:
             for category in averages:
                 for field in averages[category]:
                     averages[category][field] /= num_jobs
 
-            print("\nAverages across {} jobs:\n".format(num_jobs))
+            print("\nAverages across {} jobs:\n".format(num_jobs), file = out)
 
             if not args.noheader:
                 if args.format:
-                    print(config.generate_header(format_type, custom_format = args.format, units = units))
+                    print(config.generate_header(format_type, custom_format = args.format, units = units), file = out)
                 else:
-                    print(config.generate_header(format_type, units = units))
+                    print(config.generate_header(format_type, units = units), file = out)
 
-            print(tabular_output(averages, averages_format))
+            print(tabular_output(averages, averages_format), file = out)
     except UnboundLocalError:
         print("Note: statistics output is only currently supported for tabular mode", file = sys.stderr)
+
+    out.close()
+
+    if timer:
+        timer.stages["output"] = time.perf_counter() - output_start
+        timer.report(args.stats_timing)
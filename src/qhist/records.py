@@ -0,0 +1,379 @@
+"""
+Lazily parsed and compact job records for qhist
+
+Most queries only use a handful of the attributes in a record. A LazyRecord is
+built from only the requested fields, which are found in the raw log line with
+a single compiled regular expression, and then processed (converted to numbers,
+datetimes, etc.) by the usual PbsRecord routines. The remaining attributes are
+parsed on first access, so records behave like fully parsed ones.
+
+Records that are held in memory in large numbers (e.g., while sorting or in the
+qhistd service) are stored as CompactRecords, which keep their values in a
+single tuple laid out by a shared RecordLayout instead of a per-record __dict__
+and nested resource dictionaries.
+"""
+
+import sys, datetime, functools, re
+
+from pbsparse import PbsRecord
+
+# Processed fields that are derived from (or converted along with) other fields
+FIELD_DEPENDENCIES = {  "start"                     : ("end", "resources_used", "resource_assigned"),
+                        "end"                       : ("start", "resources_used", "resource_assigned"),
+                        "waittime"                  : ("start", "etime"),
+                        "request_user"              : ("requestor",),
+                        "request_server"            : ("requestor",),
+                        "resources_used"            : ("start", "end", "Resource_List[ncpus]") }
+
+# Fields with few distinct values, whose strings are shared by compact records
+SHARED_FIELDS = frozenset(("type", "user", "group", "account", "project", "queue", "jobname", "requestor",
+                           "request_user", "request_server", "Exit_status", "exec_host", "exec_vnode"))
+
+# Bookkeeping attributes of lazy records that are not copied to compact records
+LAZY_ATTRIBUTES = frozenset(("_raw_record", "_process", "_fields", "_complete"))
+
+# Layouts of compact records, shared by all records with the same attributes
+LAYOUTS = {}
+
+#
+## Classes
+#
+
+class PartialDict(dict):
+    """A record category (e.g., Resource_List) holding only the extracted keys
+
+    Looking up a key that was not extracted parses the category from the raw
+    record. The dictionary does not refer back to its record, so records are
+    freed as soon as they are no longer used.
+
+    Args:
+        category (str): The name of the category
+        source (tuple): The arguments used to construct the record
+        fields (frozenset): The fields that were extracted
+    """
+
+    __slots__ = ("_category", "_source", "_fields", "_complete")
+
+    def __init__(self, category, source, fields, *args):
+        super().__init__(*args)
+        self._category = category
+        self._source = source
+        self._fields = fields
+        self._complete = False
+
+    def __missing__(self, key):
+        if self._complete or "{}[{}]".format(self._category, key) in self._fields or self._category in self._fields:
+            raise KeyError(key)
+
+        self.load(getattr(PbsRecord(*self._source), self._category, {}))
+        return self[key]
+
+    def load(self, full_category):
+        self._complete = True
+
+        for key, value in full_category.items():
+            self.setdefault(key, value)
+
+class LazyRecord(PbsRecord):
+    """A PbsRecord that only parses the given fields when it is created
+
+    Fields use the same names as record filters (e.g., "user" or
+    "Resource_List[ncpus]"), and a bare category name extracts all of its keys.
+    Accessing any other attribute parses the full record first. Requested fields
+    that are missing from the log line raise errors as usual.
+
+    Args:
+        record_data (str): A single record/line from an accounting log
+        process (bool): Whether to process the extracted fields
+        time_divisor (float): Time unit conversion
+        location (int): The location of the record in the accounting log
+        fields (frozenset): The fields to extract (see expand_fields)
+    """
+
+    def __init__(self, record_data, process = False, time_divisor = 1.0, location = -1, fields = frozenset()):
+        time_stamp, record_type, job_id, record_meta = record_data.split(";")
+
+        if "=" not in record_meta:
+            super().__init__(record_data, process, time_divisor, location)
+            self._fields, self._complete = fields, True
+            return
+
+        self._raw_record = record_data
+        self.time = parse_time_stamp(time_stamp)
+        self.type = record_type
+        self.id = job_id
+        self.short_id = job_id.split(".")[0]
+        self._divisor = time_divisor
+        self._estimates = False
+        self._location = location
+        self._processable = True
+        self._process = process
+        self._fields = fields
+        self._complete = False
+
+        # Processing probes for many attributes that were not extracted, so the
+        # record is processed as a plain PbsRecord before lazy parsing is enabled
+        self.__class__ = ExtractedRecord
+        categories = []
+
+        if fields:
+            for name, value in get_field_regex(fields).findall(" " + record_meta):
+                if "-" in name:
+                    name = name.replace("-", "_")
+
+                if "." in name:
+                    category, name = name.split(".")
+
+                    try:
+                        self.__dict__[category][name] = value
+                    except KeyError:
+                        setattr(self, category, { name : value })
+                        categories.append(category)
+                else:
+                    setattr(self, name, value)
+
+        if process:
+            self.process_record()
+
+        self.__class__ = LazyRecord
+
+        if categories:
+            source = (record_data, process, time_divisor, location)
+
+            for category in categories:
+                setattr(self, category, PartialDict(category, source, fields, getattr(self, category)))
+
+    def __getattr__(self, name):
+        # Only called for attributes that have not been set
+        if name[0] == "_" or self.__dict__.get("_complete", True) or name in self._fields:
+            raise AttributeError(name)
+
+        self.load()
+        return getattr(self, name)
+
+    def load(self):
+        """Parse the attributes that were not extracted when the record was created"""
+        full_record = PbsRecord(self._raw_record, self._process, self._divisor, self._location)
+        self._complete = True
+
+        for name, value in vars(full_record).items():
+            if name not in self.__dict__:
+                setattr(self, name, value)
+            elif isinstance(self.__dict__[name], PartialDict):
+                self.__dict__[name].load(value)
+
+class ExtractedRecord(PbsRecord):
+    """A LazyRecord while its extracted fields are being processed"""
+
+class RecordLayout:
+    """The attribute names of compact records, in the order they were set
+
+    Attributes of resource dictionaries are flattened into "category.key" names,
+    as in the record cache.
+
+    Args:
+        names (tuple): The flattened attribute names
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.index = {}
+        self.categories = {}
+        self.attributes = []
+
+        for position, name in enumerate(names):
+            if "." in name:
+                category, key = name.split(".", 1)
+
+                if category not in self.categories:
+                    self.categories[category] = []
+                    self.attributes.append(category)
+
+                self.categories[category].append((key, position))
+            else:
+                self.index[name] = position
+                self.attributes.append(name)
+
+    def __reduce__(self):
+        # Unpickled layouts are shared again rather than copied for each record
+        return get_layout, (self.names,)
+
+class CompactRecord:
+    """A memory-efficient, read-only copy of a parsed job record
+
+    Attribute values are kept in a single tuple, and strings of fields with few
+    distinct values (e.g., user and queue) are shared between records. Resource
+    dictionaries are rebuilt when they are accessed. A compact record can also
+    be used as a read-only mapping of its attributes (e.g., for table formats).
+
+    Only the attributes present when a record is compacted are kept, except
+    that a compact copy of a LazyRecord can still parse other attributes.
+
+    Args:
+        record (PbsRecord): The record to copy
+    """
+
+    __slots__ = ("_layout", "_values", "_source")
+
+    get_chunks = PbsRecord.get_chunks
+    get_nodes = PbsRecord.get_nodes
+    __str__ = PbsRecord.__str__
+
+    def __init__(self, record):
+        self._layout, self._values = get_compact_values(vars(record))
+
+        if isinstance(record, LazyRecord) and not record._complete:
+            self._source = (record._raw_record, record._process, record._divisor, record._location, record._fields)
+        else:
+            self._source = None
+
+    def __getattr__(self, name):
+        # Only called for names that are not slots, or slots that are unset
+        if name in CompactRecord.__slots__ or name.startswith("__"):
+            raise AttributeError(name)
+
+        layout = self._layout
+
+        if name in layout.index:
+            return self._values[layout.index[name]]
+        elif name in layout.categories:
+            values = self._values
+            category = { key : values[position] for key, position in layout.categories[name] }
+
+            if self._source:
+                category = PartialDict(name, self._source[:4], self._source[4], category)
+
+            return category
+        elif self._source and name not in self._source[4]:
+            self.load()
+            return getattr(self, name)
+        else:
+            raise AttributeError(name)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def keys(self):
+        return list(self._layout.attributes)
+
+    def load(self):
+        """Parse the attributes that were not extracted from a lazy record"""
+        attributes = vars(PbsRecord(*self._source[:4]))
+
+        # Attributes set after parsing (e.g., the log source) are kept
+        for name in self._layout.attributes:
+            if name not in attributes:
+                attributes[name] = getattr(self, name)
+
+        self._layout, self._values = get_compact_values(attributes)
+        self._source = None
+
+    def get_size(self):
+        """Estimate the memory used by the record, counting shared strings in full"""
+        return sys.getsizeof(self) + sys.getsizeof(self._values) + sum(sys.getsizeof(v) for v in self._values)
+
+    def to_dict(self):
+        """Return the attributes of the record, as vars() does for other records"""
+        return { name : getattr(self, name) for name in self._layout.attributes }
+
+#
+## Functions
+#
+
+def get_layout(names):
+    try:
+        return LAYOUTS[names]
+    except KeyError:
+        return LAYOUTS.setdefault(names, RecordLayout(names))
+
+def get_compact_values(attributes):
+    """Flatten record attributes into a shared layout and a tuple of values"""
+    names, values = [], []
+
+    for name, value in attributes.items():
+        if name in LAZY_ATTRIBUTES:
+            continue
+        elif isinstance(value, dict) and value:
+            for key, item in value.items():
+                names.append(name + "." + key)
+                values.append(sys.intern(item) if type(item) is str else item)
+        else:
+            names.append(name)
+            values.append(sys.intern(value) if name in SHARED_FIELDS and type(value) is str else value)
+
+    return get_layout(tuple(names)), tuple(values)
+
+def compact_record(record):
+    """Return a compact copy of a record, unless it uses a custom record class"""
+    if type(record) in (PbsRecord, LazyRecord):
+        return CompactRecord(record)
+    else:
+        return record
+
+def get_attributes(record):
+    """Return the attributes of a record, as vars() does for full records"""
+    if isinstance(record, CompactRecord):
+        return record.to_dict()
+    else:
+        return vars(record)
+
+def get_mapping(record):
+    """Return a mapping of the attributes of a record for table formats, without copying"""
+    if isinstance(record, CompactRecord):
+        return record
+    else:
+        return vars(record)
+
+def parse_time_stamp(time_stamp):
+    """Convert a record time stamp (e.g., 03/31/2025 08:15:02) to a datetime"""
+    try:
+        return datetime.datetime(int(time_stamp[6:10]), int(time_stamp[0:2]), int(time_stamp[3:5]),
+                                 int(time_stamp[11:13]), int(time_stamp[14:16]), int(time_stamp[17:19]))
+    except ValueError:
+        return datetime.datetime.strptime(time_stamp, "%m/%d/%Y %H:%M:%S")
+
+def expand_fields(fields):
+    """Return the fields to extract so that the given fields are fully processed
+
+    Args:
+        fields (iterable): Record attributes (e.g., "waittime", "Resource_List[mem]")
+
+    Returns:
+        frozenset: The fields and all fields they depend on
+    """
+    expanded = set()
+    pending = list(fields)
+
+    while pending:
+        field = pending.pop()
+
+        if field in expanded:
+            continue
+
+        expanded.add(field)
+        pending.extend(FIELD_DEPENDENCIES.get(field, ()))
+
+        if "[" in field:
+            pending.extend(FIELD_DEPENDENCIES.get(field.split("[")[0], ()))
+
+    return frozenset(expanded)
+
+@functools.lru_cache(maxsize = 16)
+def get_field_regex(fields):
+    """Compile a regular expression that finds the given fields in record metadata"""
+    patterns = []
+
+    for field in sorted(fields):
+        if "[" in field:
+            category, key = field[:-1].split("[", 1)
+            pattern = re.escape(category) + r"\." + re.escape(key)
+        else:
+            pattern = re.escape(field) + r"(?:\.[^=\s]+)?"
+
+        # Names containing dashes in the log are stored with underscores
+        patterns.append(pattern.replace("_", "[-_]"))
+
+    return re.compile(r" ({})=(\S*)".format("|".join(patterns)))
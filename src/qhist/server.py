@@ -0,0 +1,302 @@
+"""
+qhistd - a resident qhist service for shared login nodes
+
+The service keeps the parsed end-type records of recently used days in memory
+as compact records, bounded by a least-recently-used limit on the number of
+days, and answers qhist queries over a local Unix socket. Logs that grow (e.g.,
+the current day) are tailed, so only newly appended lines are parsed. The qhist command uses the
+service automatically when server_socket is configured and reachable, and
+otherwise parses the logs itself.
+
+Requests and responses are newline-delimited JSON. A request names the log
+dates, record filter, and time units; the response is one line per matching
+record, with a line marking the end of each date and a final status line.
+Clients that get no response within a timeout read the logs themselves. Any
+local user who can connect to the socket can read the records, so the socket is
+created with the permissions allowed by the umask unless socket_mode and
+socket_group are set.
+"""
+
+import sys, os, argparse, datetime, json, signal, socket, socketserver, threading
+
+from collections import OrderedDict
+from pbsparse import PbsRecord
+from .cache import DT_EPOCH, CACHE_EVENTS
+from .filters import RecordFilter
+from .logs import find_log_file, is_compressed
+from .records import compact_record, get_attributes
+
+# Constants
+PROTOCOL_VERSION = 2
+READ_BUFFER = 1 << 20
+
+#
+## Classes
+#
+
+class DayRecords:
+    """Parsed end records of one daily log and how far the log has been read"""
+
+    def __init__(self, size = 0, mtime = 0, offset = 0, records = ()):
+        self.size = size
+        self.mtime = mtime
+        self.offset = offset
+        self.records = list(records)
+
+class RecordStore:
+    """A least-recently-used store of parsed end records for daily logs
+
+    Args:
+        log_path (str): Directory containing the daily accounting logs
+        Record (class): The record class used to parse log lines
+        max_days (int): Maximum number of days (per time unit) kept in memory
+    """
+
+    def __init__(self, log_path, Record = PbsRecord, max_days = 30):
+        self.log_path = log_path
+        self.Record = Record
+        self.max_days = max_days
+        self.days = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, log_date, time_divisor = 1.0):
+        """Return the end records of a daily log, or None if the log is missing
+
+        If the log has grown since it was last read, only the appended bytes
+        are parsed, and a new list is built so concurrent readers are unaffected.
+        """
+        if os.sep in log_date or log_date.startswith("."):
+            raise ValueError("invalid log date ({})".format(log_date))
+
+        data_file = find_log_file(os.path.join(self.log_path, log_date))
+
+        try:
+            log_stat = os.stat(data_file)
+        except FileNotFoundError:
+            return None
+
+        key = (log_date, time_divisor)
+
+        with self.lock:
+            day = self.days.get(key)
+
+            if day:
+                self.days.move_to_end(key)
+
+        if day and (day.size, day.mtime) == (log_stat.st_size, log_stat.st_mtime):
+            return day.records
+
+        if not day or log_stat.st_size < day.offset:
+            day = DayRecords()
+
+        records, offset = self.read(data_file, day.offset, time_divisor)
+        day = DayRecords(log_stat.st_size, log_stat.st_mtime, offset, day.records + records)
+
+        with self.lock:
+            self.days[key] = day
+            self.days.move_to_end(key)
+
+            while len(self.days) > self.max_days:
+                self.days.popitem(last = False)
+
+        return day.records
+
+    def read(self, data_file, offset, time_divisor):
+        """Parse complete end records from a byte offset to the end of a log
+
+        Compressed logs are not appended to, so they are read in full.
+        """
+        from .qhist import read_appended, read_log
+
+        if is_compressed(data_file):
+            records = list(read_log(data_file, self.Record, True, RecordFilter(CACHE_EVENTS), time_divisor = time_divisor))
+            offset = os.path.getsize(data_file)
+        else:
+            records, offset = read_appended(data_file, offset, self.Record, True, RecordFilter(CACHE_EVENTS), time_divisor)
+
+        return [compact_record(record) for record in records], offset
+
+class QhistRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        from .qhist import filter_records
+
+        try:
+            request = json.loads(self.rfile.readline().decode())
+
+            if request.get("version") != PROTOCOL_VERSION:
+                raise ValueError("unsupported protocol version ({})".format(request.get("version")))
+
+            record_filter = RecordFilter.from_dict(request["filter"])
+
+            if not self.server.store_usable(record_filter):
+                raise ValueError("only end-type records (E, R) are served")
+
+            for log_date in request["dates"]:
+                records = self.server.store.get(log_date, float(request["time_divisor"]))
+
+                if records is None:
+                    self.send({ "warning" : "no PBS records found for date in time range ({})".format(
+                                            os.path.join(self.server.store.log_path, log_date)) })
+                else:
+                    for record in filter_records(records, record_filter, request.get("reverse", False)):
+                        self.wfile.write(encode_record(record))
+
+                self.send({ "date" : log_date })
+
+            self.send({ "done" : True })
+        except (ValueError, KeyError, TypeError) as e:
+            self.send({ "error" : str(e) })
+        except BrokenPipeError:
+            pass
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+
+class QhistServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, store):
+        self.store = store
+        super().__init__(socket_path, QhistRequestHandler)
+
+    @staticmethod
+    def store_usable(record_filter):
+        return record_filter.type_filter and all(c in CACHE_EVENTS + ", " for c in record_filter.type_filter)
+
+#
+## Functions
+#
+
+def encode_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return { "$t" : int((value - DT_EPOCH).total_seconds()) }
+    else:
+        raise TypeError("cannot serialize {}".format(type(value).__name__))
+
+def decode_datetime(value):
+    if len(value) == 1 and "$t" in value:
+        return DT_EPOCH + datetime.timedelta(seconds = value["$t"])
+    else:
+        return value
+
+def encode_record(record):
+    data = { "record" : { k : v for k, v in get_attributes(record).items() if k != "_raw_record" } }
+    return json.dumps(data, default = encode_datetime).encode() + b"\n"
+
+def query_server(socket_path, log_dates, record_filter, reverse = False, time_divisor = 1.0,
+                 Record = None, timeout = 30.0):
+    """Query a qhistd service for records matching a filter
+
+    The connection is made immediately, so an unreachable service raises an
+    OSError before any records are returned and the caller can fall back to
+    reading the logs directly. The records of each date are returned once the
+    service has sent all of them, so if it stops responding for timeout seconds,
+    socket.timeout is raised with only whole dates returned and the caller can
+    read the remaining dates itself.
+
+    Returns:
+        generator: A list of the matching records of each date, in the
+                   requested order
+    """
+    Record = Record or PbsRecord
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+
+    try:
+        connection.connect(socket_path)
+        request = { "version"       : PROTOCOL_VERSION,
+                    "dates"         : log_dates,
+                    "filter"        : record_filter.to_dict(),
+                    "reverse"       : reverse,
+                    "time_divisor"  : time_divisor }
+        connection.sendall(json.dumps(request).encode() + b"\n")
+    except OSError:
+        connection.close()
+        raise
+
+    def get_records():
+        records = []
+
+        with connection, connection.makefile("rb", buffering = READ_BUFFER) as response:
+            for line in response:
+                message = json.loads(line.decode(), object_hook = decode_datetime)
+
+                if "record" in message:
+                    record = Record.__new__(Record)
+                    record.__dict__.update(message["record"])
+                    records.append(record)
+                elif "date" in message:
+                    yield records
+                    records = []
+                elif "warning" in message:
+                    print("Warning: {}".format(message["warning"]), file = sys.stderr)
+                elif "error" in message:
+                    exit("Error: qhistd could not answer query ({})".format(message["error"]))
+                elif message.get("done"):
+                    return
+
+        exit("Error: connection to qhistd was closed unexpectedly")
+
+    return get_records()
+
+def set_socket_access(socket_path, mode = None, group = None):
+    """Set the group and permissions of the socket, if configured
+
+    Otherwise the socket keeps the permissions allowed by the umask.
+    """
+    try:
+        if group:
+            import grp
+            os.chown(socket_path, -1, grp.getgrnam(group).gr_gid)
+
+        if mode:
+            os.chmod(socket_path, int(mode, 8))
+    except KeyError:
+        exit("Error: unknown socket_group ({})".format(group))
+    except ValueError:
+        exit("Error: socket_mode must be an octal string (e.g., \"0660\")")
+    except OSError as e:
+        exit("Error: could not set the access of {} ({})".format(socket_path, e))
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog = "qhistd", description = "Serve qhist queries from records held in memory")
+    parser.add_argument("-s", "--socket",   help = "path of the Unix socket to listen on (default: server_socket setting)")
+    parser.add_argument("-d", "--days",     help = "maximum number of days held in memory (default: server_cache_days setting)",
+                                            type = int)
+    return parser
+
+def main():
+    from .qhist import get_config, get_record_class
+
+    args = get_parser().parse_args()
+    config = get_config()
+    CustomRecord, search_paths = get_record_class(config)
+    socket_path = args.socket or config.server_socket
+    sources = config.get_log_sources()
+
+    if not socket_path:
+        exit("Error: no socket path given and server_socket not set by config file.")
+    elif len(sources) > 1:
+        exit("Error: qhistd serves a single log directory, but {} log sources are configured".format(len(sources)))
+
+    if os.path.exists(socket_path):
+        try:
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            probe.connect(socket_path)
+            probe.close()
+            exit("Error: qhistd is already listening on {}".format(socket_path))
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    store = RecordStore(sources[0][1], CustomRecord or PbsRecord, args.days or config.server_cache_days)
+    server = QhistServer(socket_path, store)
+
+    try:
+        set_socket_access(socket_path, config.socket_mode, config.socket_group)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
@@ -0,0 +1,153 @@
+"""
+Memory-bounded sorting of job records for qhist
+
+Records are sorted by a single field. The top N records are selected with a
+bounded heap, while full sorts buffer compact copies of records up to a memory
+budget, spill each full buffer to disk as a sorted run, and then merge all runs
+lazily.
+"""
+
+import sys, os, datetime, heapq, itertools, pickle, shutil, tempfile
+
+from .filters import get_accessor
+from .records import CompactRecord, compact_record
+
+# Constants
+SAMPLE_SIZE = 100
+RUN_BUFFER = 1 << 20
+
+#
+## Classes
+#
+
+class SortKey:
+    """Build sort keys for a record field that order mixed and missing values
+
+    Numbers sort before datetimes and strings, and records missing the field
+    (or with an empty value) always sort last, in either direction. Ties keep
+    the order in which records were read.
+
+    Args:
+        field (str): The record attribute to sort by (e.g., "resources_used[mem]")
+        descending (bool): Whether records will be sorted in descending order
+    """
+
+    def __init__(self, field, descending = False):
+        self.get_value = get_accessor(field)
+        self.missing = (-1 if descending else 4, 0)
+
+    def __call__(self, record):
+        try:
+            value = self.get_value(record)
+        except (AttributeError, KeyError, TypeError):
+            return self.missing
+
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return (0, value)
+        elif isinstance(value, datetime.datetime):
+            return (1, value)
+        elif value == "" or value is None:
+            return self.missing
+        else:
+            return (2, str(value))
+
+#
+## Functions
+#
+
+def get_record_size(record):
+    """Estimate the memory used by a record, including nested dictionaries"""
+    if isinstance(record, CompactRecord):
+        return record.get_size()
+
+    size = sys.getsizeof(record) + sys.getsizeof(vars(record))
+
+    for key, value in vars(record).items():
+        size += sys.getsizeof(value)
+
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+
+    return size
+
+def write_run(run_dir, keyed_records):
+    """Write a sorted run of (key, sequence, record) tuples to a file"""
+    fd, run_path = tempfile.mkstemp(dir = run_dir, suffix = ".run")
+
+    with open(fd, "wb", buffering = RUN_BUFFER) as run_file:
+        for item in keyed_records:
+            pickle.dump(item, run_file, pickle.HIGHEST_PROTOCOL)
+
+    return run_path
+
+def read_run(run_path):
+    with open(run_path, "rb", buffering = RUN_BUFFER) as run_file:
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                break
+
+    os.remove(run_path)
+
+def sort_records(records, field, descending = False, top = None, memory_limit = 512, temp_dir = None):
+    """Sort a stream of records by a field using bounded memory
+
+    Args:
+        records (iterable): The job records to sort
+        field (str): The record attribute to sort by
+        descending (bool): Sort from largest to smallest
+        top (int): Only return the first N records in sorted order
+        memory_limit (float): Approximate memory budget in MB for buffered records
+        temp_dir (str): Directory in which sorted runs are written
+
+    Yields:
+        Records in sorted order
+    """
+    sort_key = SortKey(field, descending)
+    sign = -1 if descending else 1
+
+    # Sequence numbers keep the sort stable and avoid comparing records
+    keyed = ((sort_key(record), sign * n, record) for n, record in enumerate(records))
+
+    if top is not None:
+        select = heapq.nlargest if descending else heapq.nsmallest
+        yield from (item[2] for item in select(top, keyed, key = lambda item: item[:2]))
+        return
+
+    budget = memory_limit * 1024 * 1024
+    buffer, used, record_size = [], 0, None
+    run_dir, runs = None, []
+
+    try:
+        for key, sequence, record in keyed:
+            buffer.append((key, sequence, compact_record(record)))
+
+            if record_size is None:
+                if len(buffer) == SAMPLE_SIZE:
+                    record_size = sum(get_record_size(i[2]) for i in buffer) / SAMPLE_SIZE
+                    used = record_size * len(buffer)
+
+                continue
+
+            used += record_size
+
+            if used > budget:
+                if run_dir is None:
+                    run_dir = tempfile.mkdtemp(prefix = "qhist-sort-", dir = temp_dir)
+
+                buffer.sort(key = lambda item: item[:2], reverse = descending)
+                runs.append(write_run(run_dir, buffer))
+                buffer, used = [], 0
+
+        buffer.sort(key = lambda item: item[:2], reverse = descending)
+
+        if runs:
+            merged = heapq.merge(*[read_run(run) for run in runs], iter(buffer),
+                                 key = lambda item: item[:2], reverse = descending)
+            yield from (item[2] for item in merged)
+        else:
+            yield from (item[2] for item in buffer)
+    finally:
+        if run_dir:
+            shutil.rmtree(run_dir, ignore_errors = True)
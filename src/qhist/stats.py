@@ -0,0 +1,457 @@
+"""
+Streaming statistics over job records for qhist
+
+Records are aggregated in a single pass into per-group accumulators, so memory
+use depends on the number of groups rather than the number of jobs. Percentiles
+are estimated using a mergeable logarithmic sketch with bounded relative error.
+Utilization time series keep only the times and sizes of jobs in typed arrays.
+
+Aggregators (GroupAggregator, NodeAggregator, and UtilizationSeries) share an
+interface used by the qhist command: the record attributes they read
+(record_fields), add(record) and merge(other) to accumulate records,
+results() to yield a (group key, statistic values) pair for each group, and
+the names of the group fields (group_fields), labels of the statistics
+(stat_labels), and formats of their values (stat_formats).
+"""
+
+import math, re, datetime, bisect, itertools
+
+from array import array
+from .filters import get_accessor
+
+# Constants
+STAT_REGEX = re.compile(r"^(count|sum|mean|min|max|median|p\d{1,2}(?:\.\d+)?)(?:\(([^)]+)\))?$")
+GROUP_FIELDS = { "day" : "%Y-%m-%d", "month" : "%Y-%m" }
+NODE_STATS = (("jobs", "d"), ("busy_hours", ".2f"), ("failed", "d"))
+INTERVAL_REGEX = re.compile(r"^(\d+(?:\.\d+)?)([smhd]?)$")
+INTERVAL_UNITS = { "s" : 1, "m" : 60, "h" : 3600, "d" : 86400 }
+UTILIZATION_FIELDS = ("jobs", "cpus", "gpus", "nodes")
+UTILIZATION_RESOURCES = ("ncpus", "ngpus", "nodect")
+
+#
+## Classes
+#
+
+class QuantileSketch:
+    """A mergeable sketch for estimating quantiles of a stream of numbers
+
+    Values are counted in logarithmically sized buckets, so any quantile is
+    estimated within the given relative accuracy using memory proportional to
+    the logarithm of the range of values.
+
+    Args:
+        accuracy (float): Relative accuracy of quantile estimates
+    """
+
+    def __init__(self, accuracy = 0.01):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+
+        if value > 0:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif value < 0:
+            key = math.ceil(math.log(-value) / self.log_gamma)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zeros += 1
+
+    def merge(self, other):
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + count
+
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+
+        for key in sorted(self.negative, reverse = True):
+            seen += self.negative[key]
+
+            if seen > rank:
+                return -self.estimate(key)
+
+        seen += self.zeros
+
+        if seen > rank:
+            return 0.0
+
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+
+            if seen > rank:
+                return self.estimate(key)
+
+        return self.estimate(max(self.positive))
+
+    def estimate(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+class Statistic:
+    """An accumulator for one statistic (e.g., "sum(numcpus*elapsed)")
+
+    Args:
+        spec (str): The statistic, optionally applied to a field or a product of
+                    fields (e.g., "count", "mean(memory)", "p95(elapsed)")
+        translate (function): Maps field names to record attributes
+    """
+
+    def __init__(self, spec, translate = None):
+        match = STAT_REGEX.match(spec.replace(" ", ""))
+
+        if not match or (match.group(1) != "count" and not match.group(2)):
+            raise ValueError("invalid statistic ({})".format(spec))
+
+        self.spec = spec
+        self.function = "p50" if match.group(1) == "median" else match.group(1)
+        self.fields = match.group(2).split("*") if match.group(2) else []
+        self.accessors = [get_accessor(translate(f) if translate else f) for f in self.fields]
+
+    def get_value(self, record):
+        """Return the numeric value of the statistic's field(s), or None"""
+        value = 1
+
+        try:
+            for accessor in self.accessors:
+                value *= accessor(record)
+        except (AttributeError, KeyError, TypeError):
+            return None
+
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        else:
+            return None
+
+    def new_state(self):
+        if self.function[0] == "p":
+            return QuantileSketch()
+        else:
+            return [0, 0, None, None]
+
+    def update(self, state, record):
+        if self.function == "count" and not self.fields:
+            state[0] += 1
+            return
+
+        value = self.get_value(record)
+
+        if value is None:
+            return
+
+        if self.function[0] == "p":
+            state.add(value)
+        else:
+            state[0] += 1
+            state[1] += value
+
+            if state[2] is None or value < state[2]:
+                state[2] = value
+
+            if state[3] is None or value > state[3]:
+                state[3] = value
+
+    def merge(self, state, other):
+        if self.function[0] == "p":
+            state.merge(other)
+        else:
+            state[0] += other[0]
+            state[1] += other[1]
+
+            for i, pick in ((2, min), (3, max)):
+                if other[i] is not None:
+                    state[i] = other[i] if state[i] is None else pick(state[i], other[i])
+
+    def result(self, state):
+        if self.function[0] == "p":
+            return state.quantile(float(self.function[1:]) / 100)
+        elif self.function == "count":
+            return state[0]
+        elif self.function == "sum":
+            return float(state[1])
+        elif self.function == "mean":
+            return state[1] / state[0] if state[0] else None
+        elif self.function == "min":
+            return state[2]
+        else:
+            return state[3]
+
+class GroupAggregator:
+    """Aggregate statistics of job records by a set of grouping fields
+
+    Args:
+        group_fields (list): Field names to group by; "day" and "month" group by
+                             the date of the end record
+        stats (list): Statistic specifications
+        translate (function): Maps field names to record attributes
+    """
+
+    def __init__(self, group_fields, stats, translate = None):
+        self.group_fields = group_fields
+        self.stats = [Statistic(spec, translate) for spec in stats]
+        self.stat_labels = list(stats)
+        self.stat_formats = ["d" if stat.function == "count" else ".2f" for stat in self.stats]
+        self.groups = {}
+        self.key_functions = []
+
+        # Record attributes read by the aggregator
+        self.record_fields = set(translate(f) if translate else f for stat in self.stats for f in stat.fields)
+
+        for field in group_fields:
+            if field in GROUP_FIELDS:
+                date_format = GROUP_FIELDS[field]
+                self.key_functions.append(lambda record, f = date_format: record.time.strftime(f))
+            else:
+                self.record_fields.add(translate(field) if translate else field)
+                self.key_functions.append(get_accessor(translate(field) if translate else field))
+
+    def get_key(self, record):
+        key = []
+
+        for key_function in self.key_functions:
+            try:
+                key.append(str(key_function(record)))
+            except (AttributeError, KeyError):
+                key.append("-")
+
+        return tuple(key)
+
+    def add(self, record):
+        key = self.get_key(record)
+
+        try:
+            states = self.groups[key]
+        except KeyError:
+            states = self.groups[key] = [stat.new_state() for stat in self.stats]
+
+        for stat, state in zip(self.stats, states):
+            stat.update(state, record)
+
+    def merge(self, other):
+        """Combine the groups of another aggregator with the same statistics"""
+        for key, other_states in other.groups.items():
+            try:
+                states = self.groups[key]
+            except KeyError:
+                self.groups[key] = other_states
+                continue
+
+            for stat, state, other_state in zip(self.stats, states, other_states):
+                stat.merge(state, other_state)
+
+    def results(self):
+        """Yield a (group key, statistic values) pair for each group in sorted order"""
+        for key in sorted(self.groups):
+            yield key, [stat.result(state) for stat, state in zip(self.stats, self.groups[key])]
+
+class NodeAggregator:
+    """Aggregate job counts, busy hours, and failed jobs for each node
+
+    Each job is counted once for every node it ran on. The busy hours of a node
+    are the summed elapsed hours of its jobs (so shared nodes can be busy for
+    more hours than have passed), and failed jobs have a non-zero exit status.
+    The statistics are fixed, so plain totals are kept for each node.
+
+    Args:
+        time_divisor (float): The number of seconds in the units of elapsed times
+        nodes (list): Only report these nodes, if given
+    """
+
+    def __init__(self, time_divisor = 3600.0, nodes = None):
+        self.group_fields = ["node"]
+        self.stat_labels = [label for label, _ in NODE_STATS]
+        self.stat_formats = [stat_format for _, stat_format in NODE_STATS]
+        self.groups = {}
+        self.record_fields = { "exec_vnode", "resources_used[walltime]", "Exit_status" }
+        self.hours = time_divisor / 3600.0
+        self.nodes = set(nodes) if nodes else None
+
+    def add(self, record):
+        nodes = record.get_nodes()
+
+        # Jobs that never ran (and array parents) have no exec_vnode
+        if not isinstance(nodes, list):
+            return
+
+        try:
+            busy_hours = record.resources_used["walltime"] * self.hours
+        except (AttributeError, KeyError, TypeError):
+            busy_hours = 0.0
+
+        failed = 1 if getattr(record, "Exit_status", 0) not in (0, "0") else 0
+        groups = self.groups
+
+        for node in set(nodes):
+            if self.nodes is None or node in self.nodes:
+                try:
+                    totals = groups[node]
+                except KeyError:
+                    totals = groups[node] = [0, 0.0, 0]
+
+                totals[0] += 1
+                totals[1] += busy_hours
+                totals[2] += failed
+
+    def merge(self, other):
+        """Combine the totals of another node aggregator"""
+        for node, other_totals in other.groups.items():
+            totals = self.groups.setdefault(node, [0, 0.0, 0])
+
+            for n, value in enumerate(other_totals):
+                totals[n] += value
+
+    def results(self):
+        """Yield a (node, totals) pair for each node in sorted order"""
+        for node in sorted(self.groups):
+            yield (node,), list(self.groups[node])
+
+class UtilizationSeries:
+    """Average numbers of running jobs and busy CPUs, GPUs, and nodes over time
+
+    The occupancy of each interval is the integral of running resources over
+    the interval divided by its length. Integrals at the interval edges are
+    found with cumulative sums over the jobs sorted by start and by end time,
+    so the cost grows with the number of jobs plus the number of intervals
+    rather than their product. NumPy is used if it is installed.
+
+    The series covers whole days, from the first to the last day on which a
+    job ended (or until the current interval). Only finished jobs are counted,
+    so intervals near the current time may be incomplete.
+
+    Args:
+        interval (float): Length of each interval in seconds
+    """
+
+    def __init__(self, interval = 3600.0):
+        self.group_fields = ["time"]
+        self.stat_labels = list(UTILIZATION_FIELDS)
+        self.stat_formats = [".2f"] * len(UTILIZATION_FIELDS)
+        self.record_fields = { "start", "end" } | { "Resource_List[{}]".format(r) for r in UTILIZATION_RESOURCES }
+        self.interval = interval
+        self.starts, self.ends = array("d"), array("d")
+        self.sizes = { field : array("d") for field in UTILIZATION_FIELDS[1:] }
+
+    def add(self, record):
+        try:
+            start, end = record.start.timestamp(), record.end.timestamp()
+        except (AttributeError, TypeError, ValueError, OverflowError, OSError):
+            return
+
+        # Jobs that never started have no (or a zero) start time
+        if start <= 0 or end < start:
+            return
+
+        resources = record.Resource_List
+        self.starts.append(start)
+        self.ends.append(end)
+
+        for field, resource in zip(UTILIZATION_FIELDS[1:], UTILIZATION_RESOURCES):
+            try:
+                self.sizes[field].append(float(resources.get(resource) or 0))
+            except (TypeError, ValueError):
+                self.sizes[field].append(0.0)
+
+    def merge(self, other):
+        """Combine the jobs of another series with the same interval"""
+        self.starts.extend(other.starts)
+        self.ends.extend(other.ends)
+
+        for field, sizes in self.sizes.items():
+            sizes.extend(other.sizes[field])
+
+    def get_edges(self):
+        """Return the start time of the series and the times of interval edges after it"""
+        first_day = datetime.datetime.fromtimestamp(min(self.ends)).date()
+        last_day = datetime.datetime.fromtimestamp(max(self.ends)).date() + datetime.timedelta(days = 1)
+        origin = datetime.datetime.combine(first_day, datetime.time()).timestamp()
+        end = min(datetime.datetime.combine(last_day, datetime.time()).timestamp(),
+                  datetime.datetime.now().timestamp() + self.interval)
+        count = max(int(math.ceil((end - origin) / self.interval)), 1)
+
+        return origin, [n * self.interval for n in range(count + 1)]
+
+    def results(self):
+        """Yield the start time and average occupancy of each interval in order"""
+        if not self.ends:
+            return
+
+        origin, edges = self.get_edges()
+        weights = [None] + [self.sizes[field] for field in UTILIZATION_FIELDS[1:]]
+        started = get_running_integrals(self.starts, weights, edges, origin)
+        ended = get_running_integrals(self.ends, weights, edges, origin)
+        busy = [[s - e for s, e in zip(s_column, e_column)] for s_column, e_column in zip(started, ended)]
+
+        for n in range(len(edges) - 1):
+            label = datetime.datetime.fromtimestamp(origin + edges[n]).strftime("%Y-%m-%dT%H:%M")
+            yield (label,), [(column[n + 1] - column[n]) / self.interval for column in busy]
+
+#
+## Functions
+#
+
+def get_interval(spec):
+    """Convert an interval like "15m", "1h", or "90s" to seconds (minutes if no unit is given)"""
+    match = INTERVAL_REGEX.match(spec.strip())
+
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError("invalid interval ({}); use a number with s, m, h, or d units".format(spec))
+
+    return float(match.group(1)) * INTERVAL_UNITS[match.group(2) or "m"]
+
+def get_running_integrals(times, weights, edges, origin = 0.0):
+    """Sum the weighted time elapsed since each event at the given edges
+
+    For events at times t_j with weights w_j, returns the sum of
+    w_j * max(edge - t_j, 0) at each edge, for each set of weights (None for
+    unit weights). The difference between these sums for job starts and ends
+    is the integral of running resources up to each edge. Times are shifted by
+    origin to keep the sums precise.
+
+    Returns:
+        list: A list of sums at the edges for each set of weights
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        times = numpy.frombuffer(times, dtype = numpy.float64) - origin
+        order = numpy.argsort(times, kind = "stable")
+        times = times[order]
+        edges = numpy.asarray(edges, dtype = numpy.float64)
+        counts = numpy.searchsorted(times, edges, side = "left")
+        results = []
+
+        for column in weights:
+            column = numpy.ones(len(times)) if column is None else numpy.frombuffer(column, dtype = numpy.float64)[order]
+            total = numpy.concatenate(([0.0], numpy.cumsum(column)))
+            moment = numpy.concatenate(([0.0], numpy.cumsum(column * times)))
+            results.append((edges * total[counts] - moment[counts]).tolist())
+
+        return results
+
+    order = sorted(range(len(times)), key = times.__getitem__)
+    times = [times[n] - origin for n in order]
+    counts = [bisect.bisect_left(times, edge) for edge in edges]
+    results = []
+
+    for column in weights:
+        column = [1.0] * len(times) if column is None else [column[n] for n in order]
+        total = [0.0] + list(itertools.accumulate(column))
+        moment = [0.0] + list(itertools.accumulate(w * t for w, t in zip(column, times)))
+        results.append([edge * total[k] - moment[k] for edge, k in zip(edges, counts)])
+
+    return results
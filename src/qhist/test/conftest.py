@@ -0,0 +1,39 @@
+import pytest, os, shutil, json
+from qhist import qhist
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+@pytest.fixture
+def log_files(tmp_path):
+    data_files = []
+
+    for data_date in ("20250329", "20250330", "20250331"):
+        data_file = str(tmp_path / data_date)
+        shutil.copy(testdata, data_file)
+        data_files.append(data_file)
+
+    return data_files
+
+@pytest.fixture
+def record_opts():
+    """Return the record options used to read logs for the given events"""
+    def get_record_opts(events = "ER"):
+        return { "CustomRecord" : None, "process" : True, "record_filter" : qhist.RecordFilter(events),
+                 "time_divisor" : 3600.0 }
+
+    return get_record_opts
+
+@pytest.fixture
+def log_config(tmp_path):
+    """Return a configuration loaded from a server file, reading logs from tmp_path by default"""
+    def load_config(**settings):
+        if "pbs_log_sources" not in settings:
+            settings.setdefault("pbs_log_path", str(tmp_path))
+
+        config_file = tmp_path / "server.json"
+        config_file.write_text(json.dumps(settings))
+        config = qhist.QhistConfig()
+        config.load_config(str(config_file))
+        return config
+
+    return load_config
@@ -0,0 +1,44 @@
+import pytest, os, re, datetime
+from qhist import qhist
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+def test_collapse_arrays(log_config, tmp_path):
+    with open(testdata) as f:
+        lines = [line for line in f if ";E;" in line]
+
+    # Two subjobs of an array, another job, and the array parent
+    ids = ("4215033[1].casper-pbs", "4215033[2].casper-pbs", None, "4215033[].casper-pbs")
+    log_file = tmp_path / "20250331"
+
+    with open(str(log_file), "w") as f:
+        for line, job_id in zip(lines, ids):
+            fields = line.rstrip("\n").split(";")
+
+            if job_id:
+                fields[2] = job_id
+
+            if job_id and "[]" in job_id:
+                fields[3] += " array_indices_submitted=1-2"
+
+            f.write(";".join(fields) + "\n")
+
+    config = log_config()
+
+    # Record times are local, so expected times come from the epoch fields of the log
+    start = datetime.datetime.fromtimestamp(int(re.search(r" start=(\d+)", lines[0]).group(1)))
+    end = datetime.datetime.fromtimestamp(int(re.search(r" end=(\d+)", lines[1]).group(1)))
+
+    for reverse in (False, True):
+        jobs = list(qhist.query(period = "20250331", reverse = reverse, arrays = "collapse", time_units = "s",
+                                use_cache = False, config = config, attributes = ["user"]))
+        assert [job.short_id for job in jobs] == ["4215265", "4215033[]"]
+
+        rollup = jobs[1]
+        assert rollup.subjobs == 2 and rollup.exit_statuses == "-1:1 0:1" and rollup.Exit_status == "1"
+        assert (rollup.start, rollup.end) == (start, end)
+        assert (rollup.min_elapsed, rollup.max_elapsed) == (0, 216)
+        assert rollup.resources_used["walltime"] == 108
+
+    with pytest.raises(ValueError):
+        next(qhist.query(period = "20250331", arrays = "merge", config = config))
@@ -0,0 +1,45 @@
+import os
+from qhist import qhist
+from qhist.cache import RecordCache
+
+def test_record_cache(log_files, record_opts, tmp_path):
+    cache = RecordCache(str(tmp_path / "cache"))
+    record_opts = record_opts("E")
+    parsed = [vars(job) for job in qhist.get_log_records(log_files[0], record_opts)]
+    stored = [vars(job) for job in qhist.get_log_records(log_files[0], record_opts, cache)]
+    cached = [vars(job) for job in qhist.get_log_records(log_files[0], record_opts, cache)]
+
+    assert os.listdir(str(tmp_path / "cache" / "records"))
+    assert parsed == stored
+
+    for record in parsed:
+        del record["_raw_record"]
+
+    assert parsed == cached
+    assert [list(r) for r in cached] == [list(r) for r in parsed]
+
+def test_record_index(log_files, record_opts, tmp_path):
+    index = RecordCache(str(tmp_path / "cache")).index
+    log_file = log_files[0]
+
+    with open(log_file) as f:
+        lines = f.readlines()
+
+    with open(log_file, "w") as f:
+        f.writelines(lines[:10])
+
+    first = index.lookup(log_file, [("id", ["4215065"])])
+    users = index.lookup(log_file, [("user", ["vanderwb"])])
+
+    with open(log_file, "a") as f:
+        f.writelines(lines[10:])
+
+    second = index.lookup(log_file, [("id", ["4215065"])])
+    record_opts = record_opts("E")
+    jobs = list(qhist.get_indexed_records(log_file, second, **record_opts))
+
+    assert first == [] and len(users) == 3
+    assert [job.id for job in jobs] == ["4215065.casper-pbs"]
+    assert index.lookup(log_file, [("id", ["42150"]), ("user", ["bneuman"])]) == []
+    assert index.lookup(log_file, [("host", ["crhtc82"])]) == second
+    assert index.lookup(log_file, [("host", ["crhtc82"]), ("host", ["crhtc86"])]) == []
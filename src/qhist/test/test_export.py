@@ -0,0 +1,82 @@
+import pytest, os, datetime
+from qhist import qhist, export
+from types import SimpleNamespace
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+fields = ["id", "numcpus", "memory", "end", "elapsed", "gputype"]
+format_map = { "numcpus" : "Resource_List[ncpus]", "memory" : "resources_used[mem]", "elapsed" : "resources_used[walltime]",
+               "gputype" : "Resource_List[gpu_type]" }
+
+@pytest.fixture
+def records(record_opts):
+    return list(qhist.read_log(testdata, **record_opts()))
+
+def export_records(records, path, export_format):
+    exporter = export.ColumnExporter(str(path), export_format, fields, lambda f: format_map.get(f, f), batch_size = 5)
+
+    for record in records:
+        exporter.add(record)
+
+    exporter.close()
+
+def test_normalize_column():
+    assert export.normalize_column([1, 2.5, None]) == ("float", [1.0, 2.5, None])
+    assert export.normalize_column(["a", 3, ""]) == ("str", ["a", "3", None])
+    assert export.normalize_column([None, ""]) == ("null", [None, None])
+
+def test_export_parquet(records, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    export_records(records, tmp_path / "jobs.parquet", "parquet")
+    table = pq.read_table(str(tmp_path / "jobs.parquet")).to_pydict()
+
+    assert table["id"] == [r.id for r in records]
+    assert table["numcpus"] == [r.Resource_List["ncpus"] for r in records]
+    assert table["end"][-1].replace(tzinfo = None) == records[-1].end
+    assert table["gputype"] == [None] * len(records)
+
+def test_export_npz(records, tmp_path):
+    np = pytest.importorskip("numpy")
+    export_records(records, tmp_path / "jobs.npz", "npz")
+    columns = np.load(str(tmp_path / "jobs.npz"))
+
+    assert columns["numcpus"].dtype == np.int64
+    assert columns["id"].tolist() == [r.id for r in records]
+    assert columns["elapsed"].tolist() == [r.resources_used["walltime"] for r in records]
+    assert columns["end"][0] == np.datetime64(records[0].end)
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow", "npz"])
+def test_export_widened_types(export_format, tmp_path):
+    pytest.importorskip("numpy" if export_format == "npz" else "pyarrow.parquet")
+    path = tmp_path / ("jobs." + export_format)
+    start = datetime.datetime(2025, 3, 31, 10, 59, 31)
+    exporter = export.ColumnExporter(str(path), export_format, ["cpus", "memory", "start"], batch_size = 1)
+
+    # The second batch has a float, a string, and a missing value
+    for cpus, memory, time in ((4, 1, start), (0.5, "30gb", None)):
+        exporter.add(SimpleNamespace(cpus = cpus, memory = memory, start = time))
+
+    exporter.close()
+    assert os.listdir(str(tmp_path)) == [path.name]
+
+    if export_format == "npz":
+        columns = { k : v.tolist() for k, v in pytest.importorskip("numpy").load(str(path)).items() }
+    elif export_format == "parquet":
+        columns = pytest.importorskip("pyarrow.parquet").read_table(str(path)).to_pydict()
+    else:
+        import pyarrow
+        columns = pyarrow.ipc.open_file(str(path)).read_all().to_pydict()
+
+    assert columns["cpus"] == [4.0, 0.5] and columns["memory"] == ["1", "30gb"]
+    assert columns["start"][0] == start
+
+def test_export_discard(records, tmp_path):
+    pytest.importorskip("pyarrow.parquet")
+    exporter = export.ColumnExporter(str(tmp_path / "jobs.parquet"), "parquet", fields, lambda f: format_map.get(f, f),
+                                     batch_size = 2)
+
+    for record in records[:3]:
+        exporter.add(record)
+
+    assert os.path.exists(str(tmp_path / "jobs.parquet"))
+    exporter.discard()
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,58 @@
+import pytest, operator
+from qhist.filters import RecordFilter, parse_expression
+from pbsparse import PbsRecord
+
+data = '03/31/2025 11:39:29;E;4215065.casper-pbs;user=vanderwb group=csgteam account="SCSG0001" project=_pbs_project_default jobname=STDIN queue=htc ctime=1743440746 qtime=1743440746 etime=1743440746 start=1743440753 exec_host=crhtc82/32 exec_vnode=(crhtc82:ncpus=1:mem=31457280kb) Resource_List.mem=30gb Resource_List.mps=0 Resource_List.ncpus=1 Resource_List.ngpus=0 Resource_List.nodect=1 Resource_List.nvpus=0 Resource_List.place=scatter Resource_List.select=1:ncpus=1:mem=30GB:ompthreads=1 Resource_List.walltime=06:00:00 session=97162 end=1743442769 Exit_status=0 resources_used.cpupercent=34 resources_used.cput=00:00:16 resources_used.mem=753360kb resources_used.ncpus=1 resources_used.vmem=8722444kb resources_used.walltime=00:33:27 eligible_time=00:00:15 run_count=1'
+
+def matches_expression(text):
+    record_filter = RecordFilter(expression = parse_expression(text))
+    return record_filter.check_line(data) and record_filter(PbsRecord(data, process = True))
+
+def matches(*data_filters, **filter_args):
+    record_filter = RecordFilter(data_filters = list(data_filters), **filter_args)
+    return record_filter.check_line(data) and record_filter(PbsRecord(data, process = True))
+
+def test_coerced_values():
+    assert matches((False, operator.gt, "resources_used[mem]", "0.5"))
+    assert matches((False, operator.le, "Resource_List[ncpus]", "1.5"))
+    assert matches((False, operator.gt, "end", "2025-03-01"))
+
+def test_missing_fields():
+    assert not matches((False, operator.eq, "Resource_List[gpu_type]", "a100"))
+    assert matches((True, operator.eq, "Resource_List[gpu_type]", "a100"))
+
+def test_line_checks():
+    assert RecordFilter(data_filters = [(False, operator.eq, "account", "SCSG0001")]).check_line(data)
+    assert not RecordFilter(data_filters = [(False, operator.eq, "user", "vanderw")]).check_line(data)
+    assert not RecordFilter(type_filter = "R", id_filter = ["4215065"]).check_line(data)
+    assert matches(type_filter = "E", id_filter = ["42150"], host_filter = ["crhtc82"])
+
+def test_expressions():
+    assert matches_expression("queue==cpu or (user==vanderwb and not jobname has X)")
+    assert matches_expression("user in (alice, vanderwb) and jobname =~ '^ST'")
+    assert matches_expression("~queue==cpu;Exit_status==0")
+    assert not matches_expression("user not in (vanderwb) or queue in (cpu,gpu)")
+
+def test_unquoted_values():
+    assert parse_expression("Resource_List[select]==1:ncpus=1:mem=30gb;queue!=cpu") == \
+            ("and", [("clause", False, operator.eq, "Resource_List[select]", "1:ncpus=1:mem=30gb"),
+                     ("clause", False, operator.ne, "queue", "cpu")])
+    assert matches_expression("(Resource_List[select]==1:ncpus=1:mem=30GB:ompthreads=1)&&user==vanderwb")
+    assert not matches_expression("Resource_List[select]==1:ncpus=1 || queue==cpu")
+
+def test_expression_errors():
+    for text in ("user==", "(user==a", "user ?? a", "name =~ '['"):
+        with pytest.raises(ValueError):
+            parse_expression(text)
+
+def test_required_values():
+    record_filter = RecordFilter(expression = parse_expression("user in (a,b) and (account==x or account==y)"))
+    assert record_filter.get_required_values("user") == ["a", "b"]
+    assert record_filter.get_required_values("account") is None
+
+def test_serialization():
+    record_filter = RecordFilter("E", ["4215"], None, [(False, operator.gt, "waittime", 0.5)],
+                                 expression = parse_expression("user in (a, vanderwb) and not name =~ '^x'"))
+    copy = RecordFilter.from_dict(record_filter.to_dict())
+    assert copy.to_dict() == record_filter.to_dict()
+    assert copy(PbsRecord(data, process = True)) == record_filter(PbsRecord(data, process = True)) == True
@@ -0,0 +1,26 @@
+import os
+from qhist import qhist
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+def test_follow(record_opts, tmp_path):
+    with open(testdata) as f:
+        lines = f.readlines()
+
+    data_file = str(tmp_path / qhist.datetime.datetime.today().strftime("%Y%m%d"))
+
+    with open(data_file, "w") as f:
+        f.writelines(lines[:10])
+        f.write(lines[10][:40])
+
+    record_opts = record_opts()
+    follower = qhist.follow_logs(str(tmp_path), "%Y%m%d", record_opts, interval = 0.01)
+    first = [job.id for job in next(follower)]
+
+    with open(data_file, "a") as f:
+        f.write(lines[10][40:])
+        f.writelines(lines[11:])
+
+    second = [job.id for job in next(follower)]
+    expected = [job.id for job in qhist.read_log(testdata, **record_opts)]
+    assert first and first + second == expected
@@ -0,0 +1,25 @@
+import os, gzip, lzma
+from qhist import qhist
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+def test_compressed_logs(log_files, log_config):
+    with open(testdata, "rb") as f:
+        data = f.read()
+
+    os.remove(log_files[0])
+    os.remove(log_files[1])
+
+    with gzip.open(log_files[0] + ".gz", "wb") as f:
+        f.write(data)
+
+    with lzma.open(log_files[1] + ".xz", "wb") as f:
+        f.write(data)
+
+    config = log_config()
+    assert config.pbs_log_start == "20250329"
+
+    for reverse in (False, True):
+        jobs = [job.id for job in qhist.query(period = "20250329-20250331", events = "ER", reverse = reverse, config = config)]
+        expected = [job.id for job in qhist.read_log(testdata, record_filter = qhist.RecordFilter("ER"), reverse = reverse)]
+        assert jobs == expected * 3
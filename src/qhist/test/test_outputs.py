@@ -1,4 +1,4 @@
-import pytest
+import pytest, io, json, textwrap
 from qhist import qhist
 from pbsparse import PbsRecord
 
@@ -28,3 +28,55 @@ def test_csv_output(capsys):
     qhist.csv_output(record, fields)
     captured = capsys.readouterr()
     assert captured.out == "vanderwb,0.7184600830078125,2025-03-31 11:05:46\n"
+
+def test_output_writer():
+    stream = io.StringIO()
+    out = qhist.OutputWriter(stream, buffer_size = 32)
+    print("4215065.casper-pbs", file = out)
+    assert stream.getvalue() == ""
+    print("4215066.casper-pbs", file = out)
+    assert stream.getvalue() == "4215065.casper-pbs\n4215066.casper-pbs"
+    out.flush()
+    assert stream.getvalue() == "4215065.casper-pbs\n4215066.casper-pbs\n"
+
+    line_stream = io.StringIO()
+    line_out = qhist.OutputWriter(line_stream, line_buffering = True)
+    print("vanderwb", end = "", file = line_out)
+    assert line_stream.getvalue() == ""
+    print(",0.72", file = line_out)
+    assert line_stream.getvalue() == "vanderwb,0.72\n"
+
+def test_row_renderer():
+    record = PbsRecord(data, process = True)
+    del record.Resource_List["ngpus"]
+    formats = ("{id:10.10} {Resource_List[ncpus]:>6d} {etime:%m%dT%H%M}",
+               "{short_id:7.7} {Resource_List[ngpus]:5d} {Resource_List[mem]:8.2f} {eligible:%d-%H%M} 100%",
+               "{user!s:>10} {missing:>6.1f} {queue}")
+
+    for fmt_spec in formats:
+        expected = qhist.FillFormatter(fill_value = "-").format(fmt_spec, **vars(record))
+        assert qhist.RowRenderer(fmt_spec)(vars(record)) == expected
+
+def test_json_writer(monkeypatch):
+    record = PbsRecord(data, process = True)
+    stream = io.StringIO()
+    writer = qhist.JsonWriter(stream)
+    writer.begin()
+    writer.write(record)
+    writer.write(record)
+    writer.end()
+    document = json.loads(stream.getvalue())
+    assert list(document["Jobs"]) == [record.id]
+    legacy = textwrap.indent(qhist.json_output(record)[2:-2], "    ")
+    assert stream.getvalue().split("\n", 3)[3] == legacy + ",\n" + legacy + "\n    }\n}\n"
+
+    lines = []
+
+    for encoder in (qhist.orjson, None):
+        monkeypatch.setattr(qhist, "orjson", encoder)
+        stream = io.StringIO()
+        qhist.JsonWriter(stream, ndjson = True).write(record)
+        lines.append(stream.getvalue())
+
+    assert lines[0] == lines[1] and lines[0].count("\n") == 1
+    assert json.loads(lines[0])["id"] == record.id
@@ -0,0 +1,8 @@
+from qhist import qhist
+
+def test_parallel_order(log_files, record_opts):
+    record_opts = record_opts()
+    serial = [[job.id for job in jobs] for jobs in qhist.get_daily_records(log_files, record_opts)]
+    parallel = [[job.id for job in jobs] for jobs in qhist.get_daily_records(log_files, record_opts, processes = 2)]
+    assert parallel == serial
+    assert len(serial) == 3 and len(serial[0]) == 5
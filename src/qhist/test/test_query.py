@@ -0,0 +1,19 @@
+import pytest
+from qhist import qhist
+
+def test_query(log_files, log_config):
+    config = log_config()
+
+    jobs = list(qhist.query(period = "20250329-20250331", events = "ER", filters = { "user" : "vanderwb" }, config = config))
+    assert len(jobs) == 12 and all(job.user == "vanderwb" for job in jobs)
+
+    jobs = list(qhist.query(period = "20250331", filters = { "waittime" : (">", 0.002) }, expression = "numcpus >= 1",
+                            sort_by = "elapsed", reverse = True, config = config))
+    assert [job.short_id for job in jobs] == ["4215034", "4215033"]
+
+    batches = list(qhist.query(period = "20250329-20250331", fields = ["id", "numcpus"], batch_size = 5, config = config))
+    assert [len(batch["id"]) for batch in batches] == [5, 5, 2]
+    assert batches[0]["numcpus"] == [1, 1, 5, 1, 1]
+
+    with pytest.raises(ValueError):
+        qhist.query(expression = "user ~", config = config)
@@ -0,0 +1,39 @@
+import pickle
+from qhist import qhist
+from qhist.records import CompactRecord, expand_fields
+
+def test_lazy_records(log_files, record_opts):
+    record_opts = record_opts("ERS")
+    full = list(qhist.read_log(log_files[0], **record_opts))
+    fields = expand_fields(["user", "waittime", "Resource_List[ncpus]", "resources_used[avgcpu]"])
+    lazy = list(qhist.read_log(log_files[0], fields = fields, **record_opts))
+
+    for full_job, lazy_job in zip(full, lazy):
+        assert "ctime" not in vars(lazy_job)
+        assert lazy_job.waittime == full_job.waittime
+        assert lazy_job.Resource_List["ncpus"] == full_job.Resource_List["ncpus"]
+        assert lazy_job.Resource_List["mem"] == full_job.Resource_List["mem"]
+        assert lazy_job.ctime == full_job.ctime
+        assert vars(lazy_job).keys() >= vars(full_job).keys()
+        assert all(vars(lazy_job)[k] == v for k, v in vars(full_job).items())
+
+    assert len(full) == len(lazy) == 10
+
+def test_compact_records(log_files, record_opts):
+    record_opts = record_opts()
+    full = list(qhist.read_log(log_files[0], **record_opts))
+    compact = pickle.loads(pickle.dumps([CompactRecord(job) for job in full]))
+    render_row = qhist.RowRenderer(qhist.QhistConfig(time_format = "h").table_format_data["wide"])
+
+    for full_job, compact_job in zip(full, compact):
+        assert compact_job.to_dict() == { k : v for k, v in vars(full_job).items() if k != "_raw_record" }
+        assert render_row(compact_job) == render_row(vars(full_job))
+        assert qhist.get_json_dict(compact_job) == qhist.get_json_dict(full_job)
+        assert compact_job.get_nodes() == full_job.get_nodes()
+
+    assert compact[0]._layout is compact[1]._layout
+
+    fields = expand_fields(["user"])
+    lazy = [CompactRecord(job) for job in qhist.read_log(log_files[0], fields = fields, **record_opts)]
+    assert [job.Resource_List["mem"] for job in lazy] == [job.Resource_List["mem"] for job in full]
+    assert [job.ctime for job in lazy] == [job.ctime for job in full]
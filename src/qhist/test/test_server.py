@@ -0,0 +1,74 @@
+import pytest, os, shutil, threading
+from qhist import qhist, server
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+@pytest.fixture
+def qhistd(tmp_path):
+    log_path = tmp_path / "logs"
+    log_path.mkdir()
+    shutil.copy(testdata, str(log_path / "20250329"))
+    socket_path = str(tmp_path / "qhistd.sock")
+    service = server.QhistServer(socket_path, server.RecordStore(str(log_path), max_days = 2))
+    thread = threading.Thread(target = service.serve_forever, daemon = True)
+    thread.start()
+    yield service, socket_path, log_path
+    service.shutdown()
+    service.server_close()
+
+def test_server_query(qhistd, record_opts):
+    service, socket_path, log_path = qhistd
+    record_filter = qhist.RecordFilter("E", data_filters = [(False, qhist.operator.eq, "queue", "htc")])
+    record_opts = dict(record_opts(), record_filter = record_filter)
+    local = qhist.get_log_records(str(log_path / "20250329"), record_opts)
+    served, = server.query_server(socket_path, ["20250329"], record_filter, time_divisor = 3600.0)
+    public = lambda jobs: [{ k : v for k, v in vars(job).items() if not k.startswith("_") } for job in jobs]
+
+    assert public(served) == public(local) != []
+
+def test_server_tail(qhistd):
+    service, socket_path, log_path = qhistd
+    data_file = str(log_path / "20250329")
+
+    with open(data_file) as f:
+        lines = f.readlines()
+
+    with open(data_file, "w") as f:
+        f.writelines(lines[:10])
+
+    record_filter = qhist.RecordFilter("ER")
+    first = [job.id for jobs in server.query_server(socket_path, ["20250329"], record_filter) for job in jobs]
+
+    with open(data_file, "a") as f:
+        f.writelines(lines[10:])
+
+    second = [job.id for jobs in server.query_server(socket_path, ["20250329"], record_filter) for job in jobs]
+    day = service.store.days[("20250329", 1.0)]
+
+    assert len(second) > len(first) and second[:len(first)] == first
+    assert day.offset == os.path.getsize(data_file)
+
+def test_server_timeout(qhistd, log_config, monkeypatch, capsys):
+    service, socket_path, log_path = qhistd
+    shutil.copy(testdata, str(log_path / "20250330"))
+    store_get, release = service.store.get, threading.Event()
+
+    # The service hangs while reading the second day
+    def get(log_date, time_divisor = 1.0):
+        if log_date == "20250330":
+            release.wait()
+
+        return store_get(log_date, time_divisor)
+
+    monkeypatch.setattr(service.store, "get", get)
+    config = log_config(pbs_log_path = str(log_path), server_socket = socket_path, server_timeout = 0.2)
+
+    try:
+        jobs = [job.id for job in qhist.query(period = "20250329-20250330", config = config)]
+        local = [job.id for job in qhist.query(period = "20250329-20250330", config = config, use_server = False)]
+    finally:
+        release.set()
+
+    assert jobs == local and len(jobs) == 8
+    assert list(service.store.days) == [("20250329", 3600.0)]
+    assert "did not respond" in capsys.readouterr().err
@@ -0,0 +1,17 @@
+import pytest, random
+from qhist.sorting import sort_records
+from types import SimpleNamespace
+
+records = [SimpleNamespace(id = n, resources_used = { "mem" : random.random() }) for n in range(1000)]
+records[10].resources_used = {}
+
+def test_external_sort(tmp_path):
+    output = list(sort_records(iter(records), "resources_used[mem]", memory_limit = 0.01, temp_dir = str(tmp_path)))
+    expected = sorted(records[:10] + records[11:], key = lambda r: r.resources_used["mem"]) + [records[10]]
+    assert [r.id for r in output] == [r.id for r in expected]
+    assert list(tmp_path.iterdir()) == []
+
+def test_top_descending():
+    output = list(sort_records(iter(records), "resources_used[mem]", descending = True, top = 5))
+    expected = sorted(records[:10] + records[11:], key = lambda r: r.resources_used["mem"], reverse = True)[:5]
+    assert [r.id for r in output] == [r.id for r in expected]
@@ -0,0 +1,29 @@
+import os, shutil
+from qhist import qhist
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+def test_log_sources(log_config, tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+
+    shutil.copy(testdata, str(tmp_path / "a" / "20250330"))
+    shutil.copy(testdata, str(tmp_path / "a" / "20250331"))
+
+    # The second source logs the same jobs 20 minutes later
+    with open(testdata) as f, open(str(tmp_path / "b" / "20250331"), "w") as b:
+        for line in f:
+            time_stamp = qhist.datetime.datetime.strptime(line[:19], "%m/%d/%Y %H:%M:%S")
+            b.write((time_stamp + qhist.datetime.timedelta(minutes = 20)).strftime("%m/%d/%Y %H:%M:%S") + line[19:])
+
+    config = log_config(pbs_log_sources = { name : { "pbs_log_path" : str(tmp_path / name) } for name in ("a", "b") })
+    assert [source[2] for source in config.get_log_sources()] == ["20250330", "20250331"]
+
+    for reverse in (False, True):
+        jobs = [(job.source, job.short_id) for job in qhist.query(period = "20250331", reverse = reverse, config = config)]
+        expected = [("a", "4215033"), ("a", "4215034"), ("b", "4215033"), ("b", "4215034"),
+                    ("a", "4215265"), ("a", "4215065"), ("b", "4215265"), ("b", "4215065")]
+        assert jobs == (expected[::-1] if reverse else expected)
+
+    jobs = list(qhist.query(period = "20250330-20250331", expression = "source == b", config = config, processes = 1))
+    assert len(jobs) == 4 and all(job.source == "b" for job in jobs)
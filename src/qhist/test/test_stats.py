@@ -0,0 +1,83 @@
+import pytest, random, os, sys, datetime
+from qhist import qhist
+from qhist.stats import QuantileSketch, GroupAggregator, NodeAggregator, UtilizationSeries, get_interval
+from types import SimpleNamespace
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+def test_quantile_sketch():
+    values = [random.lognormvariate(0, 2) for _ in range(10000)]
+    first, second = QuantileSketch(), QuantileSketch()
+
+    for n, value in enumerate(values):
+        (first if n % 2 else second).add(value)
+
+    first.merge(second)
+    values.sort()
+
+    for q in (0.1, 0.5, 0.95):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(first.quantile(q) - exact) <= 0.02 * exact
+
+def test_group_aggregator():
+    jobs = [SimpleNamespace(account = a, Resource_List = { "ncpus" : n }, resources_used = { "walltime" : w })
+                for a, n, w in (("A", 4, 2.0), ("B", 1, 1.0), ("A", 2, 0.5), ("B", 8, None))]
+    aggregator = GroupAggregator(["account"], ["count", "sum(ncpus*walltime)", "max(ncpus)", "mean(walltime)"],
+                                 lambda f: { "ncpus" : "Resource_List[ncpus]", "walltime" : "resources_used[walltime]" }.get(f, f))
+
+    for job in jobs:
+        aggregator.add(job)
+
+    assert list(aggregator.results()) == [(("A",), [2, 9.0, 4, 1.25]), (("B",), [2, 1.0, 8, 1.0])]
+
+def test_node_aggregator():
+    jobs = list(qhist.read_log(testdata, process = True, record_filter = qhist.RecordFilter("E"), time_divisor = 60.0))
+    aggregator, selected = NodeAggregator(60.0), NodeAggregator(60.0, ["crhtc65", "crhtc82"])
+
+    for job in jobs + jobs:
+        aggregator.add(job)
+        selected.add(job)
+
+    results = { key[0] : values for key, values in aggregator.results() }
+    assert sorted(results) == ["crhtc65", "crhtc72", "crhtc82", "crhtc86"]
+    assert results["crhtc65"] == [2, 0.0, 2] and results["crhtc82"][0::2] == [2, 0]
+    assert results["crhtc82"][1] == pytest.approx(2 * 2007 / 3600)
+    assert [key for key, _ in selected.results()] == [("crhtc65",), ("crhtc82",)]
+
+def test_node_report_hosts(log_files, log_config, monkeypatch, capsys):
+    log_config()
+    monkeypatch.setenv("QHIST_SERVER_CONFIG", os.path.join(os.path.dirname(log_files[0]), "server.json"))
+    args = qhist.get_parser().parse_args(["-p", "20250329-20250331", "--node-report", "-H", "crhtc65,crhtc86"])
+    qhist.run(args)
+
+    rows = capsys.readouterr().out.splitlines()[2:]
+    assert [row.split()[:2] for row in rows] == [["crhtc65", "3"], ["crhtc86", "3"]]
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_utilization_series(use_numpy, monkeypatch):
+    if not use_numpy:
+        monkeypatch.setitem(sys.modules, "numpy", None)
+
+    day = datetime.datetime(2025, 3, 31)
+    series = UtilizationSeries(get_interval("15m"))
+    jobs = []
+
+    for _ in range(200):
+        start = day + datetime.timedelta(seconds = random.randint(-7200, 86000))
+        end = start + datetime.timedelta(seconds = random.randint(0, 20000))
+        end = min(max(end, day), day + datetime.timedelta(seconds = 86399))
+        jobs.append(SimpleNamespace(start = start, end = end, Resource_List = { "ncpus" : random.randint(1, 128), "nodect" : 1 }))
+        series.add(jobs[-1])
+
+    results = list(series.results())
+    assert len(results) == 96 and results[0][0] == ("2025-03-31T00:00",)
+
+    for n in (0, 40, 95):
+        bin_start = day + datetime.timedelta(minutes = 15 * n)
+        bin_end = bin_start + datetime.timedelta(minutes = 15)
+        overlaps = [max((min(j.end, bin_end) - max(j.start, bin_start)).total_seconds(), 0) / 900 for j in jobs]
+        expected = [sum(overlaps), sum(o * j.Resource_List["ncpus"] for o, j in zip(overlaps, jobs)), 0.0, sum(overlaps)]
+        assert results[n][1] == pytest.approx(expected, abs = 1e-6)
+
+    with pytest.raises(ValueError):
+        get_interval("15x")
@@ -0,0 +1,27 @@
+import os, gzip
+from qhist import qhist
+from qhist.timing import QueryTimer, STAGES
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+def test_query_timer(log_config, tmp_path):
+    with open(testdata) as f:
+        lines = f.readlines()
+
+    # Each log holds the records of its own day, and the first is compressed
+    for data_date, open_log in (("0329", gzip.open), ("0330", open), ("0331", open)):
+        log_name = "2025" + data_date + (".gz" if open_log is gzip.open else "")
+
+        with open_log(str(tmp_path / log_name), "wt") as f:
+            f.writelines(data_date[:2] + "/" + data_date[2:] + line[5:] for line in lines)
+
+    config = log_config()
+
+    for processes in (1, 2):
+        timer = QueryTimer()
+        jobs = list(timer.count_emitted(qhist.query(period = "20250329-20250331", filters = { "user" : "vanderwb" },
+                                                    config = config, processes = processes, timer = timer)))
+        summary = timer.get_summary()
+        assert len(jobs) == 9 and set(summary["stages"]) == set(STAGES) | {"total"}
+        assert [(os.path.basename(f["file"]), f["lines"], f["matched"], f["emitted"]) for f in summary["files"]] == \
+                    [("20250329.gz", 18, 3, 3), ("20250330", 18, 3, 3), ("20250331", 18, 3, 3)]
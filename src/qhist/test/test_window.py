@@ -0,0 +1,21 @@
+import os
+from qhist import qhist
+
+testdata = os.path.join(os.path.dirname(__file__), "testdata")
+
+def test_time_window():
+    with open(testdata) as f:
+        lines = [line.rstrip("\n") for line in f]
+
+    # Windows that start and end on repeated, missing, and out-of-range times
+    for window in (("103000", "105923"), ("105923", "110546"), ("110000", "110500"), ("113935", "120000")):
+        time_filter = [qhist.datetime.datetime.strptime("20250331" + t, "%Y%m%d%H%M%S") for t in window]
+        bounds = ["20250331 {}:{}:{}".format(t[0:2], t[2:4], t[4:6]) for t in window]
+        expected = [line for line in lines if bounds[0] <= qhist.get_line_time(line) <= bounds[1]]
+
+        with qhist.open_time_window(testdata, time_filter) as log_window:
+            assert [line.rstrip("\n") for line in log_window] == expected
+
+        with qhist.open_time_window(testdata, time_filter, reverse = True) as log_window:
+            log_window.block_size = 100
+            assert list(log_window) == expected[::-1]
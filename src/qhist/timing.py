@@ -0,0 +1,198 @@
+"""
+Timing instrumentation for qhist queries
+
+A QueryTimer collects the wall time spent in each stage of a query (loading the
+configuration, reading logs, parsing records, filtering, and writing output)
+along with counters for each daily log: bytes read, lines scanned, records
+matched by the filters, and records emitted to the output. Timing is opt-in;
+logs are read by the uninstrumented code path unless a timer is given.
+"""
+
+import sys, os, json, time
+
+from .logs import find_log_file
+
+# Constants
+STAGES = ("config", "setup", "read", "parse", "filter", "output")
+FILE_COUNTERS = ("bytes", "lines", "matched", "emitted")
+FILE_TIMES = ("read", "parse", "filter")
+
+#
+## Classes
+#
+
+class QueryTimer:
+    """Per-stage wall times and per-file counters for a single query
+
+    Reading, parsing, and filtering are timed for each daily log as records are
+    consumed, so the output stage is the remainder of the time spent writing
+    jobs (including sorting and parsing attributes on first access). When logs
+    are read by parallel workers, file times are those of the workers.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.files = {}
+        self.emitted = {}
+        self.log_paths = {}
+        self.date_format = "%Y%m%d"
+        self.log_files = {}
+
+    def set_logs(self, log_paths, date_format):
+        """Set the log directory of each log source, to find the log of a record
+
+        Args:
+            log_paths (dict): Log directories keyed by source name (None if the
+                              logs are not from a named source)
+            date_format (str): The format of daily log file names
+        """
+        self.log_paths, self.date_format = log_paths, date_format
+
+    def get_file_stats(self, data_file, source = "log"):
+        try:
+            return self.files[data_file]
+        except KeyError:
+            stats = dict(source = source, **dict.fromkeys(FILE_COUNTERS, 0), **dict.fromkeys(FILE_TIMES, 0.0))
+            return self.files.setdefault(data_file, stats)
+
+    def get_log_file(self, record):
+        """Return the daily log containing a record, from its source and time stamp
+
+        The log is found as it was read, so records from a compressed log are
+        counted against that file.
+        """
+        # Records without a named source would be parsed in full by the lookup
+        source = None if None in self.log_paths else getattr(record, "source", None)
+        log_key = (source, record.time.date())
+
+        try:
+            return self.log_files[log_key]
+        except KeyError:
+            data_file = find_log_file(os.path.join(self.log_paths.get(log_key[0], ""), log_key[1].strftime(self.date_format)))
+            return self.log_files.setdefault(log_key, data_file)
+
+    def time_records(self, lines, data_file, Record, process = False, record_filter = None, time_divisor = 1.0,
+                     reverse = False, source = None):
+        """Yield the matching records of a log like read_log does, timing each stage
+
+        Time spent by the consumer between records is not counted.
+        """
+        stats = self.get_file_stats(data_file)
+        clock = time.perf_counter
+        read_time = parse_time = filter_time = 0.0
+        num_bytes = num_lines = matched = 0
+
+        # Lines read in reverse do not include the newline
+        line_end = 1 if reverse else 0
+
+        try:
+            start = clock()
+
+            for line_number, record in enumerate(lines):
+                read = clock()
+                read_time += read - start
+                num_lines += 1
+                num_bytes += len(record) + line_end
+
+                if record_filter and not record_filter.check_line(record):
+                    start = clock()
+                    filter_time += start - read
+                    continue
+
+                checked = clock()
+                event = Record(record, process, time_divisor = time_divisor, location = line_number)
+                parsed = clock()
+                parse_time += parsed - checked
+
+                if source:
+                    event.source = source
+
+                keep = not record_filter or record_filter(event)
+                start = clock()
+                filter_time += (checked - read) + (start - parsed)
+
+                if keep:
+                    matched += 1
+                    yield event
+                    start = clock()
+        finally:
+            stats["read"] += read_time
+            stats["parse"] += parse_time
+            stats["filter"] += filter_time
+            stats["bytes"] += num_bytes
+            stats["lines"] += num_lines
+            stats["matched"] += matched
+
+    def time_cached(self, data_file, load):
+        """Time loading the records of a log from the record cache, and count matches"""
+        stats = self.get_file_stats(data_file, "cache")
+        start = time.perf_counter()
+        records = load()
+        stats["read"] += time.perf_counter() - start
+
+        for record in records:
+            stats["matched"] += 1
+            yield record
+
+    def count_served(self, records):
+        """Count the records returned by the qhistd service for each log"""
+        for record in records:
+            self.get_file_stats(self.get_log_file(record), "server")["matched"] += 1
+            yield record
+
+    def count_emitted(self, records):
+        """Count the records passed on to the output for each log"""
+        emitted = self.emitted
+
+        for record in records:
+            data_file = self.get_log_file(record)
+            emitted[data_file] = emitted.get(data_file, 0) + 1
+            yield record
+
+    def get_summary(self):
+        """Return the stage times and file statistics, with the output stage net of reading"""
+        stages = dict(self.stages)
+
+        for name in FILE_TIMES:
+            stages[name] = sum(stats[name] for stats in self.files.values())
+
+        stages["output"] = max(stages["output"] - sum(stages[name] for name in FILE_TIMES), 0.0)
+        stages["total"] = time.perf_counter() - self.start
+
+        for data_file, count in self.emitted.items():
+            self.get_file_stats(data_file, "-")["emitted"] = count
+
+        files = [dict(file = data_file, **stats) for data_file, stats in sorted(self.files.items())]
+
+        return { "stages" : stages, "files" : files }
+
+    def report(self, mode = "text", file = None):
+        """Print the summary to stderr, as a table or as JSON"""
+        file = file or sys.stderr
+        summary = self.get_summary()
+
+        if mode == "json":
+            print(json.dumps(summary, indent = 4), file = file)
+            return
+
+        print("Stage        Time (s)", file = file)
+
+        for name, seconds in summary["stages"].items():
+            print("{:10} {:>10.3f}".format(name, seconds), file = file)
+
+        if summary["files"]:
+            print("\n{:16} {:6} {:>11} {:>9} {:>9} {:>9} {:>8} {:>8} {:>8}".format("Log", "Source", "Bytes", "Lines",
+                  "Matched", "Emitted", "Read", "Parse", "Filter"), file = file)
+
+            source_names = { log_path : name for name, log_path in self.log_paths.items() if name }
+
+            for stats in summary["files"]:
+                log_path, log_name = os.path.split(stats["file"])
+
+                if log_path in source_names:
+                    log_name = "{}/{}".format(source_names[log_path], log_name)
+
+                print("{:16} {:6} {:>11} {:>9} {:>9} {:>9} {:>8.3f} {:>8.3f} {:>8.3f}".format(log_name,
+                      stats["source"], stats["bytes"], stats["lines"], stats["matched"], stats["emitted"],
+                      stats["read"], stats["parse"], stats["filter"]), file = file)